@@ -3,16 +3,94 @@ import calendar
 import json
 import os
 import sys
+import threading
 from dotenv import load_dotenv
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from modules import auth, ingest, process, utils
+from modules import archive, auth, conflicts, ingest, model, outbound, outbox, process, sent_index, utils
 
 date = datetime(2024, 7, 30)
 # dateTo = datetime(2023, 11, 21, 23, 59, 59, 999)
 
 env_path = utils.get_env_path()
 
+WARM_UP_TIMEOUT = 30  # Maximum time, in seconds, a Fetch waits for the background warm-up to finish
+
+# Background thread running warm_up(), started by the GUI at application start
+_warm_up_thread = None
+
+# Bookings of the missions of the last fetch, indexed as they were fetched (see `check_conflicts`)
+_conflict_index = None
+
+def warm_up():
+    """
+    Prepares the authentication and network connections needed by the first Fetch.
+
+    This function validates the PlanningPME bearer token with a lightweight request and re-authenticates if it was
+    rejected, refreshes the Microsoft Graph access token and resolves the user name, and sets up the SharePoint client
+    context. All requests go through the shared HTTP session, so that the connections to PlanningPME and Graph stay
+    open in its pool and can be reused by the first Fetch.
+
+    The interactive Microsoft login is never started from here: when no refresh token is stored yet, or when the
+    refresh token is rejected, the warm-up fails and the login is left to the first Fetch, as before.
+
+    Returns:
+    - None
+    """
+    load_dotenv(env_path, override=True)
+
+    # PlanningPME: validate the bearer token and open the connection
+    response = ingest.get_categories()
+    if response.status_code == 401:
+        auth.authenticate_to_ppme()
+        ingest.get_categories()
+
+    # Microsoft Graph: refresh the access token, resolve the user name and open the connection
+    if os.environ.get('MS_REFRESH_TOKEN'):
+        access_token = auth.refresh_access_token(interactive=False)
+        ingest.get_user_details(access_token)
+
+        # Bring the sent mission orders index up to date
+        sent_index.sync(access_token, interactive=False)
+
+    # SharePoint: set up the client context
+    auth.authenticate_to_shpt()
+
+    # Make the refreshed tokens and user name visible to the rest of the session
+    load_dotenv(env_path, override=True)
+
+def start_warm_up():
+    """
+    Starts warm_up() on a background thread, unless a warm-up is already running.
+
+    Errors raised during the warm-up are ignored: the first Fetch performs the same steps and reports them.
+    """
+    global _warm_up_thread
+    if _warm_up_thread and _warm_up_thread.is_alive():
+        return
+
+    def run():
+        try:
+            warm_up()
+        except Exception:
+            pass
+
+    _warm_up_thread = threading.Thread(target=run, daemon=True)
+    _warm_up_thread.start()
+
+def wait_for_warm_up(timeout:float=WARM_UP_TIMEOUT):
+    """
+    Blocks until the background warm-up, if any, has finished, so that it does not race with a Fetch. A warm-up
+    stuck on a slow network is not waited for more than `timeout` seconds: the Fetch then performs the same steps,
+    the token refreshes and .env writes of both waiting for each other (see `auth.refresh_access_token` and
+    `utils.update_env_var`).
+    """
+    if _warm_up_thread:
+        _warm_up_thread.join(timeout)
+
 def fetch_and_store(date:datetime = None, departments:list=None, progress_callback=None):
+    global _conflict_index
+    _conflict_index = None  # Until the new missions are stored
+    wait_for_warm_up()
     load_dotenv(env_path)
     if not os.environ.get('MS_USER_NAME'):
         utils.init_user()
@@ -47,20 +125,25 @@ def fetch_and_store(date:datetime = None, departments:list=None, progress_callba
         if progress_callback:
             progress_callback(mapped_progress)
 
-    # Clean missions.json
+    # Clean missions.json, indexing the bookings of the missions as they come
     missions = process.clean_data(missions)
+    conflict_index = conflicts.ConflictIndex()
+    for mission in missions:
+        conflict_index.add(mission)
 
-    # Download mission attachments from SharePoint
+    # Download mission attachments from SharePoint, or link the ones above the size threshold
     access_token = os.environ.get('MS_ACCESS_TOKEN')
+    link_threshold_mb = os.environ.get('ATTACHMENT_LINK_THRESHOLD_MB')
+    link_threshold = int(float(link_threshold_mb) * 1024 * 1024) if link_threshold_mb else None
     try:
-        missions = ingest.download_sharepoint_file(missions, access_token, 5, 30, adjusted_progress)
+        missions = ingest.download_sharepoint_file(missions, access_token, 5, 30, adjusted_progress, link_threshold)
     except ValueError:
         try:
             access_token = auth.refresh_access_token()
-            missions = ingest.download_sharepoint_file(missions, access_token, 5, 30, adjusted_progress)
+            missions = ingest.download_sharepoint_file(missions, access_token, 5, 30, adjusted_progress, link_threshold)
         except ValueError:
             access_token = auth.authenticate_to_ms_graph()
-            missions = ingest.download_sharepoint_file(missions, access_token, 5, 30, adjusted_progress)
+            missions = ingest.download_sharepoint_file(missions, access_token, 5, 30, adjusted_progress, link_threshold)
 
     current_progress = 30  # Increment to 30% after cleaning data and downloading attachments
 
@@ -68,6 +151,13 @@ def fetch_and_store(date:datetime = None, departments:list=None, progress_callba
     current_progress = 90  # After get_locations, we're at 90%
 
     utils.save_to_json('temp/missions.json', missions)
+    _conflict_index = conflict_index
+    warning = None
+    try:
+        archive.archive_missions(missions, dateFrom, depts)  # Keep the history of the missions, which './temp' does not
+    except Exception as error:
+        # The archive is only used by the analytics: it must not fail the fetch, but the planner is told it is incomplete
+        warning = f"The missions could not be added to the archive: {error}"
 
     current_progress += 5  # Increment by 5% after writing missions data
     if progress_callback:
@@ -84,8 +174,9 @@ def fetch_and_store(date:datetime = None, departments:list=None, progress_callba
     if progress_callback:
         # progress_callback(current_progress)
         progress_callback(100)  # Ensure completion is signaled correctly
+    return warning
 
-def generate(keys:list[str], progress_callback=None):
+def generate(keys:list[str], progress_callback=None, force:bool=False):
     """
     Generates PDFs based on the missions and sources data stored in JSON files.
     
@@ -93,70 +184,287 @@ def generate(keys:list[str], progress_callback=None):
     passes this data to the process.generate_pdfs() function to generate PDF documents.
     These documents are intended to provide a printable format of the missions and sources
     for review or archival purposes.
+    With the GENERATE_MAX_WORKERS setting above 1, the PDFs are generated by a pool of processes
+    (see `generate_max_workers`). With the PDF_RENDERER setting set to 'canvas', the fixed layout of the
+    mission orders is drawn directly on the canvas, which is faster than Platypus. With the PDF_BUNDLE
+    setting, one PDF is generated per agent and day with all their mission orders, and split back into
+    the PDFs of the missions. With the PDF_PROFILE setting set to 'compact', the PDFs are made smaller
+    (see `process._pdf_profile`). Only the PDFs whose mission or sources changed since they were last
+    generated are rebuilt, unless `force` is set.
     
     Parameters:
-    - date (datetime, optional): The specific date for which to generate PDFs. Currently not used
-      in the function but can be implemented for filtering or specifying the data range in future enhancements.
+    - keys (list): The keys of the missions selected in the GUI.
+    - progress_callback (function, optional): A callback function receiving the progress, from 0 to 100.
+    - force (bool, optional): Whether to regenerate the PDFs that are up to date. Defaults to False.
     
     Returns:
-    - None. This function does not return any value but triggers the PDF generation process.
+    - str: The size of the PDFs and their reduction with the compact profile (see `process.profile_summary`), or None.
+      An exception listing the mission orders that could not be generated is raised once all the others are done.
     """
+    load_dotenv(env_path)
     if progress_callback:
         progress_callback(0)  # Start with 0% progress
 
-    with open('temp/missions.json', 'r') as file1, \
-         open('temp/sources.json', 'r') as file2:
-        missions = json.load(file1)
-        sources = json.load(file2)
+    missions = model.load_missions('temp/missions.json')
+    with open('temp/sources.json', 'r') as file:
+        sources = json.load(file)
+
+    max_workers = generate_max_workers()
+    renderer, profile = pdf_renderer(), pdf_profile()
 
     # Feed data into process.generate_pdfs() to generate PDF documents containing the missions details
-    process.generate_pdfs(missions, sources, keys)    
+    bundle = pdfs_bundled()
+    if bundle:
+        results = process.generate_bundles(missions, sources, keys, progress_callback, max_workers, force, renderer, split=True,
+                                           profile=profile)
+    else:
+        results = process.generate_pdfs(missions, sources, keys, progress_callback, max_workers, force, renderer, profile)
+
+    # Report the mission orders that could not be generated
+    failed = {key: error for key, error in results.items() if error}
+    if failed:
+        details = "\n".join(f"• n°{key}: {error}" for key, error in failed.items())
+        raise Exception(f"{len(failed)} of {len(results)} mission orders could not be generated:\n\n{details}")
+
+    # Measure the size of the generated PDFs, and its reduction with the compact profile
+    if bundle:
+        generated = [(bundle, process.bundle_path(bundle)) for bundle in process.agent_bundles(missions, keys)]
+    else:
+        generated = [(mission, process.pdf_path(mission)) for mission in missions if mission.get('key') in results]
+    generated = [(sample, os.path.getsize(path)) for sample, path in generated if os.path.exists(path)]
+    summary = process.profile_summary([size for _, size in generated], generated[0][0] if generated else None, sources,
+                                      renderer, profile, bundle)
 
     if progress_callback:
         progress_callback(100)  # Ensure completion is signaled correctly
+    return summary
+
+def find_already_sent(keys:list[str], progress_callback=None) -> tuple:
+    """
+    Returns the keys of the selected missions whose mission order was already sent.
 
-def send(keys:list[str], progress_callback=None):
+    The mission order emails are built, and their attachments hashed, only once for both lookups: the fingerprints
+    are compared with the ones recorded in the outbox, and the recipients are looked up in the local sent mission
+    orders index (kept up to date at start-up and after every send), without any Graph call.
+
+    Returns:
+    - tuple: The keys of the missions whose mission order did not change since it was last delivered, and the keys of
+      the missions whose mission order was already delivered to the same recipients.
+    """
     load_dotenv(env_path)
     if progress_callback:
         progress_callback(0)  # Start with 0% progress
 
-    with open('temp/missions.json', 'r') as file:
-        missions = json.load(file)
+    missions = model.load_missions('temp/missions.json')
+    with open('temp/sources.json', 'r') as file:
+        sources = json.load(file)
+
+    last_fingerprints = outbox.delivered_fingerprints()
+    delivered = sent_index.load()
+    messages = process.build_om_messages(missions, keys, os.environ.get('MS_USER_NAME'), sources=sources)
+    unchanged_keys = [key for message in messages for key, fingerprint in message['fingerprints'].items()
+                      if last_fingerprints.get(key) == fingerprint]
+    delivered_keys = [key for message in messages if sent_index.is_delivered(delivered, message) for key in message['keys']]
+
+    if progress_callback:
+        progress_callback(100)  # Ensure completion is signaled correctly
+    return unchanged_keys, delivered_keys
+
+def generate_max_workers() -> int:
+    """
+    Returns the number of processes generating the PDFs, from the GENERATE_MAX_WORKERS setting: 1 (default) generates
+    them in the application's process. The pool is opt-in: every worker process starts by importing ReportLab and the
+    other libraries again, which takes longer than generating a typical day of mission orders one after another.
+    """
+    return max(1, int(os.environ.get('GENERATE_MAX_WORKERS') or 1))
+
+def pdf_renderer() -> str:
+    """
+    Returns the engine rendering the mission orders, from the PDF_RENDERER setting: 'platypus' (default) or 'canvas'.
+    """
+    return 'canvas' if os.environ.get('PDF_RENDERER', '').lower() == 'canvas' else 'platypus'
+
+def pdf_profile() -> str:
+    """
+    Returns the output profile of the mission orders, from the PDF_PROFILE setting: 'standard' (default) or 'compact'.
+    """
+    return 'compact' if os.environ.get('PDF_PROFILE', '').lower() == 'compact' else 'standard'
+
+def pdfs_bundled() -> bool:
+    """
+    Returns whether the PDF_BUNDLE setting is enabled: the mission orders of each agent are then bundled into a single
+    PDF per day, which is rendered in memory when they are sent.
+    """
+    load_dotenv(env_path)
+    return os.environ.get('PDF_BUNDLE', '').lower() in ('1', 'true', 'yes')
+
+def pdfs_in_memory() -> bool:
+    """
+    Returns whether the PDF_IN_MEMORY setting is enabled: the mission orders are then rendered in memory when they
+    are sent, instead of being read back from './generated'.
+    """
+    load_dotenv(env_path)
+    return os.environ.get('PDF_IN_MEMORY', '').lower() in ('1', 'true', 'yes')
+
+def send(keys:list[str], progress_callback=None, skip_delivered:bool=False, changed_only:bool=False):
+    """
+    Sends the mission orders of the selected missions through the outbox.
+
+    One outbox job is enqueued per mission, with a copy of its attachments and the fingerprint of its content, and the
+    outbox is then drained. If the send is interrupted, the jobs that did not go out stay in the outbox and can be
+    resumed with `resume_send`.
+    With `skip_delivered`, the mission orders already delivered to the same recipients are not sent again. With
+    `changed_only`, the mission orders whose content did not change since they were last delivered are not sent again.
+    With the SEND_GROUP_BY_AGENT setting, each agent receives a single email with all their mission orders of the day.
+    With the SEND_OPTIMIZE_ATTACHMENTS setting, photos and large PDFs are downscaled/recompressed before being sent.
+    With the PDF_IN_MEMORY setting, the PDFs are rendered in memory and handed straight to the outbox; they are saved
+    to './generated' in the background, for archiving and preview only.
+    With the PDF_BUNDLE setting, each agent receives a single email per day with the bundle of all their mission
+    orders, rendered in memory.
+
+    Returns:
+    - str: The size of the PDFs rendered in memory and their reduction with the compact profile (see
+      `process.profile_summary`), or None.
+    """
+    load_dotenv(env_path)
+    if progress_callback:
+        progress_callback(0)  # Start with 0% progress
+
+    missions = model.load_missions('temp/missions.json')
+    with open('temp/sources.json', 'r') as file:
+        sources = json.load(file)
 
     name = os.environ.get('MS_USER_NAME')
+    delivered = sent_index.load() if skip_delivered else None
+    last_fingerprints = outbox.delivered_fingerprints() if changed_only else None
+    bundle = pdfs_bundled()
+    in_memory = bundle or pdfs_in_memory()
+
+    # Leave the mission orders already sent out before rendering their PDFs: their emails are built without the PDFs,
+    # which neither their recipients nor their fingerprints depend on
+    if in_memory and (delivered is not None or last_fingerprints is not None):
+        keys = [key for message in process.build_om_messages(missions, keys, name, delivered, sources=sources,
+                                                             last_fingerprints=last_fingerprints, bundle=bundle)
+                for key in message['keys']]
+        delivered = last_fingerprints = None
+
+    # Render the PDFs in memory, and send the mission orders whose PDF could be rendered
+    documents = None
+    summary = None
+    render_failed = {}
+    if in_memory and (keys is None or keys):
+        max_workers = generate_max_workers()
+        renderer, profile = pdf_renderer(), pdf_profile()
+        if bundle:
+            documents, rendered = process.render_bundles(missions, sources, keys, max_workers=max_workers,
+                                                         renderer=renderer, profile=profile)
+        else:
+            documents, rendered = process.render_pdfs(missions, sources, keys, max_workers=max_workers,
+                                                      renderer=renderer, profile=profile)
+        if bundle:
+            process.archive_bundles(process.agent_bundles(missions, keys), documents, sources, profile, renderer)
+        else:
+            process.archive_pdfs(missions, documents, sources, profile, renderer)
+        render_failed = {key: error for key, error in rendered.items() if error}
+        keys = [key for key in rendered if key not in render_failed]
+
+        # Measure the size of the rendered PDFs, and its reduction with the compact profile
+        if bundle:
+            samples = [agent_bundle for agent_bundle in process.agent_bundles(missions, keys) if agent_bundle['id'] in documents]
+        else:
+            samples = [mission for mission in missions if mission.get('key') in documents]
+        summary = process.profile_summary([len(document) for document in documents.values()], samples[0] if samples else None,
+                                          sources, renderer, profile, bundle)
     
-    process.send_om(missions, keys, name, progress_callback)
+    enqueue_failed = {}
+    if keys is None or keys:
+        group_by_agent = os.environ.get('SEND_GROUP_BY_AGENT', '').lower() in ('1', 'true', 'yes')
+        optimize_attachments = os.environ.get('SEND_OPTIMIZE_ATTACHMENTS', '').lower() in ('1', 'true', 'yes')
+        _, enqueue_failed = outbox.enqueue(process.build_om_messages(missions, keys, name, delivered, group_by_agent,
+                                                                     optimize_attachments, sources, last_fingerprints,
+                                                                     documents, bundle))
+    drain_outbox(progress_callback, render_failed, enqueue_failed)
+    return summary
+
+def resume_send(progress_callback=None):
+    """
+    Resumes an interrupted send: the jobs left in the outbox, including the failed ones, are sent again.
+    """
+    load_dotenv(env_path)
+    if progress_callback:
+        progress_callback(0)  # Start with 0% progress
+
+    outbox.retry_failed()
+    drain_outbox(progress_callback)
+
+def drain_outbox(progress_callback=None, render_failed:dict=None, enqueue_failed:dict=None):
+    max_workers = int(os.environ.get('SEND_MAX_WORKERS', outbound.MAX_CONCURRENT_REQUESTS))
+
+    batch = os.environ.get('SEND_BATCH', '').lower() in ('1', 'true', 'yes')
+
+    transport = outbound.get_transport(os.environ.get('OUTBOUND_TRANSPORT'))
+
+    results = outbox.drain(max_workers, progress_callback, batch, transport)
+
+    # Report the mission orders that could not be sent, once all the others went out
+    failed = {key: error for key, error in results.items() if error}
+    render_failed = render_failed or {}
+    enqueue_failed = enqueue_failed or {}
+    not_sent = len(render_failed) + len(enqueue_failed)
+    if failed or not_sent:
+        message = f"{len(failed) + not_sent} of {len(results) + not_sent} mission orders could not be sent:\n\n"
+        if render_failed:
+            details = "\n".join(f"• n°{key}: {error}" for key, error in render_failed.items())
+            message += f"{details}\n\nTheir PDF could not be generated.\n\n"
+        if enqueue_failed:
+            details = "\n".join(f"• n°{key}: {error}" for key, error in enqueue_failed.items())
+            message += f"{details}\n\nThey were not added to the outbox: generate them again, or check their attachments.\n\n"
+        if failed:
+            details = "\n".join(f"• n°{key}: {error}" for key, error in failed.items())
+            message += f"{details}\n\nThey are kept in the outbox, and will be proposed for sending again at the next send."
+        raise Exception(message.strip())
 
     if progress_callback:
         progress_callback(100)  # Ensure completion is signaled correctly
 
-def check_sources_conflicts():
-    with open('temp/missions.json', 'r') as file:
-        missions = json.load(file)
-        result = process.check_sources_double_bookings(missions)
-    return result
+def check_conflicts():
+    """
+    Returns the sources, vehicles, equipment and agents booked by several missions at overlapping times.
+
+    The conflicts of the missions fetched by this process were found as they were fetched (see `conflicts.ConflictIndex`),
+    the missions left in './temp' by a previous session are checked at once (see `conflicts.find_conflicts`).
+    """
+    if _conflict_index is not None:
+        return _conflict_index.conflicts()
+    missions = model.load_missions('temp/missions.json')
+    return conflicts.find_conflicts(missions)
 
 def generate_ADR_monthly_transports_list(date: datetime=datetime(2024, 7, 1)):
+    """
+    Generates the ADR transport register of the month of a date, as a PDF document and a CSV file
+    (see `process.generate_ADR_transport_list`). The locations of the RT missions are taken from the locations
+    cache when possible, instead of being queried one by one.
+    """
     monthrange = calendar.monthrange(date.year, date.month)
 
     dateFrom = date.replace(day=1)
-    dateTo = date.replace(day=monthrange[1])
+    dateTo = datetime.combine(date.replace(day=monthrange[1]), time(23, 59, 59, 999))  # Up to the end of the last day
 
     missions = ingest.get_events(dateFrom, dateTo)
     missions = process.clean_data(missions)
     rt_missions = process.filter_rt_missions(missions)
-    rt_missions = ingest.get_locations(rt_missions)
+    rt_missions = ingest.get_locations(rt_missions, cached=True)
     utils.save_to_json('temp/rt_missions.json', rt_missions)
     try:
         sources = ingest.get_sources()
     except:
         sources = ingest.get_sources()
-    process.generate_ADR_transport_list(rt_missions, sources)
+    process.generate_ADR_transport_list(rt_missions, sources, date)
     return rt_missions
 
 # fetch_and_store(date, ['South'])
 # generate(None)
 # send(None)
-# check_sources_conflicts()
+# check_conflicts()
 # get_sent_elements() 
 # generate_ADR_monthly_transports_list()
\ No newline at end of file
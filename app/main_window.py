@@ -1,8 +1,7 @@
 from PyQt6 import QtWidgets
 from PyQt6.QtGui import QStandardItemModel, QStandardItem, QColor, QAction
-from PyQt6.QtCore import QThread, pyqtSignal, Qt, QRect
+from PyQt6.QtCore import QThread, QTimer, pyqtSignal, Qt, QRect
 from PyQt6.QtWidgets import QProgressDialog, QMessageBox, QApplication, QStyle, QStyleOptionButton, QHeaderView
-from datetime import datetime
 from dotenv import load_dotenv
 import json
 import os
@@ -12,7 +11,7 @@ import sys
 from ui.ui_main_window import Ui_MainWindow
 from app import main
 from .credentials_dialog import CredentialsDialog
-from modules import utils
+from modules import model, outbox, process, utils
 
 class CheckBoxHeader(QHeaderView):
     checkStateChanged = pyqtSignal(bool)
@@ -77,6 +76,11 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
         self.menuEdit.addAction(self.actionCredentials)
         self.actionCredentials.triggered.connect(self.open_credentials_dialog)
 
+        self.actionRegenerate = QAction("Regenerate mission orders", self)
+        self.actionRegenerate.setShortcut("Ctrl+Shift+G")
+        self.menuEdit.addAction(self.actionRegenerate)
+        self.actionRegenerate.triggered.connect(lambda: self.generate_mission_orders(force=True))
+
         self.setupMissionTable() # Initialize the model for Mission tableView
         self.setupDepartmentTable() # Initialize the model for Department tableView
         self.current_task = None  # Add a variable to track the current task
@@ -86,13 +90,20 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
 
         # Connect buttons to functions
         self.fetchButton.clicked.connect(self.fetch_data)
-        self.genButton.clicked.connect(self.generate_mission_orders)
+        self.genButton.clicked.connect(lambda: self.generate_mission_orders())
         self.sendButton.clicked.connect(self.send_mission_orders)
         self.missionTableView.doubleClicked.connect(self.handleMissionDoubleClick)
 
         # self.cleanUpFolders()
         utils.init_folders()
 
+        # Validate tokens and open connections in the background while the planner picks a date
+        if utils.credentials_are_valid():
+            main.start_warm_up()
+
+        # Offer to resume a send that was interrupted during a previous session
+        QTimer.singleShot(0, self.offer_to_resume_send)
+
     def exception_hook(exctype, value, traceback):
         QtWidgets.QMessageBox.critical(None, "Error", str(value))
         sys.__excepthook__(exctype, value, traceback)  # Optionally, re-raise the error to stop the program
@@ -103,6 +114,8 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
         """Open the credentials dialog for user to fill in the credentials."""
         dialog = CredentialsDialog(self)
         dialog.exec()  # This will block until the dialog is closed
+        if utils.credentials_are_valid():
+            main.start_warm_up()
 
     def closeEvent(self, event):
         self.cleanUpFolders()
@@ -159,21 +172,14 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
         # Extract the mission key from the selected row
         mission_key = self.missionModel.item(index.row(), 5).text()  # Assuming column 5 has the mission key
         mission = None
-        with open('temp/missions.json', 'r') as file:
-            missions = json.load(file)
+        missions = model.load_missions('temp/missions.json')
         for data in missions:  # Assuming you store mission data somewhere accessible
-            if data['key'] == mission_key:
+            if data.key == mission_key:
                 mission = data
                 break
         
         if mission:
-            names = ""
-            for resource in mission.get('resources'):
-                names += resource['lastName'] + " " + resource['firstName'] + " - "
-            mission_start = datetime.strptime(mission['start'], '%Y-%m-%d %H:%M:%S')
-
-            day_missions = mission_start.strftime('%Y%m%d')  # Format the date
-            pdf_path = f"./generated/{day_missions}/{names}{mission['key']}.pdf"
+            pdf_path = process.pdf_path(mission)
             
             if os.path.exists(pdf_path):
                 # Open the PDF if it exists
@@ -247,7 +253,7 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
                     QStandardItem(item.get('SOnumber')),
                     QStandardItem(str(item.get('key'))),
                     QStandardItem(item.get('departurePlace')),
-                    QStandardItem(item.get('location')),
+                    QStandardItem(utils.plain_text(item.get('location'))),
                     QStandardItem(item.get('vehicle')),
                     QStandardItem(equipment_names),
                     QStandardItem(source_names),
@@ -288,12 +294,12 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
     def show_conflict_results(self, conflicts):
         # There are conflicts, show the detailed message and update the table
         self.load_data_to_mission_table("./temp/missions.json", conflicts)
-        sources = "\n".join(f"• {key}" for key in conflicts.keys())
-        message = f"The following sources are booked several times:\n\n{sources}\n\nCheck missions overview for more information"
+        resources = "\n".join(f"• {key}" for key in conflicts.keys())
+        message = f"The following resources are booked several times:\n\n{resources}\n\nCheck missions overview for more information"
         QtWidgets.QMessageBox.warning(self, "Conflicts found!", message)
 
     def assign_colors_to_conflicts(self, conflicts):
-        # Assign a unique color for each source
+        # Assign a unique color for each resource
         available_colors = ['lightsalmon', 'lightcoral', 'lightyellow', 'lightpink', 'lightblue', 'lightgrey']
         for key in conflicts.keys():
             if key not in self.conflict_colors:
@@ -305,17 +311,17 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
         self.assign_colors_to_conflicts(conflicts)
         for row in range(self.missionModel.rowCount()):
             item_key = self.missionModel.item(row, 5).text()  # Assuming key is in the sixth column
-            for source, missions in conflicts.items():
+            for resource, missions in conflicts.items():
                 if item_key in missions:
-                    color = QColor(self.conflict_colors[source])
+                    color = QColor(self.conflict_colors[resource])
                     for col in range(self.missionModel.columnCount()):
                         item = self.missionModel.item(row, col)
                         item.setBackground(color)
 
     # ------------------ Functions related to the worker call ------------------
 
-    def start_thread(self, task_type, message, *args):
-        self.thread = Worker(task_type, *args)  # Initialize the worker thread
+    def start_thread(self, task_type, message, *args, **kwargs):
+        self.thread = Worker(task_type, *args, **kwargs)  # Initialize the worker thread
         self.thread.progress_updated.connect(self.update_progress)  # Connect progress update signal
         self.thread.finished.connect(self.task_finished)  # Connect the finished signal
         self.thread.error_occurred.connect(self.handle_thread_error)  # Connect the error signal
@@ -324,31 +330,43 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
         self.progress_dialog.setModal(True)
         self.progress_dialog.setAutoClose(True)
         self.thread.start()  # Start the thread
-        if self.progress_dialog.exec() == QProgressDialog.DialogCode.Rejected:
+        self.progress_dialog.exec()
+        if self.progress_dialog.wasCanceled():
             self.thread.terminate()  # Stop the thread if the dialog is canceled
+        # The dialog also closes as soon as the progress reaches 100%, before the task returns or reports its failures:
+        # wait for the task, and handle its error and completion signals before the caller reads its result
+        self.thread.wait()
+        QApplication.sendPostedEvents()
 
     def update_progress(self, value):
+        if self.sender() is not self.thread:
+            return  # Late signal of a previous task
         self.progress_dialog.setValue(value)
 
     def task_finished(self):
-        if self.thread.error:
-            return  # Skip the rest of the function if an error occurred
+        if self.sender() is not self.thread or self.thread.error:
+            return  # Skip the late signals of a previous task, and the rest of the function if an error occurred
         
         # Check which task finished and act accordingly
         if self.current_task == 'fetch_and_store':
             # After fetching, immediately check for conflicts
-            conflicts = main.check_sources_conflicts()
+            conflicts = main.check_conflicts()
             if conflicts:
                 self.show_conflict_results(conflicts)
             else:
                 self.load_data_to_mission_table("./temp/missions.json")
+            if self.thread.result:
+                self.statusbar.showMessage(self.thread.result)  # The missions could not be archived
+        elif self.current_task in ('generate', 'send') and self.thread.result:
+            self.statusbar.showMessage(self.thread.result)  # Size of the PDFs with the compact profile
         self.progress_dialog.setValue(100)  # Update progress dialog to show completion
         self.current_task = None  # Reset current task
         self.message = None # Clear message
 
     def handle_thread_error(self, error_message):
         QtWidgets.QMessageBox.critical(self, "Error", error_message)
-        self.progress_dialog.cancel()
+        if self.sender() is self.thread:
+            self.progress_dialog.reset()  # Close the dialog without flagging it as canceled: the task is over
 
     # ------------------ Functions linked to buttons ------------------
 
@@ -369,44 +387,103 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
 
             self.start_thread(self.current_task, self.message, selected_date, departments)
 
-    def generate_mission_orders(self):
+    def generate_mission_orders(self, force=False):
+        """
+        Generates the PDFs of the selected missions. The PDFs that are up to date are kept, unless `force` is set.
+        """
         selected_keys = self.get_selected_items("missions")
         if not selected_keys:
             QtWidgets.QMessageBox.warning(self, "No Selection", "Please select at least one mission order to generate.")
             return
         self.current_task = 'generate'  # Set the current task
         self.message = 'Mission orders PDFs generating'
-        self.start_thread(self.current_task, self.message, selected_keys)
+        self.start_thread(self.current_task, self.message, selected_keys, force=force)
+
+    def offer_to_resume_send(self):
+        """
+        Asks the planner whether to resume the mission orders left in the outbox by an interrupted send.
+
+        Returns True if the outbox is empty, was discarded or was entirely sent, False if the planner cancelled or some of
+        its mission orders could still not be sent, in which case a new send is not started.
+        """
+        unfinished = outbox.unfinished_count()
+        if not unfinished:
+            return True
+        answer = QMessageBox.question(self, "Interrupted send",
+                                      f"{unfinished} mission order(s) of a previous send have not been sent yet.\n\n"
+                                      "Yes: send them now.\nNo: discard them.",
+                                      QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No | QMessageBox.StandardButton.Cancel)
+        if answer == QMessageBox.StandardButton.Yes:
+            self.current_task = 'resume_send'  # Set the current task
+            self.message = 'Mission orders sending'
+            self.start_thread(self.current_task, self.message)  # Returns once the resumed send is over
+            return not self.thread.error and not outbox.unfinished_count()
+        elif answer == QMessageBox.StandardButton.No:
+            outbox.discard_unfinished()
+            return True
+        return False
 
     def send_mission_orders(self):
+        # Handle the leftovers of an interrupted send first, so that they are neither lost nor sent twice
+        if not self.offer_to_resume_send():
+            return
         selected_keys = self.get_selected_items("missions")
         # Check if any mission orders were selected
         if not selected_keys:
             QtWidgets.QMessageBox.warning(self, "No Selection", "Please select at least one mission order to send.")
             return
-        # Format the date from the date selector
-        selected_date = self.dateSelector.date().toPyDate()
-        formatted_date = selected_date.strftime('%Y%m%d')
-        generated_directory = f'./generated/{formatted_date}/'
-        # Check if the directory exists
-        if not os.path.exists(generated_directory):
-            QtWidgets.QMessageBox.warning(self, "No Data", "Please first generate the mission orders.")
-            return
-        # Check if PDF files for all selected keys exist
-        all_files_exist = True
-        for key in selected_keys:
+        # The PDFs must have been generated, unless they are rendered in memory when sending
+        if not main.pdfs_in_memory() and not main.pdfs_bundled():
+            # Format the date from the date selector
+            selected_date = self.dateSelector.date().toPyDate()
+            formatted_date = selected_date.strftime('%Y%m%d')
+            generated_directory = f'./generated/{formatted_date}/'
+            # Check if the directory exists
+            if not os.path.exists(generated_directory):
+                QtWidgets.QMessageBox.warning(self, "No Data", "Please first generate the mission orders.")
+                return
+            # Check if PDF files for all selected keys exist, listing the directory only once
+            pdf_filenames = [filename for filename in os.listdir(generated_directory) if filename.endswith('.pdf')]
             # Check for any file containing the key in its name
-            file_exists = any(key in filename for filename in os.listdir(generated_directory) if filename.endswith('.pdf'))
-            if not file_exists:
-                all_files_exist = False
-                break
-        if not all_files_exist:
-            QtWidgets.QMessageBox.warning(self, "Incomplete Data", "Some selected missions have not been generated yet. Please generate them first.")
+            all_files_exist = all(any(key in filename for filename in pdf_filenames) for key in selected_keys)
+            if not all_files_exist:
+                QtWidgets.QMessageBox.warning(self, "Incomplete Data", "Some selected missions have not been generated yet. Please generate them first.")
+                return
+        # Look for the mission orders already sent, building and hashing them in the worker thread
+        self.current_task = 'find_already_sent'  # Set the current task
+        self.message = 'Mission orders checking'
+        self.start_thread(self.current_task, self.message, selected_keys)
+        if self.thread.error or self.thread.result is None:
             return
+        unchanged_keys, delivered_keys = self.thread.result
+        # Offer to send only the mission orders that changed since they were last delivered
+        skip_delivered = False
+        changed_only = False
+        if unchanged_keys:
+            unchanged = "\n".join(f"• n°{key}" for key in unchanged_keys)
+            answer = QMessageBox.question(self, "Unchanged mission orders",
+                                          f"The following mission orders were already sent and have not changed since:\n\n{unchanged}\n\n"
+                                          "Yes: send only the changed mission orders.\nNo: send them all again.",
+                                          QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No | QMessageBox.StandardButton.Cancel)
+            if answer == QMessageBox.StandardButton.Cancel:
+                return
+            changed_only = answer == QMessageBox.StandardButton.Yes
+        # Flag the mission orders already delivered to the same agents, unless they are already left out as unchanged
+        if changed_only:
+            delivered_keys = [key for key in delivered_keys if key not in unchanged_keys]
+        if delivered_keys:
+            delivered = "\n".join(f"• n°{key}" for key in delivered_keys)
+            answer = QMessageBox.question(self, "Already sent",
+                                          f"The following mission orders were already sent to the same agents:\n\n{delivered}\n\n"
+                                          "Yes: skip them.\nNo: send them again.",
+                                          QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No | QMessageBox.StandardButton.Cancel)
+            if answer == QMessageBox.StandardButton.Cancel:
+                return
+            skip_delivered = answer == QMessageBox.StandardButton.Yes
         # Proceed with sending the missions
         self.current_task = 'send'  # Set the current task
         self.message = 'Mission orders sending'
-        self.start_thread(self.current_task, self.message, selected_keys)
+        self.start_thread(self.current_task, self.message, selected_keys, skip_delivered=skip_delivered, changed_only=changed_only)
 
 class MissionTableModel(QStandardItemModel):
     def __init__(self, parent=None):
@@ -430,15 +507,20 @@ class Worker(QThread):
         self.args = args
         self.kwargs = kwargs
         self.error = False
+        self.result = None  # Value returned by the task, if any
 
     def run(self):
         try:
             if self.task_type == 'fetch_and_store':
-                main.fetch_and_store(*self.args, progress_callback=self.handle_progress, **self.kwargs)
+                self.result = main.fetch_and_store(*self.args, progress_callback=self.handle_progress, **self.kwargs)
             elif self.task_type == 'generate':
-                main.generate(*self.args, progress_callback=self.handle_progress, **self.kwargs)
+                self.result = main.generate(*self.args, progress_callback=self.handle_progress, **self.kwargs)
             elif self.task_type == 'send':
-                main.send(*self.args, progress_callback=self.handle_progress, **self.kwargs)
+                self.result = main.send(*self.args, progress_callback=self.handle_progress, **self.kwargs)
+            elif self.task_type == 'resume_send':
+                main.resume_send(*self.args, progress_callback=self.handle_progress, **self.kwargs)
+            elif self.task_type == 'find_already_sent':
+                self.result = main.find_already_sent(*self.args, progress_callback=self.handle_progress, **self.kwargs)
         except Exception as e:
             self.error = True
             self.error_occurred.emit(str(e))  # Emit the error message
@@ -0,0 +1,149 @@
+from datetime import date, datetime, timedelta
+from modules import utils
+import hashlib
+import json
+import numpy as np
+
+# Constants
+GBQ_PER_CI = 37
+TABLE_MARGIN_DAYS = 31  # Days added on both sides of a date missing from the cached table, so that the next lookups hit it
+
+# Half-lives of the isotopes, in days (see `register_isotope` to add one)
+HALF_LIVES = {'Cs-137': 11012.05,
+              'Ir-192': 73.83,
+              'Se-75': 119.78}
+
+# Activity tables of the sources, keyed by registry version (see `activity_table`)
+_tables = {}
+
+# Last sources registry seen and its version (see `registry_version`)
+_last_registry = (None, None)
+
+def register_isotope(isotope:str, half_life:float):
+    """
+    Adds an isotope to the half-life table, or updates its half-life, in days. The cached activity tables are dropped.
+    """
+    HALF_LIVES[isotope] = float(half_life)
+    _tables.clear()
+
+def registry_version(sources:dict) -> str:
+    """
+    Returns the version of a sources registry: the hash of the fields the activity of its sources depends on (isotope,
+    initial activity and calibration date).
+
+    The registry is reloaded from './temp/sources.json' by every action and never modified afterwards: the version of
+    the last registry seen is therefore kept, and only computed again for another registry.
+    """
+    global _last_registry
+    if _last_registry[0] is not sources:
+        decay_fields = {name: [source.get('Isotope'), source.get('GBq'), source.get('Calibrationdate')]
+                        for name, source in sources.items()}
+        version = hashlib.sha256(json.dumps(decay_fields, sort_keys=True, default=str).encode()).hexdigest()
+        _last_registry = (sources, version)
+    return _last_registry[1]
+
+def _calibration_day(source:dict) -> float:
+    """
+    Returns the proleptic ordinal of the calibration day of a source, or NaN if it has none.
+    """
+    calibration_date = source.get('Calibrationdate')
+    return utils.iso_to_datetime(calibration_date).date().toordinal() if calibration_date else np.nan
+
+class ActivityTable:
+    """
+    Activities of all the sources of a registry, for every day of a date range, computed in one vectorized pass with
+    A = A0 * (1/2)^(Δt/T), where Δt is the number of days since the calibration of the source and T its half-life.
+
+    Attributes:
+    - names (list): The names of the sources, in the order of the rows.
+    - isotopes (list): The isotopes of the sources, in the order of the rows.
+    - start (date): The first day of the range, the one of the first column.
+    - end (date): The last day of the range, the one of the last column.
+    - gbq (numpy.ndarray): The (sources × days) matrix of the activities, in GBq. The row of a source whose isotope is
+      unknown, or whose initial activity or calibration date is missing, is NaN.
+    - ci (numpy.ndarray): The same matrix, in Ci.
+    """
+    def __init__(self, sources:dict, start:date, end:date):
+        self.names = list(sources)
+        self.rows = {name: row for row, name in enumerate(self.names)}
+        self.isotopes = [source.get('Isotope') for source in sources.values()]
+        self.start, self.end = start, end
+
+        initial_activities = np.array([np.nan if source.get('GBq') is None else source['GBq'] for source in sources.values()], dtype=float)
+        half_lives = np.array([HALF_LIVES.get(isotope, np.nan) for isotope in self.isotopes], dtype=float)
+        calibration_days = np.array([_calibration_day(source) for source in sources.values()], dtype=float)
+        days = np.arange(start.toordinal(), end.toordinal() + 1, dtype=float)
+
+        elapsed_days = days[np.newaxis, :] - calibration_days[:, np.newaxis]
+        self.gbq = initial_activities[:, np.newaxis] * np.power(0.5, elapsed_days / half_lives[:, np.newaxis])
+        self.ci = self.gbq / GBQ_PER_CI
+
+    def covers(self, start:date, end:date=None) -> bool:
+        """
+        Returns whether a day, or a range of days, is within the range of the table.
+        """
+        return self.start <= start and (end or start) <= self.end
+
+    def days(self) -> list:
+        """
+        Returns the days of the columns of the table.
+        """
+        return [self.start + timedelta(days=column) for column in range(self.gbq.shape[1])]
+
+    def activity(self, source:str, day:date) -> tuple:
+        """
+        Returns the activity of a source on a day, rounded as on the mission orders (see `process.compute_activity`).
+
+        Returns:
+        - tuple: The activity in GBq and in Ci, rounded to two decimals.
+
+        Raises:
+        - KeyError: If the source is not in the registry, or if its isotope is not in the half-life table.
+        - ValueError: If the day is outside the range of the table, or if the initial activity or the calibration date
+          of the source is missing.
+        """
+        if not self.covers(day):
+            raise ValueError(f"{day} is outside the range of the activity table, from {self.start} to {self.end}")
+        row = self.rows[source]
+        GBq = float(self.gbq[row, (day - self.start).days])
+        if np.isnan(GBq):
+            isotope = self.isotopes[row]
+            if isotope not in HALF_LIVES:
+                raise KeyError(isotope)
+            raise ValueError(f"Missing activity or calibration date for source {source}")
+        GBq = round(GBq, 2)
+        return GBq, round(GBq / GBQ_PER_CI, 2)
+
+def activity_table(sources:dict, start:date, end:date) -> ActivityTable:
+    """
+    Returns the activity table of the sources of a registry over a range of days, computing it only if the table cached
+    for this version of the registry does not cover the range. A new table covers both the cached range and the
+    requested one, so that a cached table only grows.
+    """
+    version = registry_version(sources)
+    table = _tables.get(version)
+    if table is None or not table.covers(start, end):
+        if table is not None:
+            start, end = min(start, table.start), max(end, table.end)
+        table = _tables[version] = ActivityTable(sources, start, end)
+    return table
+
+def source_activity(sources:dict, source:str, day) -> tuple:
+    """
+    Returns the activity of a source on a day, in GBq and Ci, looked up in the activity table of the registry. A table
+    spanning `TABLE_MARGIN_DAYS` around the day is computed if the cached one does not cover it.
+
+    Parameters:
+    - sources (dict): The sources registry.
+    - source (str): The name of the source.
+    - day (date or datetime): The day of the activity.
+
+    Returns:
+    - tuple: The activity in GBq and in Ci, rounded to two decimals.
+    """
+    day = day.date() if isinstance(day, datetime) else day
+    table = _tables.get(registry_version(sources))
+    if table is None or not table.covers(day):
+        margin = timedelta(days=TABLE_MARGIN_DAYS)
+        table = activity_table(sources, day - margin, day + margin)
+    return table.activity(source, day)
@@ -0,0 +1,81 @@
+from datetime import date
+from modules import archive
+
+# Optional dependency: the columnar mission archive
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:
+    pa = pc = None
+
+# Constants
+PERIOD_FORMATS = {'day': '%Y-%m-%d', 'week': '%G-W%V', 'month': '%Y-%m', 'year': '%Y'}  # Labels of the periods, by length
+
+def _with_period_and_hours(missions, period:str):
+    """
+    Adds to the archived missions the label of the period of their start (see `PERIOD_FORMATS`) and their duration
+    in hours.
+    """
+    periods = pc.strftime(missions['start'], format=PERIOD_FORMATS[period])
+    seconds = pc.cast(pc.subtract(missions['end'], missions['start']), pa.int64())
+    hours = pc.divide(pc.cast(seconds, pa.float64()), 3600)
+    return missions.append_column('period', periods).append_column('hours', hours)
+
+def _explode(missions, column:str, name:str):
+    """
+    Returns one row per item of a list column of the missions (e.g. one per source), with the period and hours of
+    its mission.
+    """
+    parents = pc.list_parent_indices(missions[column])
+    return pa.table({
+        name: pc.list_flatten(missions[column]),
+        'period': missions['period'].take(parents),
+        'hours': missions['hours'].take(parents),
+        'key': missions['key'].take(parents),
+    })
+
+def _booked_hours(column:str, name:str, start:date, end:date, period:str):
+    missions = _with_period_and_hours(archive.load(start, end, ['key', 'start', 'end', column]), period)
+    bookings = _explode(missions, column, name)
+    totals = bookings.group_by([name, 'period']).aggregate([('hours', 'sum'), ('key', 'count_distinct')])
+    totals = totals.rename_columns({'hours_sum': 'hours', 'key_count_distinct': 'missions'})
+    return totals.sort_by([(name, 'ascending'), ('period', 'ascending')])
+
+def source_utilization(start:date=None, end:date=None, period:str='month'):
+    """
+    Computes the utilization of every source over the archived missions: its booked hours and number of missions per
+    period.
+
+    Parameters:
+    - start (date, optional): The first day of the missions. Defaults to the first archived day.
+    - end (date, optional): The last day of the missions. Defaults to the last archived day.
+    - period (str, optional): The length of the periods (see `PERIOD_FORMATS`). Defaults to 'month'.
+
+    Returns:
+    - pyarrow.Table: The 'source', 'period', 'hours' and 'missions' columns, sorted by source and period.
+    """
+    return _booked_hours('sources', 'source', start, end, period)
+
+def agent_workload(start:date=None, end:date=None, period:str='week'):
+    """
+    Computes the workload of every agent over the archived missions: their hours on missions and number of missions
+    per period.
+
+    Returns:
+    - pyarrow.Table: The 'agent', 'period', 'hours' and 'missions' columns, sorted by agent and period.
+    """
+    return _booked_hours('agents', 'agent', start, end, period)
+
+def rt_missions_per_customer(start:date=None, end:date=None, period:str='year'):
+    """
+    Counts the RT missions, i.e. the ones transporting sources, of every customer over the archived missions, per period.
+
+    Returns:
+    - pyarrow.Table: The 'customer', 'period' and 'missions' columns, sorted by decreasing number of missions.
+    """
+    missions = archive.load(start, end, ['key', 'start', 'end', 'customers', 'sources'])
+    missions = missions.filter(pc.greater(pc.list_value_length(missions['sources']), 0))
+    customers = _explode(_with_period_and_hours(missions, period), 'customers', 'customer')
+    counts = customers.group_by(['customer', 'period']).aggregate([('key', 'count_distinct')])
+    counts = counts.rename_columns({'key_count_distinct': 'missions'})
+    return counts.sort_by([('missions', 'descending'), ('customer', 'ascending'), ('period', 'ascending')])
@@ -0,0 +1,194 @@
+from datetime import date, timedelta
+from modules import model, utils
+import json
+import os
+import tempfile
+
+# Optional dependency: the columnar mission archive
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pc = ds = pq = None
+
+# Constants
+ARCHIVE_FILE_NAME = 'missions.parquet'  # File holding the missions of a day, in the partition of the day
+MOVED_MISSION_WINDOW_DAYS = 14  # Days around the archived ones where a mission moved to another day is looked for
+
+# Columns of the archive. The 'departments' column holds the departments of the fetch that archived the mission (see
+# `archive_missions`), and the 'mission' column the cleaned mission itself, as JSON, so that it can be restored as is
+SCHEMA = pa.schema([
+    ('key', pa.string()),
+    ('start', pa.timestamp('s')),
+    ('end', pa.timestamp('s')),
+    ('agents', pa.list_(pa.string())),
+    ('customers', pa.list_(pa.string())),
+    ('sources', pa.list_(pa.string())),
+    ('vehicle', pa.string()),
+    ('equipment', pa.list_(pa.string())),
+    ('techniques', pa.list_(pa.string())),
+    ('departurePlace', pa.string()),
+    ('departments', pa.list_(pa.int64())),
+    ('mission', pa.string()),
+]) if pa else None
+
+def get_archive_dir():
+    """
+    Returns the directory of the mission archive, in the application's data directory. The missions are partitioned
+    by day of start: './archive/day=<YYYY-MM-DD>/missions.parquet'.
+    """
+    return os.path.join(utils.get_data_dir(), 'archive')
+
+def is_available() -> bool:
+    """
+    Returns whether the mission archive can be used, that is, whether pyarrow is installed.
+    """
+    return pa is not None
+
+def _day_path(day:str) -> str:
+    return os.path.join(get_archive_dir(), f"day={day}", ARCHIVE_FILE_NAME)
+
+def _to_row(mission:dict, departments:list=None) -> dict:
+    """
+    Converts a cleaned mission (see `process.clean_data`), fetched for some departments, to a row of the archive.
+    """
+    return {
+        "key": mission['key'],
+        "start": model.start_of(mission),
+        "end": model.end_of(mission),
+        "agents": [f"{agent.get('firstName')} {agent.get('lastName')}" for agent in mission.get('resources') or []],
+        "customers": [customer.get('label') for customer in mission.get('customers') or []],
+        "sources": list(mission.get('sources') or []),
+        "vehicle": mission.get('vehicle'),
+        "equipment": list(mission.get('equipment') or []),
+        "techniques": list(mission.get('techniques') or []),
+        "departurePlace": mission.get('departurePlace'),
+        "departments": list(departments) if departments else None,
+        "mission": json.dumps(mission, default=model.json_default),
+    }
+
+def _dataset(source=None):
+    """
+    Opens the archive, the file of a partition or a list of them, as a dataset with the 'day' column of the partitions.
+    The columns missing from the files written before they were added to `SCHEMA` are read as nulls.
+    """
+    partitioning = ds.partitioning(pa.schema([('day', pa.string())]), flavor='hive')
+    return ds.dataset(source or get_archive_dir(), schema=SCHEMA.append(partitioning.schema.field('day')), format='parquet',
+                      partitioning=partitioning, partition_base_dir=get_archive_dir())
+
+def _archived_days(keys, days:set) -> set:
+    """
+    Returns the days of the partitions holding an archived version of the missions of some keys, among the partitions
+    within `MOVED_MISSION_WINDOW_DAYS` of some days. Only the key column of these partitions is read, so that the cost
+    of archiving a day does not grow with the history.
+    """
+    if not len(keys) or not days:
+        return set()
+    first, last = date.fromisoformat(min(days)), date.fromisoformat(max(days))
+    window = (first + timedelta(days=offset) for offset in range(-MOVED_MISSION_WINDOW_DAYS,
+                                                                  (last - first).days + MOVED_MISSION_WINDOW_DAYS + 1))
+    paths = [path for path in (_day_path(day.isoformat()) for day in window) if os.path.exists(path)]
+    if not paths:
+        return set()
+    return set(_dataset(paths).to_table(columns=['day'], filter=ds.field('key').isin(keys))['day'].to_pylist())
+
+def _write_partition(table, path:str):
+    """
+    Writes the file of a partition through a temporary file, replaced at once: a crash in the middle of the write
+    leaves the previous version of the partition intact. The temporary file is hidden from the dataset readers.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    descriptor, temporary_path = tempfile.mkstemp(prefix='.', suffix='.parquet', dir=os.path.dirname(path))
+    os.close(descriptor)
+    try:
+        pq.write_table(table, temporary_path)
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.remove(temporary_path)
+        raise
+
+def archive_missions(missions:list, day:date=None, departments:list=None) -> int:
+    """
+    Adds cleaned missions to the archive, replacing the archived version of the missions already in it.
+
+    The missions are grouped by day of start, and the file of each day is rewritten with the missions it already held
+    and the new ones. The archived version of a mission is removed from its partition, if it is within
+    `MOVED_MISSION_WINDOW_DAYS` of its new day, so that a mission moved to another day is not archived twice. Fetching
+    a day again for another department completes its partition, while fetching it again for the same departments
+    replaces their missions: the ones cancelled since are removed from the archive. Nothing is done if pyarrow is not
+    installed.
+
+    Parameters:
+    - missions (list): The cleaned missions (see `process.clean_data`).
+    - day (date, optional): The day fetched.
+    - departments (list, optional): The departments fetched, recorded with the missions. The missions of the fetched
+      day archived by a previous fetch of these departments are replaced, even if the new fetch no longer has them.
+
+    Returns:
+    - int: The number of missions archived.
+    """
+    if not is_available():
+        return 0
+
+    days = {}
+    for mission in missions:
+        days.setdefault(mission['start'][:10], []).append(_to_row(mission, departments))
+    fetched_day = day.strftime('%Y-%m-%d') if day is not None and departments else None
+    if fetched_day:
+        days.setdefault(fetched_day, [])
+
+    replaced = pa.array([mission['key'] for mission in missions], pa.string())
+    for partition in sorted(days.keys() | _archived_days(replaced, days.keys())):
+        path = _day_path(partition)
+        table = pa.Table.from_pylist(days.get(partition, []), schema=SCHEMA)
+        if os.path.exists(path):
+            archived = _dataset(path).to_table(columns=SCHEMA.names)
+            kept = pc.invert(pc.is_in(archived['key'], value_set=replaced))
+            if partition == fetched_day:
+                refetched = [bool(set(archived_departments or ()) & set(departments))
+                             for archived_departments in archived['departments'].to_pylist()]
+                kept = pc.and_(kept, pc.invert(pa.array(refetched, pa.bool_())))
+            table = pa.concat_tables([archived.filter(kept), table])
+        if table.num_rows:
+            _write_partition(table, path)
+        elif os.path.exists(path):
+            os.remove(path)
+            try:
+                os.rmdir(os.path.dirname(path))
+            except OSError:
+                pass  # Not empty, e.g. a temporary file left by a crash
+    return len(missions)
+
+def load(start:date=None, end:date=None, columns:list=None):
+    """
+    Loads the archived missions started between two days, both included, reading only the partitions of these days.
+
+    Parameters:
+    - start (date, optional): The first day. Defaults to the first archived day.
+    - end (date, optional): The last day. Defaults to the last archived day.
+    - columns (list, optional): The columns to read (see `SCHEMA`). Defaults to all of them.
+
+    Returns:
+    - pyarrow.Table: The archived missions, with the 'day' column of their partition. Empty if nothing is archived.
+    """
+    if not is_available():
+        raise ImportError("pyarrow is required to read the mission archive")
+    if not os.path.isdir(get_archive_dir()):
+        return SCHEMA.append(pa.field('day', pa.string())).empty_table().select((columns or SCHEMA.names) + ['day'])
+
+    dataset = _dataset()
+    condition = None
+    if start is not None:
+        condition = ds.field('day') >= start.isoformat()
+    if end is not None:
+        before_end = ds.field('day') <= end.isoformat()
+        condition = before_end if condition is None else condition & before_end
+    return dataset.to_table(columns=(columns or SCHEMA.names) + ['day'], filter=condition)
+
+def load_missions(start:date=None, end:date=None) -> list:
+    """
+    Restores the archived missions started between two days, both included, as cleaned missions (see `load`).
+    """
+    return [json.loads(mission) for mission in load(start, end, ['mission'])['mission'].to_pylist()]
@@ -12,6 +12,12 @@ import threading
 import urllib
 import webbrowser
 
+# Authenticated SharePoint client contexts, keyed by (site url, client id, client secret)
+_shpt_contexts = {}
+
+# Serializes the Microsoft Graph token refreshes of the process, e.g. the start-up warm-up and the first Fetch
+_refresh_lock = threading.RLock()
+
 def authenticate_to_ppme():
     """
     Authenticates to the PPME api service using the APPKEY and AUTH_TOKEN securely fetched from the keyring.
@@ -36,7 +42,7 @@ def authenticate_to_ppme():
     headers = {'X-APPKEY': appkey}
 
     try:
-        response = requests.put(connection_str, headers=headers, data={
+        response = utils.get_session().put(connection_str, headers=headers, data={
             'grant_type': 'urn:ietf:params:oauth:grant-type:jwt-bearer',
             'assertion': auth_token
         })
@@ -68,6 +74,9 @@ def authenticate_to_shpt():
     authenticate to the SharePoint site. The authenticated client context is returned,
     allowing for further operations on the SharePoint site.
 
+    The client context is cached for the lifetime of the process, so that it is only set up once
+    (typically during the start-up warm-up) as long as the site URL and credentials do not change.
+
     Returns:
         ClientContext: An authenticated SharePoint client context object.
     """
@@ -79,8 +88,13 @@ def authenticate_to_shpt():
     if not client_secret:
         raise Exception("Client secret is missing or not set in the keyring.")
 
-    client_credential = ClientCredential(client_id, client_secret)
-    ctx = ClientContext(site_url).with_credentials(client_credential)
+    cache_key = (site_url, client_id, client_secret)
+    ctx = _shpt_contexts.get(cache_key)
+    if ctx is None:
+        client_credential = ClientCredential(client_id, client_secret)
+        ctx = ClientContext(site_url).with_credentials(client_credential)
+        _shpt_contexts.clear()  # Credentials changed, drop any stale context
+        _shpt_contexts[cache_key] = ctx
 
     return ctx
 
@@ -184,18 +198,29 @@ def authenticate_to_ms_graph():
     else:
         raise Exception('No authorization code was received.')
 
-def refresh_access_token():
+def refresh_access_token(interactive:bool=True):
     """
     This function is used to refresh the access token for Microsoft Graph.
 
+    The refreshes are serialized: each one reads the refresh token stored by the previous one, which Microsoft may
+    have rotated, and the tokens are written to the .env file one refresh at a time.
+
     Args:
-        None
+        interactive (bool, optional): Whether to fall back to the interactive Microsoft login if the refresh token was
+            rejected. Defaults to True.
 
     Returns:
         str: The refreshed access token
 
     Raises:
-        requests.exceptions.HTTPError: If the request to refresh the access token fails
+        requests.exceptions.HTTPError: If the request to refresh the access token fails and `interactive` is False
+    """
+    with _refresh_lock:
+        return _refresh_access_token(interactive)
+
+def _refresh_access_token(interactive:bool):
+    """
+    Refreshes the access token for Microsoft Graph, with the refresh lock held (see `refresh_access_token`).
     """
     load_dotenv(override=True)
 
@@ -218,11 +243,13 @@ def refresh_access_token():
         "scope": "https://graph.microsoft.com/.default offline_access"
     }
     try:
-        response = requests.post(token_url, headers=headers, data=body)
+        response = utils.get_session().post(token_url, headers=headers, data=body)
         response.raise_for_status()
         new_tokens = response.json()
         utils.update_env_var(new_tokens.get('access_token'), 'MS_ACCESS_TOKEN')
         utils.update_env_var(new_tokens.get('refresh_token'), 'MS_REFRESH_TOKEN')
     except requests.exceptions.HTTPError:
+        if not interactive:
+            raise
         new_tokens = authenticate_to_ms_graph()
     return new_tokens['access_token']
@@ -0,0 +1,144 @@
+from bisect import bisect_left, insort
+from datetime import timedelta
+from modules import model
+import heapq
+
+# Constants
+RESOURCE_KINDS = ('source', 'vehicle', 'equipment', 'agent')  # Kinds of resources that cannot be booked twice at once
+KIND_LABELS = {'source': 'Source', 'vehicle': 'Vehicle', 'equipment': 'Equipment', 'agent': 'Agent'}
+
+def mission_period(mission:dict) -> tuple:
+    """
+    Returns the start and end of a mission, as datetimes.
+    """
+    return model.start_of(mission), model.end_of(mission)
+
+def mission_resources(mission:dict, kinds:tuple=RESOURCE_KINDS) -> list:
+    """
+    Returns the resources booked by a mission, as (kind, name) tuples, each one once.
+    """
+    resources = []
+    if 'source' in kinds:
+        resources += [('source', source) for source in mission.get('sources') or []]
+    if 'vehicle' in kinds and mission.get('vehicle'):
+        resources.append(('vehicle', mission['vehicle']))
+    if 'equipment' in kinds:
+        resources += [('equipment', equipment) for equipment in mission.get('equipment') or [] if equipment]
+    if 'agent' in kinds:
+        for agent in mission.get('resources') or []:
+            name = f"{agent.get('firstName') or ''} {agent.get('lastName') or ''}".strip()
+            if name:
+                resources.append(('agent', name))
+    return list(dict.fromkeys(resources))
+
+def resource_label(resource:tuple) -> str:
+    """
+    Returns the label of a resource shown to the user, e.g. 'Vehicle 1-ABC'.
+    """
+    kind, name = resource
+    return f"{KIND_LABELS[kind]} {name}"
+
+def _conflicts_by_label(pairs:dict) -> dict:
+    """
+    Converts the overlapping pairs of mission keys of every resource to the mission keys in conflict per resource label.
+    """
+    return {resource_label(resource): sorted({key for pair in resource_pairs for key in pair})
+            for resource, resource_pairs in pairs.items() if resource_pairs}
+
+def find_conflicts(missions:list, kinds:tuple=RESOURCE_KINDS) -> dict:
+    """
+    Finds every pair of missions booking the same resource at overlapping times, whatever the number of days they span.
+
+    The bookings of every resource are swept in order of start: the bookings still running at the start of a booking,
+    kept in a heap by end, are exactly the ones it overlaps. The missions are checked in O(n log n + k), k being the
+    number of overlapping pairs, instead of comparing every pair of bookings of a resource.
+
+    Parameters:
+    - missions (list): The missions, with their 'start' and 'end' datetime strings.
+    - kinds (tuple, optional): The kinds of resources to check (see `RESOURCE_KINDS`). Defaults to all of them.
+
+    Returns:
+    - dict: A dictionary mapping the label of every resource booked several times at once (see `resource_label`) to the
+      keys of the missions booking it at overlapping times, or None if there is no conflict.
+    """
+    bookings = {}
+    for mission in missions:
+        start, end = mission_period(mission)
+        for resource in mission_resources(mission, kinds):
+            bookings.setdefault(resource, []).append((start, end, mission['key']))
+
+    pairs = {}
+    for resource, resource_bookings in bookings.items():
+        if len(resource_bookings) < 2:
+            continue
+        resource_bookings.sort()
+        running = []  # (end, key) of the bookings running at the current start
+        for start, end, key in resource_bookings:
+            while running and running[0][0] <= start:
+                heapq.heappop(running)
+            pairs.setdefault(resource, set()).update((other_key, key) for _, other_key in running)
+            heapq.heappush(running, (end, key))
+
+    conflicts = _conflicts_by_label(pairs)
+    return conflicts or None
+
+class ConflictIndex:
+    """
+    Bookings of the resources kept sorted by start, so that the conflicts of a mission are found as it is added, while
+    the missions stream in (see `add`).
+
+    The bookings overlapping a new one are found by bisection among the ones starting before its end, and no earlier
+    than the longest booking of the resource before its start: an insertion costs O(log n) plus the number of bookings
+    in that window.
+    """
+    def __init__(self, kinds:tuple=RESOURCE_KINDS):
+        self.kinds = kinds
+        self._bookings = {}  # Sorted (start, end, key) bookings per resource
+        self._longest = {}  # Longest booking per resource
+        self._missions = {}  # Period and resources per mission key
+        self._pairs = {}  # Overlapping pairs of mission keys per resource
+
+    def add(self, mission:dict) -> dict:
+        """
+        Adds the bookings of a mission, replacing the ones it had if it was already added.
+
+        Returns:
+        - dict: A dictionary mapping the label of every resource the mission is in conflict for to the keys of the other
+          missions booking it at overlapping times.
+        """
+        key = mission['key']
+        self.remove(key)
+        start, end = mission_period(mission)
+        resources = mission_resources(mission, self.kinds)
+        self._missions[key] = (start, end, resources)
+
+        conflicts = {}
+        for resource in resources:
+            bookings = self._bookings.setdefault(resource, [])
+            self._longest[resource] = longest = max(self._longest.get(resource, timedelta(0)), end - start)
+            first, last = bisect_left(bookings, (start - longest,)), bisect_left(bookings, (end,))
+            overlapping = [other_key for _, other_end, other_key in bookings[first:last] if other_end > start]
+            if overlapping:
+                self._pairs.setdefault(resource, set()).update((other_key, key) for other_key in overlapping)
+                conflicts[resource_label(resource)] = overlapping
+            insort(bookings, (start, end, key))
+        return conflicts
+
+    def remove(self, key:str):
+        """
+        Removes the bookings of a mission, and the conflicts it was part of. Unknown missions are ignored.
+        """
+        if key not in self._missions:
+            return
+        start, end, resources = self._missions.pop(key)
+        for resource in resources:
+            bookings = self._bookings[resource]
+            del bookings[bisect_left(bookings, (start, end, key))]
+            if resource in self._pairs:
+                self._pairs[resource] = {pair for pair in self._pairs[resource] if key not in pair}
+
+    def conflicts(self) -> dict:
+        """
+        Returns the conflicts between the missions added so far, as `find_conflicts` does.
+        """
+        return _conflicts_by_label(self._pairs) or None
@@ -0,0 +1,505 @@
+from modules import model, process, utils
+from reportlab.lib import colors
+from reportlab.lib.enums import TA_CENTER
+from reportlab.lib.fonts import ps2tt, tt2ps
+from reportlab.lib.pagesizes import A4, landscape
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.pdfgen.canvas import Canvas
+from reportlab.platypus import Paragraph
+import io
+import json
+import re
+import time
+
+# Constants: geometry of the frame of the Platypus renderer (A4, margins of 72 points and 100 at the top, padding of 6)
+PAGE_WIDTH, PAGE_HEIGHT = A4
+FRAME_LEFT = 72 + 6
+FRAME_TOP = PAGE_HEIGHT - 100 - 6
+FRAME_BOTTOM = 72 + 6
+FRAME_WIDTH = PAGE_WIDTH - 2 * 72 - 2 * 6
+CELL_PADDING = 6  # Left and right padding of the table cells
+TABLE_PADDINGS = {'mission': 5, 'adr': 4.9, 'signatures': 0}  # Top and bottom padding of the table cells, by kind of table
+SIGNATURES_FONT = ('Helvetica', 10, 12)  # Font name, size and leading of the cells of the signatures table
+GRID_COLOR = colors.darkslategray
+FUZZ = 1e-6  # Tolerance of the page fitting tests, as in Platypus
+REGISTER_MARGIN = 36  # Margins of the registers (landscape A4)
+REGISTER_FONT = ('Helvetica', 7, 8.5)  # Font name, size and leading of the cells of the registers
+REGISTER_PADDING = 3  # Padding of the cells of the registers
+
+# Width of the words, by (text, font name, font size)
+_string_widths = {}
+
+# Markup supported by the canvas renderer: anything else is drawn by Platypus
+_MARKUP = re.compile(r'(<br/>|<b>|</b>)')
+_UNSUPPORTED = re.compile(r'[<>&]')
+_SPACES = re.compile(r'(\s+)')
+
+def _string_width(text:str, font_name:str, font_size:float) -> float:
+    """
+    Returns the width of a word in a font, computing it on the first call only.
+    """
+    key = (text, font_name, font_size)
+    width = _string_widths.get(key)
+    if width is None:
+        width = _string_widths[key] = stringWidth(text, font_name, font_size)
+    return width
+
+def _parse(text:str, font_name:str) -> list:
+    """
+    Splits a paragraph into its lines (on '<br/>') and words, each word being a list of (text, font name) runs.
+
+    Returns:
+    - list: The lines, or None if the paragraph holds markup or entities the canvas renderer does not support.
+    """
+    family, bold, italic = ps2tt(font_name)
+    lines = [[]]
+    bold_depth = 0
+    glued = False  # Whether the next run continues the last word
+    for token in _MARKUP.split(text):
+        if token == '<br/>':
+            lines.append([])
+            glued = False
+        elif token == '<b>':
+            bold_depth += 1
+        elif token == '</b>':
+            bold_depth = max(bold_depth - 1, 0)
+        elif token:
+            if _UNSUPPORTED.search(token):
+                return None
+            font = tt2ps(family, bold or bold_depth > 0, italic)
+            for part in _SPACES.split(token):
+                if not part:
+                    continue
+                if part.isspace():
+                    glued = False
+                elif glued:
+                    lines[-1][-1].append((part, font))
+                else:
+                    lines[-1].append([(part, font)])
+                    glued = True
+
+    # As in Platypus, a trailing line break does not start a new line, and an empty paragraph has no line
+    if len(lines) > 1 and not lines[-1]:
+        lines.pop()
+    return [] if lines == [[]] else lines
+
+class _TextBlock:
+    """
+    A paragraph laid out in a given width: drawn directly on the canvas if its markup is supported (see `_parse`),
+    by Platypus otherwise, or if it is free text.
+    """
+    def __init__(self, text:str, style, width:float, free_text:bool=False):
+        self.style = style
+        self.width = width
+        lines = None if free_text else _parse(text, style.fontName)
+        if lines is None:
+            self.paragraph = Paragraph(text, style)
+            self.height = self.paragraph.wrap(width, PAGE_HEIGHT)[1]
+        else:
+            self.paragraph = None
+            self.lines = self._wrap(lines)
+            self.height = len(self.lines) * style.leading
+
+    def _wrap(self, lines:list) -> list:
+        """
+        Breaks the lines of the paragraph greedily to fit its width.
+
+        Returns:
+        - list: A (words, width) tuple per line.
+        """
+        font_size = self.style.fontSize
+        wrapped = []
+        for words in lines:
+            line, line_width = [], 0
+            for word in words:
+                word_width = sum(_string_width(text, font, font_size) for text, font in word)
+                if line:
+                    space_width = _string_width(' ', line[-1][-1][1], font_size)
+                    if line_width + space_width + word_width > self.width + FUZZ:
+                        wrapped.append((line, line_width))
+                        line, line_width = [word], word_width
+                    else:
+                        line.append(word)
+                        line_width += space_width + word_width
+                else:
+                    line, line_width = [word], word_width
+            wrapped.append((line, line_width))
+        return wrapped
+
+    def draw(self, canvas, x:float, top:float):
+        """
+        Draws the paragraph with its top left corner at (x, top).
+        """
+        if self.paragraph is not None:
+            self.paragraph.drawOn(canvas, x, top - self.height)
+            return
+
+        font_size = self.style.fontSize
+        text_object = canvas.beginText()
+        current_font = None
+        y = top - font_size
+        for words, line_width in self.lines:
+            offset = (self.width - line_width) / 2 if self.style.alignment == TA_CENTER else 0
+            text_object.setTextOrigin(x + offset, y)
+
+            # Merge the words into runs of the same font, the spaces going to the run they follow
+            runs = []
+            for index, word in enumerate(words):
+                for text, font in word:
+                    if runs and runs[-1][1] == font:
+                        runs[-1][0] += text
+                    else:
+                        runs.append([text, font])
+                if index < len(words) - 1:
+                    runs[-1][0] += ' '
+
+            for text, font in runs:
+                if font != current_font:
+                    text_object.setFont(font, font_size)
+                    current_font = font
+                text_object.textOut(text)
+            y -= self.style.leading
+        canvas.drawText(text_object)
+
+class _Document:
+    """
+    The pages of a mission order being drawn, and the position of the next section on the current page, following the
+    rules of the Platypus frames: the space before a section is dropped at the top of a page, and overlaps the space
+    after the previous section. The output `profile` sets the compression of the document and the logos of its page
+    header (see `process._pdf_profile`).
+    """
+    def __init__(self, profile:str='standard'):
+        self.buffer = io.BytesIO()
+        self.canvas = Canvas(self.buffer, pagesize=A4, **process._document_settings(profile))
+        self.pdf_profile = profile
+        self.page = 0
+
+    def start_part(self, key:str=None, title:str=None):
+        """
+        Starts a mission order on a new page, with page numbers starting from 1, and bookmarks it if a key is given.
+        """
+        if self.page:
+            self.canvas.showPage()
+        self.page = 0
+        self._begin_page()
+        if key is not None:
+            self.canvas.bookmarkPage(f"OM{key}")
+            self.canvas.addOutlineEntry(title, f"OM{key}", level=0)
+
+    def _begin_page(self):
+        self.page += 1
+        self.y = FRAME_TOP
+        self.at_top = True
+        self.space_after = 0
+        process.add_header_footer(self.canvas, self)
+
+    def page_break(self):
+        self.canvas.showPage()
+        self._begin_page()
+
+    def place(self, height:float, space_before:float=0, space_after:float=0) -> float:
+        """
+        Reserves the room of a section, on the next page if it does not fit on the current one.
+
+        Returns:
+        - float: The y coordinate of the top of the section.
+        """
+        space = 0 if self.at_top else max(space_before - self.space_after, 0)
+        if self.y - space - height < FRAME_BOTTOM - FUZZ and not self.at_top:
+            self.page_break()
+            space = 0
+        top = self.y - space
+        self.y = top - height - space_after
+        self.space_after = space_after
+        self.at_top = self.at_top and self.y == FRAME_TOP
+        return top
+
+    def paragraph(self, text:str, style):
+        block = _TextBlock(text, style, FRAME_WIDTH)
+        top = self.place(block.height, style.spaceBefore, style.spaceAfter)
+        block.draw(self.canvas, FRAME_LEFT, top)
+
+    def spacer(self, height:float):
+        self.place(height)
+
+    def table(self, section:dict):
+        """
+        Draws a table row by row, moving to the next page the rows that do not fit on the current one.
+        """
+        kind = section['kind']
+        padding = TABLE_PADDINGS[kind]
+
+        # Columns without a width share the remaining width of the frame
+        col_widths = section['col_widths'] or [None] * len(section['rows'][0])
+        free_width = FRAME_WIDTH - sum(width for width in col_widths if width is not None)
+        col_widths = [free_width / col_widths.count(None) if width is None else width for width in col_widths]
+        col_positions = [FRAME_LEFT + (FRAME_WIDTH - sum(col_widths)) / 2]  # Tables are centered
+        for width in col_widths:
+            col_positions.append(col_positions[-1] + width)
+
+        # Lay out the cells
+        _, smaller_font_style = process._pdf_styles()
+        style = smaller_font_style if kind == 'adr' else _normal_style()
+        rows = []
+        for index, row in enumerate(section['rows']):
+            if kind == 'signatures':
+                rows.append((row, SIGNATURES_FONT[2] + 2 * padding))
+                continue
+            free_text = index in section['free_text_rows']
+            blocks = [_TextBlock(text, style, width - 2 * CELL_PADDING, free_text and column > 0)
+                      for column, (text, width) in enumerate(zip(row, col_widths))]
+            rows.append((blocks, max(block.height for block in blocks) + 2 * padding))
+
+        # Draw the rows, and the grid of the part of the table on each page
+        row_positions = []
+        for cells, height in rows:
+            if row_positions and self.y - height < FRAME_BOTTOM - FUZZ:
+                self._draw_grid(kind, col_positions, row_positions)
+                row_positions = []
+            top = self.place(height)
+            if not row_positions:
+                row_positions.append(top)
+            row_positions.append(top - height)
+            self._draw_row(kind, cells, col_positions, top, height, padding)
+        self._draw_grid(kind, col_positions, row_positions)
+
+    def _draw_row(self, kind:str, cells:list, col_positions:list, top:float, height:float, padding:float):
+        canvas = self.canvas
+        if kind == 'signatures':
+            # Plain strings, aligned left, centered and right, at the bottom of their cell
+            font_name, font_size, leading = SIGNATURES_FONT
+            canvas.setFont(font_name, font_size, leading)
+            y = top - height + padding + leading - font_size
+            canvas.drawString(col_positions[0] + CELL_PADDING, y, cells[0])
+            canvas.drawCentredString((col_positions[1] + col_positions[2]) / 2, y, cells[1])
+            canvas.drawRightString(col_positions[3] - CELL_PADDING, y, cells[2])
+            return
+
+        for block, x in zip(cells, col_positions):
+            if kind == 'adr':
+                # Vertically centered, as Platypus does with the 'CENTER' alignment
+                block_top = top - (height - block.height) / 2
+            else:
+                block_top = top - padding
+            block.draw(canvas, x + CELL_PADDING, block_top)
+
+    def _draw_grid(self, kind:str, col_positions:list, row_positions:list):
+        if kind == 'signatures' or len(row_positions) < 2:
+            return  # The grid of the signatures table is transparent
+        canvas = self.canvas
+        canvas.saveState()
+        canvas.setLineCap(1)
+        canvas.setLineJoin(1)
+        canvas.setStrokeColor(GRID_COLOR)
+        canvas.setLineWidth(1)
+        lines = [(col_positions[0], y, col_positions[-1], y) for y in row_positions]
+        lines += [(x, row_positions[-1], x, row_positions[0]) for x in col_positions]
+        canvas.lines(lines)
+        canvas.restoreState()
+
+    def getvalue(self) -> bytes:
+        self.canvas.save()
+        return self.buffer.getvalue()
+
+def _normal_style():
+    """
+    Returns the style of the paragraphs of the mission details tables.
+    """
+    styles, _ = process._pdf_styles()
+    return styles['Normal']
+
+def render_sections(sections:list, profile:str='standard') -> bytes:
+    """
+    Renders the sections of a mission order (see `process.mission_order_sections`) directly on the canvas.
+
+    The layout of the mission orders is fixed: the positions of the sections, table rows and cells are computed from
+    the column widths and cached font metrics, with the same rules as Platypus, which only lays out the free text
+    remarks and the paragraphs holding markup other than bold and line breaks. The output is visually equivalent to
+    the one of the Platypus renderer.
+
+    Parameters:
+    - sections (list): The sections of the mission order.
+    - profile (str, optional): The output profile, 'standard' (default) or 'compact' (see `process.PDF_PROFILES`).
+
+    Returns:
+    - bytes: The content of the PDF document.
+    """
+    document = _Document(profile)
+    document.start_part()
+    _draw_sections(document, sections)
+    return document.getvalue()
+
+def render_bundle(parts:list, profile:str='standard') -> bytes:
+    """
+    Renders several mission orders into a single PDF document, directly on the canvas (see `process.render_bundle`).
+
+    Parameters:
+    - parts (list): A (mission key, bookmark title, sections) tuple per mission order.
+    - profile (str, optional): The output profile, 'standard' (default) or 'compact' (see `process.PDF_PROFILES`).
+
+    Returns:
+    - bytes: The content of the PDF document.
+    """
+    document = _Document(profile)
+    for key, title, sections in parts:
+        document.start_part(key, title)
+        _draw_sections(document, sections)
+    return document.getvalue()
+
+def _draw_sections(document:_Document, sections:list):
+    styles, _ = process._pdf_styles()
+    for section in sections:
+        if section['type'] == 'paragraph':
+            document.paragraph(section['text'], styles[section['style']])
+        elif section['type'] == 'spacer':
+            document.spacer(section['height'])
+        elif section['type'] == 'page_break':
+            document.page_break()
+        else:
+            document.table(section)
+
+class RegisterDocument:
+    """
+    A register drawn directly on the canvas of a landscape A4 PDF: a table whose rows are added in chunks as they are
+    produced, so that the rows of the register are never all held in memory. The header row is repeated on every page.
+    """
+    def __init__(self, path:str, title:str, columns:list):
+        """
+        Parameters:
+        - path (str): The path of the PDF document.
+        - title (str): The title, drawn at the top of every page.
+        - columns (list): A (header, width) tuple per column, the widths summing up to the width of the page, minus
+          its margins.
+        """
+        self.title = title
+        self.headers = [header for header, _ in columns]
+        self.col_positions = [REGISTER_MARGIN]
+        for _, width in columns:
+            self.col_positions.append(self.col_positions[-1] + width)
+        self.canvas = Canvas(path, pagesize=landscape(A4))
+        self.page_width, self.page_height = landscape(A4)
+        self.page = 0
+        self._begin_page()
+
+    def _begin_page(self):
+        self.page += 1
+        canvas = self.canvas
+        canvas.setFont('Helvetica-Bold', 12)
+        canvas.drawString(REGISTER_MARGIN, self.page_height - REGISTER_MARGIN, self.title)
+        canvas.setFont('Helvetica', 8)
+        canvas.drawRightString(self.page_width - REGISTER_MARGIN, REGISTER_MARGIN / 2, "Page %d" % self.page)
+        self.y = self.page_height - REGISTER_MARGIN - 12
+        self.row_positions = [self.y]
+        self._draw_row(self.headers, 'Helvetica-Bold', colors.lightgrey)
+
+    def _end_page(self):
+        canvas = self.canvas
+        canvas.saveState()
+        canvas.setStrokeColor(GRID_COLOR)
+        canvas.setLineWidth(0.5)
+        lines = [(self.col_positions[0], y, self.col_positions[-1], y) for y in self.row_positions]
+        lines += [(x, self.row_positions[-1], x, self.row_positions[0]) for x in self.col_positions]
+        canvas.lines(lines)
+        canvas.restoreState()
+
+    def _wrap(self, text:str, font_name:str, width:float) -> list:
+        """
+        Breaks a cell text greedily into the lines fitting its width. Words wider than the cell are not broken.
+        """
+        font_size = REGISTER_FONT[1]
+        space_width = _string_width(' ', font_name, font_size)
+        lines = []
+        for paragraph in str(text).split('\n'):
+            line, line_width = [], 0
+            for word in paragraph.split():
+                word_width = _string_width(word, font_name, font_size)
+                if line and line_width + space_width + word_width > width + FUZZ:
+                    lines.append(' '.join(line))
+                    line, line_width = [], 0
+                line_width += (space_width if line else 0) + word_width
+                line.append(word)
+            lines.append(' '.join(line))
+        return lines
+
+    def _draw_row(self, cells:list, font_name:str, background=None):
+        _, font_size, leading = REGISTER_FONT
+        cell_lines = [self._wrap(cell, font_name, right - left - 2 * REGISTER_PADDING)
+                      for cell, left, right in zip(cells, self.col_positions, self.col_positions[1:])]
+        height = max(len(lines) for lines in cell_lines) * leading + 2 * REGISTER_PADDING
+        if self.y - height < REGISTER_MARGIN and len(self.row_positions) > 2:
+            self._end_page()
+            self.canvas.showPage()
+            self._begin_page()
+
+        canvas = self.canvas
+        if background is not None:
+            canvas.setFillColor(background)
+            canvas.rect(self.col_positions[0], self.y - height, self.col_positions[-1] - self.col_positions[0], height, stroke=0, fill=1)
+            canvas.setFillColor(colors.black)
+        text_object = canvas.beginText()
+        text_object.setFont(font_name, font_size, leading)
+        for lines, x in zip(cell_lines, self.col_positions):
+            text_object.setTextOrigin(x + REGISTER_PADDING, self.y - REGISTER_PADDING - font_size)
+            text_object.textLines(lines)
+        canvas.drawText(text_object)
+        self.y -= height
+        self.row_positions.append(self.y)
+
+    def add_rows(self, rows:list):
+        """
+        Draws a chunk of rows, moving to the next page the rows that do not fit on the current one.
+        """
+        for row in rows:
+            self._draw_row(row, REGISTER_FONT[0])
+
+    def save(self):
+        self._end_page()
+        self.canvas.save()
+
+def benchmark(missions:list, sources:dict, renderers:tuple=('platypus', 'canvas'), repeat:int=3) -> dict:
+    """
+    Measures the time taken to render the mission orders of the missions with each renderer.
+
+    Returns:
+    - dict: A dictionary mapping each renderer to its best time per mission order, in milliseconds.
+    """
+    timings = {}
+    for renderer in renderers:
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for mission in missions:
+                process.render_pdf(mission, sources, renderer)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        timings[renderer] = best / max(len(missions), 1) * 1000
+    return timings
+
+def profile_sizes(missions:list, sources:dict, renderer:str='canvas') -> dict:
+    """
+    Measures the size of the mission orders of the missions with each output profile (see `process.PDF_PROFILES`).
+
+    Returns:
+    - dict: A dictionary mapping each profile to the average size of a mission order, in bytes.
+    """
+    return {profile: sum(len(process.render_pdf(mission, sources, renderer, profile)) for mission in missions) / max(len(missions), 1)
+            for profile in process.PDF_PROFILES}
+
+if __name__ == '__main__':
+    # Benchmark the renderers on the last downloaded missions
+    missions = model.load_missions('temp/missions.json')
+    with open('temp/sources.json', 'r') as file:
+        sources = json.load(file)
+
+    timings = benchmark(missions, sources)
+    for renderer, timing in timings.items():
+        print(f"{renderer}: {timing:.2f} ms per mission order")
+    print(f"Speed-up: {timings['platypus'] / timings['canvas']:.1f}x")
+
+    sizes = profile_sizes(missions, sources)
+    for profile, size in sizes.items():
+        print(f"{profile}: {size / 1024:.1f} KiB per mission order")
+    print(f"Size reduction: {1 - sizes['compact'] / sizes['standard']:.0%}")
+
+    stats = utils.format_text_stats()
+    print(f"format_text memo: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%} hit rate), {stats['size']} entries")
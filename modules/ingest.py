@@ -1,9 +1,9 @@
 from datetime import datetime, timedelta
 from . import auth
 import base64
+import json
 import os
 import pytz
-import requests
 import sys
 from . import utils
 
@@ -46,7 +46,7 @@ def get_events(dateFrom:datetime, dateTo:datetime=None, departments:list=None, r
     }
 
     # print("Getting mission events...")
-    response = requests.post(connection_str + 'do/list', headers=headers, json=json)
+    response = utils.get_session().post(connection_str + 'do/list', headers=headers, json=json)
     if response.status_code == 200:
         # Return response content only (this is why .json() is used)
         # print(f"Got {len(response.json()['items'])} mission events!")
@@ -57,25 +57,42 @@ def get_events(dateFrom:datetime, dateTo:datetime=None, departments:list=None, r
     else:
         sys.exit(f"Failed to retrieve data: {response.status_code}")
 
-def get_locations(missions: list, min: int = 0, max: int = 100, progress_callback=None) -> list:
+def get_locations_cache_path():
+    """
+    Returns the path to the cache of the mission locations, in the application's data directory.
+    """
+    return os.path.join(utils.get_data_dir(), 'cache', 'locations.json')
+
+def _load_locations_cache() -> dict:
+    try:
+        with open(get_locations_cache_path(), 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+def get_locations(missions: list, min: int = 0, max: int = 100, progress_callback=None, cached: bool = False) -> list:
     """
     Retrieves and appends the location details to each mission in the provided list.
 
     This function iterates through a list of missions, querying an API for each mission's details to extract
     and append location information. It supports updating a progress callback function to notify about the
     progress of location retrieval.
+    Every retrieved location is recorded in the locations cache. With `cached`, the missions whose location is in
+    the cache are not queried, e.g. for the monthly ADR register of past missions.
 
     Parameters:
     - missions (list): A list of dictionaries, where each dictionary represents a mission.
     - min (int, optional): The minimum value for the progress bar. Default is 0.
     - max (int, optional): The maximum value for the progress bar. Default is 100.
     - progress_callback (function, optional): A callback function to update the progress bar.
+    - cached (bool, optional): Whether to use the locations cache. Defaults to False.
 
     Returns:
     - list: The updated list of missions, with location details appended to each mission.
     """
     
     connection_str, headers = utils.init_ppme_api_variables()
+    locations = _load_locations_cache()
     # Variables for process tracking
     total_missions = len(missions)
     processed_count = 0
@@ -86,10 +103,18 @@ def get_locations(missions: list, min: int = 0, max: int = 100, progress_callbac
         # Get mission id (=key)
         id = mission["key"]
 
-        # Query for mission details
-        response = requests.get(connection_str + f"do/{id}", headers=headers)
+        if cached and id in locations:
+            # Use the cached location
+            if locations[id]:
+                mission["location"] = locations[id]
+            response = None
+        else:
+            # Query for mission details
+            response = utils.get_session().get(connection_str + f"do/{id}", headers=headers)
 
-        if response.status_code == 200:
+        if response is None:
+            pass
+        elif response.status_code == 200:
             # Extract location info in "place" dictionary, out of mission details
             place = response.json()["place"]
 
@@ -108,6 +133,7 @@ def get_locations(missions: list, min: int = 0, max: int = 100, progress_callbac
                 # Append locations to mission
             if address:
                 mission["location"] = address
+            locations[id] = address
 
         elif response.status_code == 401:
             sys.exit(f"Please (re)authenticate to PlanningPME API before requesting for data. {response.status_code} Unauthorized.")
@@ -120,6 +146,7 @@ def get_locations(missions: list, min: int = 0, max: int = 100, progress_callbac
         if progress_callback:
             progress_callback(progress, min, max)
 
+    utils.save_to_json(get_locations_cache_path(), locations)
     # print("Got the locations!")
     return missions
 
@@ -172,16 +199,16 @@ def get_departments(id:int=None):
     }
 
     if id==None:
-        response = requests.get(connection_str + 'department', params=params, headers=headers)
+        response = utils.get_session().get(connection_str + 'department', params=params, headers=headers)
 
     else:
-        response = requests.get(connection_str + 'department/' + str(id), params=params, headers=headers)    
+        response = utils.get_session().get(connection_str + 'department/' + str(id), params=params, headers=headers)    
 
     return response
 
 def get_categories():
     connection_str, headers = utils.init_ppme_api_variables()
-    response = requests.get(connection_str + 'category', headers=headers)
+    response = utils.get_session().get(connection_str + 'category', headers=headers)
 
     return response
 
@@ -199,26 +226,109 @@ def get_sent_elements(access_token:str):
         "Content-Type": "application/json"
     }
 
-    # Make the GET request
-    response = requests.get(url, headers=headers)
+    elements = []
+    # Follow the next page links until all messages have been retrieved
+    while url:
+        # Make the GET request
+        response = utils.get_session().get(url, headers=headers)
+
+        # Check if the request was successful
+        if response.status_code == 200:
+            # Parse the JSON data from the response
+            data = response.json()
+            # Print out the subject, time sent, and recipient of each email in the Sent Items folder
+            for message in data.get('value', []):
+                subject = message['subject']
+                sent_time = message['receivedDateTime']
+                recipients = ', '.join([recipient['emailAddress']['address'] for recipient in message['toRecipients']])
+                elements.append({'recipients': recipients, 'subject': subject, 'sent_time': sent_time})
+            url = data.get('@odata.nextLink')
+        else:
+            raise ValueError(f"Failed to retrieve data: {response.status_code}")
+            # print("Failed to retrieve data:", response.status_code)
+    return elements
+
+def get_sent_elements_delta(access_token:str, delta_link:str=None, days:int=30):
+    """
+    Retrieves the changes in the Sent Items folder since the previous call, using a Microsoft Graph delta query.
+
+    Without a delta link, the messages sent during the last `days` days are retrieved. With the delta link returned by a
+    previous call, only the messages added or removed since then are retrieved. All result pages are followed. If Graph
+    no longer accepts the delta link (410 Gone), a full retrieval is done instead.
+
+    Parameters:
+    - access_token (str): The Microsoft Graph access token.
+    - delta_link (str, optional): The delta link returned by the previous call.
+    - days (int, optional): The number of days to look back for when no delta link is provided. Defaults to 30.
+
+    Returns:
+    - tuple: A tuple containing:
+        - list: The added or updated messages, as dictionaries with 'id', 'subject', 'recipients' (list) and 'sent_time'.
+        - list: The ids of the removed messages.
+        - str: The delta link to use for the next call.
+
+    Raises:
+    - ValueError: If the access token is rejected, or if the request fails.
+    """
+    if delta_link:
+        url = delta_link
+    else:
+        start_date = datetime.today() - timedelta(days=days)
+        start_date_str = start_date.strftime('%Y-%m-%dT%H:%M:%SZ')  # Format date in ISO 8601
+        url = f"https://graph.microsoft.com/v1.0/me/mailFolders/sentItems/messages/delta?$select=subject,sentDateTime,toRecipients&$filter=receivedDateTime ge {start_date_str}"
+
+    headers = {
+        "Authorization": f"Bearer {access_token}",
+        "Prefer": "odata.maxpagesize=200"
+    }
+
+    elements = []
+    removed = []
+    # Follow the next page links until the delta link is returned
+    while url:
+        response = utils.get_session().get(url, headers=headers)
+        if response.status_code == 410 and delta_link:
+            # The delta link expired, start over with a full retrieval
+            return get_sent_elements_delta(access_token, None, days)
+        if response.status_code != 200:
+            raise ValueError(f"Failed to retrieve data: {response.status_code}")
 
-    # Check if the request was successful
-    if response.status_code == 200:
-        # Parse the JSON data from the response
         data = response.json()
-        # Print out the subject, time sent, and recipient of each email in the Sent Items folder
-        elements = []
         for message in data.get('value', []):
-            subject = message['subject']
-            sent_time = message['receivedDateTime']
-            recipients = ', '.join([recipient['emailAddress']['address'] for recipient in message['toRecipients']])
-            elements.append({'recipients': recipients, 'subject': subject, 'sent_time': sent_time})
-        return elements
-    else:
-        raise ValueError(f"Failed to retrieve data: {response.status_code}")
-        # print("Failed to retrieve data:", response.status_code)
+            if '@removed' in message:
+                removed.append(message['id'])
+                continue
+            elements.append({
+                'id': message['id'],
+                'subject': message.get('subject') or '',
+                'recipients': [recipient['emailAddress']['address'] for recipient in message.get('toRecipients') or []],
+                'sent_time': message.get('sentDateTime')
+            })
+        url = data.get('@odata.nextLink')
+        delta_link = data.get('@odata.deltaLink', delta_link)
+
+    return elements, removed, delta_link
+
+def download_sharepoint_file(missions, access_token, min, max, progress_callback=None, link_threshold:int=None):
+    """
+    Downloads the SharePoint files linked to the missions into './temp/attachments/<day>/<mission key>/'.
+
+    Files larger than `link_threshold` bytes are not downloaded: they are recorded in the mission's 'attachmentSharedLinks'
+    list instead (name, SharePoint URL and size, taken from the driveItem metadata), so that the mission order email can
+    link to them rather than carry a copy.
 
-def download_sharepoint_file(missions, access_token, min, max, progress_callback=None):
+    Parameters:
+    - missions (list): The cleaned missions.
+    - access_token (str): The Microsoft Graph access token.
+    - min (int): The minimum value for the progress bar.
+    - max (int): The maximum value for the progress bar.
+    - progress_callback (function, optional): A callback function to update the progress bar.
+    - link_threshold (int, optional): The size in bytes above which files are linked instead of downloaded. Defaults
+      to None, which downloads all files.
+
+    Returns:
+    - list: The updated list of missions.
+    """
     keys = []
     for mission in missions:
         links = mission.get("attachmentLinks")
@@ -232,6 +342,7 @@ def download_sharepoint_file(missions, access_token, min, max, progress_callback
             links = mission.get("attachmentLinks")
             if links != []:
                 mission['attachmentFileNames'] = []
+                mission['attachmentSharedLinks'] = []
                 for index, link in enumerate(links):
                     # Raise an exception if the link provided starts with "\\Vilv8PPMEP", which is not supported anymore. The planners should use SharePoint to store the files instead.
                     if link.startswith('\\\\Vilv8PPMEP') or link.startswith('\\\\VILV8PPMEP'):
@@ -254,8 +365,18 @@ def download_sharepoint_file(missions, access_token, min, max, progress_callback
                     if not any(filename.endswith(ext) for ext in allowed_extensions):
                         raise NameError(f"The provided link at:\n\nPlanningPME > mission n°{mission.get('key')} of {mission.get('start')} with {mission.get('resources')[0].get('lastName')} for {mission.get('customers')[0].get('label') if mission.get('customers') else None} > Extra info > link interventiondoc {index+1}\n\npoints to an unauthorized file type. Please use a pdf, Word or Excel document, or an image instead.")
 
+                    # Link large files instead of downloading them
+                    if link_threshold is not None and drive_item_info.get('size', 0) > link_threshold:
+                        mission['attachmentSharedLinks'].append({
+                            'name': drive_item_info.get('name'),
+                            'url': drive_item_info.get('webUrl') or link,
+                            'size': drive_item_info.get('size')
+                        })
+                        mission['attachmentFileNames'].append(drive_item_info.get('name'))
+                        continue
+
                     graph_url = drive_item_info.get('@microsoft.graph.downloadUrl')
-                    response = requests.get(graph_url, headers=headers)
+                    response = utils.get_session().get(graph_url, headers=headers)
                     response.raise_for_status()
 
                     if not os.path.exists(os.path.dirname(dir)):
@@ -282,7 +403,7 @@ def transform_sharepoint_url(sharepoint_url, access_token):
     # Step 1: Get the drive item ID from the SharePoint link
     drive_item_url = f"https://graph.microsoft.com/v1.0/shares/u!{encoded_link}/driveItem"
 
-    response = requests.get(drive_item_url, headers=headers)
+    response = utils.get_session().get(drive_item_url, headers=headers)
     if response.status_code != 200:
         if response.status_code == 403:
             raise NameError
@@ -304,7 +425,7 @@ def get_user_details(access_token):
     }
     
     # Make the GET request to the Microsoft Graph API
-    response = requests.get(url, headers=headers)
+    response = utils.get_session().get(url, headers=headers)
     
     # Check if the request was successful
     if response.status_code == 200:
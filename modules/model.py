@@ -0,0 +1,218 @@
+from dataclasses import dataclass, field
+from datetime import datetime
+import json
+import keyword
+import sys
+
+# Constants
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'  # Format of the start and end of the cleaned missions
+
+def _intern(value):
+    """
+    Interns a string, so that the values repeated across missions (agent names, customers, sources...) are stored once.
+    """
+    return sys.intern(value) if isinstance(value, str) else value
+
+class _Record:
+    """
+    Read access to a model as to the dictionary of the JSON it was loaded from (see `process.clean_data`): `record['key']`,
+    `record.get('key')`, `'key' in record`, `record.items()`... return the JSON values, so that the code written for the
+    dictionaries works with the models unchanged. The keys of the JSON that are not fields of the model are kept in
+    `extra`, the fields missing from the JSON in `absent`, and the order of the keys in `order` if it is not the one
+    of `FIELDS`, so that `to_dict` gives back the JSON as loaded.
+    """
+    __slots__ = ()
+    FIELDS = ()  # Keys of the JSON held in fields of the model, in the order of the JSON
+    INTERNED = ()  # Fields whose strings, or lists of strings, are interned
+
+    @staticmethod
+    def _attribute(name:str) -> str:
+        return name + '_' if keyword.iskeyword(name) else name  # e.g. 'return' is held in `return_`
+
+    def _json_value(self, name:str):
+        return getattr(self, self._attribute(name))
+
+    def __getitem__(self, name:str):
+        if name in self.FIELDS and name not in self.absent:
+            return self._json_value(name)
+        if self.extra and name in self.extra:
+            return self.extra[name]
+        raise KeyError(name)
+
+    def get(self, name:str, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def __contains__(self, name:str) -> bool:
+        return (name in self.FIELDS and name not in self.absent) or bool(self.extra and name in self.extra)
+
+    def keys(self) -> list:
+        if self.order:
+            return list(self.order)
+        return [name for name in self.FIELDS if name not in self.absent] + list(self.extra or ())
+
+    def items(self) -> list:
+        return [(name, self[name]) for name in self.keys()]
+
+    def to_dict(self) -> dict:
+        """
+        Returns the JSON dictionary of the model, as it was loaded.
+        """
+        return {name: to_json(value) for name, value in self.items()}
+
+    @classmethod
+    def _field_values(cls, data:dict) -> dict:
+        """
+        Returns the arguments of the constructor of the model for a JSON dictionary.
+        """
+        values = {cls._attribute(name): data[name] for name in cls.FIELDS if name in data}
+        for name in cls.INTERNED:
+            value = values.get(name)
+            values[name] = [_intern(item) for item in value] if isinstance(value, list) else _intern(value)
+        values['absent'] = tuple(name for name in cls.FIELDS if name not in data)
+        extra = {key: value for key, value in data.items() if key not in cls.FIELDS}
+        values['extra'] = extra or None
+        keys = tuple(data)
+        if keys != tuple(name for name in cls.FIELDS if name in data) + tuple(extra):
+            values['order'] = keys
+        return values
+
+    @classmethod
+    def from_dict(cls, data:dict):
+        return cls(**cls._field_values(data))
+
+@dataclass(slots=True)
+class Resource(_Record):
+    """
+    An agent of a mission.
+    """
+    FIELDS = ('lastName', 'firstName', 'mobile1', 'mobile2', 'email', 'AVnumber', 'ADR')
+    INTERNED = ('lastName', 'firstName', 'email')
+
+    lastName: str = None
+    firstName: str = None
+    mobile1: str = None
+    mobile2: str = None
+    email: str = None
+    AVnumber: str = None
+    ADR: bool = None
+    extra: dict = None
+    absent: tuple = ()
+    order: tuple = None
+
+@dataclass(slots=True)
+class Customer(_Record):
+    """
+    A customer of a mission.
+    """
+    FIELDS = ('label', 'phone1', 'phone2')
+    INTERNED = ('label',)
+
+    label: str = None
+    phone1: str = None
+    phone2: str = None
+    extra: dict = None
+    absent: tuple = ()
+    order: tuple = None
+
+@dataclass(slots=True)
+class Mission(_Record):
+    """
+    A cleaned mission (see `process.clean_data`), with its start and end parsed once into datetimes, and the agent names
+    prefixing the file names of its documents computed once (see `file_prefix`).
+    """
+    FIELDS = ('key', 'resources', 'start', 'end', 'comments', 'customers', 'SOnumber', 'departurePlace', 'vehicle',
+              'equipment', 'techniques', 'normCr', 'sources', 'location', 'oneWayTransport', 'return', 'attachmentLinks')
+    INTERNED = ('departurePlace', 'vehicle', 'equipment', 'techniques', 'normCr', 'sources')
+
+    key: str = None
+    resources: list = field(default_factory=list)
+    start: datetime = None
+    end: datetime = None
+    comments: list = field(default_factory=list)
+    customers: list = field(default_factory=list)
+    SOnumber: str = None
+    departurePlace: str = None
+    vehicle: str = None
+    equipment: list = field(default_factory=list)
+    techniques: list = field(default_factory=list)
+    normCr: list = field(default_factory=list)
+    sources: list = field(default_factory=list)
+    location: str = None
+    oneWayTransport: bool = None
+    return_: bool = False
+    attachmentLinks: list = field(default_factory=list)
+    extra: dict = None
+    absent: tuple = ()
+    order: tuple = None
+    file_prefix: str = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        self.file_prefix = "".join(f"{resource.get('lastName')} {resource.get('firstName')} - " for resource in self.resources)
+
+    @property
+    def day(self) -> str:
+        """
+        Returns the day of the mission, as used in the paths of its documents: '<year><month><day>'.
+        """
+        return self.start.strftime('%Y%m%d')
+
+    def _json_value(self, name:str):
+        if name == 'start' or name == 'end':
+            value = getattr(self, name)
+            return value.strftime(DATE_FORMAT) if value is not None else None
+        return getattr(self, self._attribute(name))
+
+    @classmethod
+    def from_dict(cls, data:dict):
+        values = cls._field_values(data)
+        values['resources'] = [Resource.from_dict(resource) for resource in values.get('resources') or []]
+        values['customers'] = [Customer.from_dict(customer) for customer in values.get('customers') or []]
+        for name in ('start', 'end'):
+            if values.get(name) is not None:
+                values[name] = datetime.strptime(values[name], DATE_FORMAT)
+        return cls(**values)
+
+def to_json(value):
+    """
+    Converts a model, or a list of models, to its JSON value.
+    """
+    if isinstance(value, _Record):
+        return value.to_dict()
+    if isinstance(value, list):
+        return [to_json(item) for item in value]
+    return value
+
+def json_default(value):
+    """
+    The `default` of `json.dumps` for the values holding models: the models are serialized as their JSON dictionary,
+    anything else as its string.
+    """
+    return value.to_dict() if isinstance(value, _Record) else str(value)
+
+def start_of(mission) -> datetime:
+    """
+    Returns the start of a mission, `Mission` or dictionary, as a datetime.
+    """
+    return mission.start if isinstance(mission, Mission) else datetime.strptime(mission['start'], DATE_FORMAT)
+
+def end_of(mission) -> datetime:
+    """
+    Returns the end of a mission, `Mission` or dictionary, as a datetime.
+    """
+    return mission.end if isinstance(mission, Mission) else datetime.strptime(mission['end'], DATE_FORMAT)
+
+def as_mission(mission) -> Mission:
+    """
+    Returns a mission as a `Mission`, converting it if it is still a dictionary.
+    """
+    return mission if isinstance(mission, Mission) else Mission.from_dict(mission)
+
+def load_missions(path:str) -> list:
+    """
+    Loads the cleaned missions of a JSON file, such as './temp/missions.json', as `Mission` objects.
+    """
+    with open(path, 'r') as file:
+        return [Mission.from_dict(mission) for mission in json.load(file)]
@@ -0,0 +1,145 @@
+from modules import utils
+from PIL import Image, ImageOps
+import hashlib
+import os
+import shutil
+import tempfile
+
+# Optional dependencies: HEIC support for Pillow, and PDF recompression
+try:
+    from pillow_heif import register_heif_opener
+    register_heif_opener()
+except ImportError:
+    pass
+
+try:
+    from pypdf import PdfWriter
+except ImportError:
+    PdfWriter = None
+
+# Constants
+MAX_IMAGE_DIMENSION = 1600  # Largest side in pixels of the optimized images
+JPEG_QUALITY = 80
+PDF_OPTIMIZE_THRESHOLD = 1024 * 1024  # PDFs smaller than this (in bytes) are sent as is
+IMAGE_EXTENSIONS = ('.jpeg', '.jpg', '.png', '.heic')
+PROFILE = f"{MAX_IMAGE_DIMENSION}-{JPEG_QUALITY}-{PDF_OPTIMIZE_THRESHOLD}"  # Part of the cache key, so that changing the settings invalidates the cache
+
+# Content hashes of the files already seen in this session, keyed by (path, size, modification time)
+_hashes = {}
+
+def get_cache_dir():
+    """
+    Returns the directory where the optimized attachments are cached, in the application's data directory.
+    """
+    return os.path.join(utils.get_data_dir(), 'cache', 'attachments')
+
+def _content_hash(path:str) -> str:
+    """
+    Returns the hash of a file's content and of the optimization settings, computing it only once per session.
+    """
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+    if memo_key not in _hashes:
+        _hashes[memo_key] = hashlib.sha256(f"{utils.file_hash(path)}-{PROFILE}".encode()).hexdigest()
+    return _hashes[memo_key]
+
+def _optimize_image(path:str, output_dir:str):
+    """
+    Downscales an image to `MAX_IMAGE_DIMENSION` and re-encodes it. Photos (JPEG, HEIC) are saved as JPEG, PNG files
+    stay PNG so that drawings and screenshots keep sharp edges.
+
+    Returns:
+    - str: The path to the optimized image.
+    """
+    name, extension = os.path.splitext(os.path.basename(path))
+    with Image.open(path) as image:
+        image = ImageOps.exif_transpose(image)  # Apply the orientation of phone photos before dropping their metadata
+        image.thumbnail((MAX_IMAGE_DIMENSION, MAX_IMAGE_DIMENSION))
+        if extension.lower() == '.png':
+            output_path = os.path.join(output_dir, name + extension)
+            image.save(output_path, optimize=True)
+        else:
+            output_path = os.path.join(output_dir, name + '.jpg')
+            image.convert('RGB').save(output_path, 'JPEG', quality=JPEG_QUALITY, optimize=True)
+    return output_path
+
+def _optimize_pdf(path:str, output_dir:str):
+    """
+    Recompresses a PDF: its content streams are compressed, identical objects merged and its images re-encoded.
+
+    Returns:
+    - str: The path to the optimized PDF, or None if the PDF is small enough or pypdf is not installed.
+    """
+    if PdfWriter is None or os.path.getsize(path) < PDF_OPTIMIZE_THRESHOLD:
+        return None
+    writer = PdfWriter(clone_from=path)
+    for page in writer.pages:
+        for image in page.images:
+            image.replace(image.image, quality=JPEG_QUALITY)
+        page.compress_content_streams()
+    writer.compress_identical_objects(remove_identicals=True, remove_orphans=True)
+    output_path = os.path.join(output_dir, os.path.basename(path))
+    with open(output_path, 'wb') as file:
+        writer.write(file)
+    return output_path
+
+def optimize_attachment(path:str) -> str:
+    """
+    Returns a lighter variant of an attachment, cached by content hash.
+
+    Images are downscaled and re-encoded, and large PDFs are recompressed. The variant is kept only if it is smaller
+    than the original. The result is cached by the hash of the file's content, so that sending the same file again
+    costs nothing extra. Other files, and files that cannot be optimized, are returned unchanged.
+
+    Parameters:
+    - path (str): The path to the attachment.
+
+    Returns:
+    - str: The path to the optimized attachment, or the original path.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in IMAGE_EXTENSIONS and extension != '.pdf':
+        return path
+
+    output_dir = os.path.join(get_cache_dir(), _content_hash(path))
+    original_marker = os.path.join(output_dir, '.original')
+
+    # Cache hit
+    if os.path.exists(original_marker):
+        return path
+    if os.path.isdir(output_dir):
+        cached = os.listdir(output_dir)
+        if cached:
+            return os.path.join(output_dir, cached[0])
+
+    # The variant is written to a temporary directory and moved into the cache once complete, so that an interrupted
+    # optimization never leaves a truncated file in the cache
+    os.makedirs(get_cache_dir(), exist_ok=True)
+    work_dir = tempfile.mkdtemp(prefix='.optimizing-', dir=get_cache_dir())
+    try:
+        try:
+            if extension == '.pdf':
+                output_path = _optimize_pdf(path, work_dir)
+            else:
+                output_path = _optimize_image(path, work_dir)
+        except Exception:
+            output_path = None  # Unreadable or unsupported file, send it as is
+
+        os.makedirs(output_dir, exist_ok=True)
+        if output_path and os.path.getsize(output_path) < os.path.getsize(path):
+            cached_path = os.path.join(output_dir, os.path.basename(output_path))
+            os.replace(output_path, cached_path)
+            return cached_path
+
+        # Remember that the original is the best variant
+        open(os.path.join(work_dir, '.original'), 'w').close()
+        os.replace(os.path.join(work_dir, '.original'), original_marker)
+        return path
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def optimize_attachments(file_paths:list) -> list:
+    """
+    Returns the optimized variants of a list of attachments (see `optimize_attachment`).
+    """
+    return [optimize_attachment(file_path) for file_path in file_paths]
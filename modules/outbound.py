@@ -1,76 +1,734 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
-from modules import auth
+from email.header import Header
+from email.message import MIMEPart
+from email.utils import encode_rfc2231, formatdate, make_msgid
+from modules import auth, utils
 import base64
+import email.policy
+import io
+import keyring
+import mimetypes
 import os
-import requests
+import re
+import smtplib
+import ssl
+import threading
+import time
+import uuid
 
-def send_email(subject:str, recipients:list, content:str, file_paths:list=None, from_address:str=None):
-    load_dotenv(override=True)
-    
-    # Constants
-    access_token = os.environ.get('MS_ACCESS_TOKEN')
-    SENDMAIL_ENDPOINT = 'https://graph.microsoft.com/v1.0/me/sendMail'
-    
-    headers = {
-        'Authorization': f'Bearer {access_token}',
-        'Content-Type': 'application/json'
-    }
-    
-    # Create the email message payload
-    email_data = {
-        "message": {
-            "subject": subject,
-            "body": {
-                "contentType": "Text",
-                "content": content
-            },
-            "toRecipients": [
-                {
-                    "emailAddress": {
-                        "address": recipient}} for recipient in recipients
-            ],
-            "attachments": []
+# Constants
+SENDMAIL_ENDPOINT = 'https://graph.microsoft.com/v1.0/me/sendMail'
+MESSAGES_ENDPOINT = 'https://graph.microsoft.com/v1.0/me/messages'
+INLINE_ATTACHMENTS_LIMIT = 3 * 1024 * 1024  # Attachments above this size (in bytes) must go through an upload session
+UPLOAD_CHUNK_SIZE = 10 * 320 * 1024  # Upload session chunks must be a multiple of 320 KiB, and at most 4 MiB
+MAX_CONCURRENT_REQUESTS = 4  # Exchange Online allows at most 4 concurrent requests per mailbox
+MAX_RETRIES = 5  # Maximum number of retries of a throttled request
+BATCH_ENDPOINT = 'https://graph.microsoft.com/v1.0/$batch'
+MAX_BATCH_REQUESTS = 20  # Graph accepts at most 20 requests per $batch call
+MAX_BATCH_PAYLOAD = 4 * 1024 * 1024  # Graph rejects request bodies above 4 MB
+SMTP_TIMEOUT = 60  # Timeout in seconds of the SMTP socket operations
+MIME_CHUNK_SIZE = 57 * 1024  # Attachments are read and base64 encoded by chunks of whole 76 characters lines
+RETRYABLE_STATUS_CODES = (408, 429)  # Client errors that may go away when the email is sent again, like all the server errors
+
+# Shared throttling state: when Graph answers 429/503 with a Retry-After header, every sender waits until it expires
+_throttle_lock = threading.Lock()
+_throttled_until = 0.0
+
+# Serializes access token refreshes between concurrent senders
+_refresh_lock = threading.Lock()
+
+def _wait_for_throttle():
+    """
+    Sleeps until the mailbox-wide throttling delay requested by Graph, if any, has expired.
+    """
+    with _throttle_lock:
+        delay = _throttled_until - time.monotonic()
+    if delay > 0:
+        time.sleep(delay)
+
+def _throttle(headers:dict, attempt:int):
+    """
+    Records the delay requested by Graph in the headers of a throttled response, so that all senders back off.
+
+    The delay is read from the Retry-After header (in seconds). If the header is missing, an exponential
+    backoff based on the attempt number is used instead.
+    """
+    global _throttled_until
+    retry_after = str((headers or {}).get('Retry-After', ''))
+    delay = float(retry_after) if retry_after.isdigit() else float(2 ** attempt)
+    with _throttle_lock:
+        _throttled_until = max(_throttled_until, time.monotonic() + delay)
+
+def _refresh_access_token(stale_token:str):
+    """
+    Refreshes the Microsoft Graph access token, unless another sender already did it in the meantime.
+    """
+    with _refresh_lock:
+        load_dotenv(override=True)
+        access_token = os.environ.get('MS_ACCESS_TOKEN')
+        if access_token and access_token != stale_token:
+            return access_token
+        return auth.refresh_access_token()
+
+def graph_request(method:str, url:str, access_token:str=None, **kwargs):
+    """
+    Sends a request to Microsoft Graph, handling throttling and access token expiry.
+
+    Throttled requests (429, 503, 504) are retried after the delay given by Graph in the Retry-After header.
+    If the access token is rejected (401), it is refreshed once and the request is sent again.
+
+    Parameters:
+    - method (str): The HTTP method.
+    - url (str): The Graph URL.
+    - access_token (str, optional): The access token to use. Defaults to the one stored in the environment.
+    - **kwargs: Additional arguments passed to `requests.Session.request`, such as `json`.
+
+    Returns:
+    - requests.Response: The last response received from Graph.
+    """
+    if not access_token:
+        load_dotenv(override=True)
+        access_token = os.environ.get('MS_ACCESS_TOKEN')
+    headers = {'Content-Type': 'application/json', **kwargs.pop('headers', {})}
+    refreshed = False
+    attempt = 0
+    while True:
+        _wait_for_throttle()
+        headers['Authorization'] = f'Bearer {access_token}'
+        response = utils.get_session().request(method, url, headers=headers, **kwargs)
+        if response.status_code in (429, 503, 504) and attempt < MAX_RETRIES:
+            _throttle(response.headers, attempt)
+            attempt += 1
+        elif response.status_code == 401 and not refreshed:
+            access_token = _refresh_access_token(access_token)
+            refreshed = True
+        else:
+            return response
+
+class SendError(Exception):
+    """
+    An email refused by the server. `retryable` is False if sending it again cannot succeed, e.g. when the user is not
+    allowed to send from the mailbox or a recipient does not exist.
+    """
+    def __init__(self, message:str, retryable:bool=True):
+        super().__init__(message)
+        self.retryable = retryable
+
+def is_retryable(error) -> bool:
+    """
+    Returns whether an error raised while sending an email may go away when the email is sent again. Only the refusals
+    known to be permanent (see `SendError`) are not retryable: network errors, for instance, are.
+    """
+    return getattr(error, 'retryable', True)
+
+def send_error(status_code:int, recipients:list, reason:str=''):
+    """
+    Returns the error message to report for a refused email, or None if Graph accepted it.
+
+    Parameters:
+    - status_code (int): The status code of the response to the send request.
+    - recipients (list): The recipients of the email, used in the error message.
+    - reason (str, optional): The reason given by Graph.
+    """
+    if status_code == 403:
+        return f"The authenticated user is not authorized to use the 'NDTplanning@vincotte.be' email address to send generate mission orders. Please ask ICT to grant access to 'NDTplanning@vincotte.be' for your account, 'avXXXX@vincotte.org'."
+    if status_code >= 400:
+        return f"Failed to send email to {[recipient for recipient in recipients]}. {status_code} {reason}"
+    return None
+
+def send_exception(status_code:int, recipients:list, reason:str=''):
+    """
+    Returns the `SendError` to report for an email refused by Graph, or None if Graph accepted it. The client errors
+    (4xx) are permanent, apart from `RETRYABLE_STATUS_CODES`.
+    """
+    error = send_error(status_code, recipients, reason)
+    if error:
+        return SendError(error, status_code >= 500 or status_code in RETRYABLE_STATUS_CODES)
+    return None
+
+def raise_for_send_status(response, recipients:list):
+    """
+    Raises an explicit exception if Graph refused to send an email.
+
+    Parameters:
+    - response (requests.Response): The response to the send request.
+    - recipients (list): The recipients of the email, used in the error message.
+
+    Raises:
+    - SendError: If Graph refused the email.
+    """
+    error = send_exception(response.status_code, recipients, response.reason)
+    if error:
+        raise error
+
+def _build_message(subject:str, recipients:list, content:str, from_address:str=None) -> dict:
+    """
+    Builds the Graph message resource of an email, without its attachments.
+    """
+    message = {
+        "subject": subject,
+        "body": {
+            "contentType": "Text",
+            "content": content
         },
-        "saveToSentItems": True,
+        "toRecipients": [
+            {
+                "emailAddress": {
+                    "address": recipient}} for recipient in recipients
+        ]
     }
 
     # Add the from address if provided
     if from_address:
-        email_data["message"]["from"] = {
+        message["from"] = {
             "emailAddress": {
                 "address": from_address
             }
         }
-    
-    # Add an attachment if a file path is provided
-    if file_paths:
-        for file_path in file_paths:
-            with open(file_path, "rb") as file:
-                # Read the file and encode it in base64
-                file_content = base64.b64encode(file.read()).decode()
-                
-            # Get the file name
-            file_name = file_path.split('/')[-1]
-            
-            # Add the attachment to the message payload
-            email_data["message"]["attachments"].append({
-                "@odata.type": "#microsoft.graph.fileAttachment",
-                "name": file_name,
-                "contentType": "application/octet-stream",  # You might want to adjust this based on the file type
-                "contentBytes": file_content
-            })
+    return message
+
+def _attachments(file_paths:list=None, documents:list=None) -> list:
+    """
+    Lists the attachments of an email, whether they are files on disk or documents held in memory.
+
+    Parameters:
+    - file_paths (list, optional): The paths of the files to attach.
+    - documents (list, optional): The in-memory documents to attach, as dictionaries with a 'name' and a 'content' (bytes).
+
+    Returns:
+    - list: A (name, size, open) tuple per attachment, where `open` returns a binary file object to read it from.
+    """
+    attachments = [(os.path.basename(file_path), os.path.getsize(file_path), lambda file_path=file_path: open(file_path, "rb"))
+                   for file_path in file_paths or []]
+    attachments += [(document['name'], len(document['content']), lambda document=document: io.BytesIO(document['content']))
+                    for document in documents or []]
+    return attachments
+
+def _file_attachment(name:str, open_attachment) -> dict:
+    """
+    Reads an attachment and returns it as a Graph file attachment, with its content encoded in base64.
+    """
+    with open_attachment() as file:
+        # Read the file and encode it in base64
+        file_content = base64.b64encode(file.read()).decode()
+        
+    return {
+        "@odata.type": "#microsoft.graph.fileAttachment",
+        "name": name,
+        "contentType": "application/octet-stream",  # You might want to adjust this based on the file type
+        "contentBytes": file_content
+    }
+
+def _sendmail_payload(subject:str, recipients:list, content:str, file_paths:list=None, from_address:str=None,
+                      documents:list=None) -> dict:
+    """
+    Builds the body of a `sendMail` request, with the attachments embedded in base64.
+    """
+    # Create the email message payload
+    email_data = {
+        "message": _build_message(subject, recipients, content, from_address),
+        "saveToSentItems": True,
+    }
+    email_data["message"]["attachments"] = [_file_attachment(name, open_attachment)
+                                            for name, _, open_attachment in _attachments(file_paths, documents)]
+    return email_data
+
+def send_email(subject:str, recipients:list, content:str, file_paths:list=None, from_address:str=None, documents:list=None):
+    """
+    Sends an email with Microsoft Graph on behalf of the authenticated user.
+
+    Small emails are sent in a single `sendMail` request, with their attachments embedded in base64. If an attachment
+    is larger than the inline limit, or the attachments together exceed it, the email is sent with
+    `send_email_with_upload_sessions` instead, which keeps memory usage bounded whatever the attachment sizes.
+
+    Parameters:
+    - subject (str): The subject of the email.
+    - recipients (list): The email addresses of the recipients.
+    - content (str): The plain text body of the email.
+    - file_paths (list, optional): The paths of the files to attach.
+    - from_address (str, optional): The address to send the email from, if different from the user's.
+    - documents (list, optional): The in-memory documents to attach, as dictionaries with a 'name' and a 'content'
+      (bytes), e.g. PDFs rendered without being written to disk.
+    """
+    if sum(size for _, size, _ in _attachments(file_paths, documents)) > INLINE_ATTACHMENTS_LIMIT:
+        send_email_with_upload_sessions(subject, recipients, content, file_paths, from_address, documents)
+        return
     
     # Send the email
+    response = graph_request('POST', SENDMAIL_ENDPOINT, json=_sendmail_payload(subject, recipients, content, file_paths, from_address, documents))
+    raise_for_send_status(response, recipients)
+
+def _upload_file(upload_url:str, name:str, open_attachment, size:int):
+    """
+    Uploads an attachment to a Graph upload session, chunk by chunk, straight from disk (or memory).
+
+    The upload URL is pre-authenticated, so no Authorization header is sent with the chunks.
+    """
+    with open_attachment() as file:
+        start = 0
+        while start < size:
+            chunk = file.read(UPLOAD_CHUNK_SIZE)
+            end = start + len(chunk) - 1
+            headers = {
+                'Content-Type': 'application/octet-stream',
+                'Content-Length': str(len(chunk)),
+                'Content-Range': f'bytes {start}-{end}/{size}'
+            }
+            attempt = 0
+            while True:
+                _wait_for_throttle()
+                response = utils.get_session().put(upload_url, headers=headers, data=chunk)
+                if response.status_code in (429, 503, 504) and attempt < MAX_RETRIES:
+                    _throttle(response.headers, attempt)
+                    attempt += 1
+                else:
+                    break
+            if response.status_code >= 400:
+                raise Exception(f"Failed to upload attachment \"{name}\". {response.status_code} {response.reason}")
+            start = end + 1
+
+def send_email_with_upload_sessions(subject:str, recipients:list, content:str, file_paths:list=None, from_address:str=None,
+                                    documents:list=None):
+    """
+    Sends an email with large attachments by creating a draft, attaching the files to it and then sending it.
+
+    Files up to the inline limit are attached one request at a time. Larger files are streamed from disk
+    through a Graph attachment upload session, in chunks of `UPLOAD_CHUNK_SIZE` bytes, so that memory usage does
+    not grow with the size of the files. The draft is deleted if any step fails.
+
+    Parameters:
+    - subject (str): The subject of the email.
+    - recipients (list): The email addresses of the recipients.
+    - content (str): The plain text body of the email.
+    - file_paths (list, optional): The paths of the files to attach.
+    - from_address (str, optional): The address to send the email from, if different from the user's.
+    - documents (list, optional): The in-memory documents to attach (see `send_email`).
+    """
+    # Create the draft
+    response = graph_request('POST', MESSAGES_ENDPOINT, json=_build_message(subject, recipients, content, from_address))
+    raise_for_send_status(response, recipients)
+    message_url = f"{MESSAGES_ENDPOINT}/{response.json()['id']}"
+
     try:
-        response = requests.post(SENDMAIL_ENDPOINT, headers=headers, json=email_data)
-        response.raise_for_status()
-    except requests.exceptions.HTTPError:
+        # Attach the files
+        for name, size, open_attachment in _attachments(file_paths, documents):
+            if size <= INLINE_ATTACHMENTS_LIMIT:
+                response = graph_request('POST', f"{message_url}/attachments", json=_file_attachment(name, open_attachment))
+                raise_for_send_status(response, recipients)
+            else:
+                response = graph_request('POST', f"{message_url}/attachments/createUploadSession", json={
+                    "AttachmentItem": {
+                        "attachmentType": "file",
+                        "name": name,
+                        "size": size
+                    }
+                })
+                raise_for_send_status(response, recipients)
+                _upload_file(response.json()['uploadUrl'], name, open_attachment, size)
+
+        # Send the draft
+        response = graph_request('POST', f"{message_url}/send")
+        raise_for_send_status(response, recipients)
+    except Exception:
+        # Do not leave a half-built draft behind
+        graph_request('DELETE', message_url)
+        raise
+
+def _estimated_payload_size(message:dict) -> int:
+    """
+    Estimates the size in bytes of the `sendMail` request of an email, without reading its attachments.
+    """
+    attachments_size = sum(size for _, size, _ in _attachments(message.get('file_paths'), message.get('documents')))
+    return attachments_size * 4 // 3 + len(message['content']) + 1024  # Base64 encoding, body and JSON overhead
+
+def _batchable(message:dict) -> bool:
+    """
+    Checks whether an email can be sent within a $batch call, i.e. without an upload session.
+    """
+    attachments_size = sum(size for _, size, _ in _attachments(message.get('file_paths'), message.get('documents')))
+    return attachments_size <= INLINE_ATTACHMENTS_LIMIT and _estimated_payload_size(message) <= MAX_BATCH_PAYLOAD
+
+def _group_in_batches(messages:list) -> list:
+    """
+    Groups emails in batches of at most `MAX_BATCH_REQUESTS` emails and `MAX_BATCH_PAYLOAD` bytes.
+    """
+    batches = []
+    batch = []
+    batch_size = 0
+    for message in messages:
+        size = _estimated_payload_size(message)
+        if batch and (len(batch) == MAX_BATCH_REQUESTS or batch_size + size > MAX_BATCH_PAYLOAD):
+            batches.append(batch)
+            batch = []
+            batch_size = 0
+        batch.append(message)
+        batch_size += size
+    if batch:
+        batches.append(batch)
+    return batches
+
+def send_email_batch(messages:list) -> list:
+    """
+    Sends up to `MAX_BATCH_REQUESTS` emails in a single Graph $batch call, one `sendMail` sub-request per email.
+
+    The status of every sub-request is mapped back to its email. Throttled sub-requests are retried in a new $batch
+    call once the delay requested by Graph has expired. An email whose sub-request is missing from the response is
+    reported as not sent, with a retryable error: it is only considered sent when Graph accepted it.
+
+    Parameters:
+    - messages (list): The emails, as dictionaries with the `send_email` arguments. Their attachments must fit within
+      the inline limit, and the whole batch within `MAX_BATCH_PAYLOAD`.
+
+    Returns:
+    - list: The `SendError` of each email (None if it was sent), in the order of `messages`.
+    """
+    errors = [SendError(f"No response from Graph for the email to {', '.join(message['recipients'])}")
+              for message in messages]
+    pending = dict(enumerate(messages))
+    attempt = 0
+    while pending:
+        batch_data = {
+            "requests": [{
+                "id": str(index),
+                "method": "POST",
+                "url": "/me/sendMail",
+                "headers": {"Content-Type": "application/json"},
+                "body": _sendmail_payload(message['subject'], message['recipients'], message['content'],
+                                          message.get('file_paths'), message.get('from_address'), message.get('documents'))
+            } for index, message in pending.items()]
+        }
+        response = graph_request('POST', BATCH_ENDPOINT, json=batch_data)
+        if response.status_code >= 400:
+            raise Exception(f"Failed to send the batch of {len(pending)} emails. {response.status_code} {response.reason}")
+
+        throttled = {}
+        for item in response.json().get('responses', []):
+            index = int(item['id'])
+            message = pending.get(index)
+            if message is None:
+                continue  # Not a sub-request of this call
+            status = item['status']
+            if status in (429, 503, 504) and attempt < MAX_RETRIES:
+                throttled[index] = message
+                _throttle(item.get('headers'), attempt)
+            elif 200 <= status < 300:
+                errors[index] = None
+            elif status >= 400:
+                reason = ((item.get('body') or {}).get('error') or {}).get('message', '')
+                errors[index] = send_exception(status, message['recipients'], reason)
+            else:
+                errors[index] = SendError(f"Unexpected response from Graph for the email to {', '.join(message['recipients'])}: {status}")
+
+        pending = throttled
+        attempt += 1
+        if pending:
+            _wait_for_throttle()
+    return errors
+
+def send_emails(messages:list, max_workers:int=MAX_CONCURRENT_REQUESTS, progress_callback=None, on_result=None,
+                batch:bool=False) -> dict:
+    """
+    Sends several emails through a bounded pool of worker threads and reports the outcome of each one.
+
+    Unlike `send_email`, a failure does not abort the run: every message is attempted and its error, if any,
+    is reported in the result. The pool size is capped to the number of concurrent requests Graph accepts
+    per mailbox, and throttling responses make all workers back off (see `graph_request`).
+
+    In batch mode, the emails whose attachments fit within the inline limit are grouped in Graph $batch calls of up to
+    `MAX_BATCH_REQUESTS` emails (see `send_email_batch`), which saves one HTTPS request per email. The other emails are
+    sent on their own.
+
+    Parameters:
+    - messages (list): A list of dictionaries with the `send_email` arguments ('subject', 'recipients', 'content',
+      'file_paths', 'from_address', 'documents') and a 'keys' list with the keys of the missions the message belongs to.
+    - max_workers (int, optional): The number of requests sent concurrently. 1 sends them one after another.
+    - progress_callback (function, optional): A callback function receiving the progress, from 0 to 100.
+    - on_result (function, optional): A callback function called with each message, its error message (None if
+      sent) and whether the error is retryable (see `is_retryable`) as soon as it is done. It is called from the
+      calling thread.
+    - batch (bool, optional): Whether to group the emails in $batch calls. Defaults to False.
+
+    Returns:
+    - dict: A dictionary mapping each mission key to None if its email was sent, or to an error message otherwise.
+    """
+    results = {}
+    total_messages = len(messages)
+    processed_count = 0
+    max_workers = max(1, min(max_workers, MAX_CONCURRENT_REQUESTS))
+
+    # Split the messages in units of work: batches of messages, or single messages
+    if batch:
+        batchable = [message for message in messages if _batchable(message)]
+        units = [(True, unit) for unit in _group_in_batches(batchable)]
+        units += [(False, [message]) for message in messages if not _batchable(message)]
+    else:
+        units = [(False, [message]) for message in messages]
+
+    def send(unit):
+        batched, unit_messages = unit
+        if batched:
+            return send_email_batch(unit_messages)
+        message = unit_messages[0]
+        send_email(message['subject'], message['recipients'], message['content'],
+                   message.get('file_paths'), message.get('from_address'), message.get('documents'))
+        return [None]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(send, unit): unit for unit in units}
+        for future in as_completed(futures):
+            unit_messages = futures[future][1]
+            try:
+                errors = future.result()
+            except Exception as e:
+                errors = [e] * len(unit_messages)
+
+            for message, error in zip(unit_messages, errors):
+                error_message = str(error) if error else None
+                for key in message['keys']:
+                    results[key] = error_message
+                if on_result:
+                    on_result(message, error_message, is_retryable(error))
+
+                # Emit progress
+                processed_count += 1
+                if progress_callback:
+                    progress_callback(int((processed_count / total_messages) * 100))
+
+    return results
+
+class GraphTransport:
+    """
+    Sends emails with Microsoft Graph (see `send_emails`).
+    """
+    name = 'graph'
+
+    def send_emails(self, messages:list, max_workers:int=MAX_CONCURRENT_REQUESTS, progress_callback=None, on_result=None,
+                    batch:bool=False) -> dict:
+        return send_emails(messages, max_workers, progress_callback, on_result, batch)
+
+    def close(self):
+        pass
+
+class SmtpTransport:
+    """
+    Sends emails over SMTP, through a single persistent session.
+
+    The session is opened on the first send (with STARTTLS and authentication if configured) and kept open between
+    sends: it is only reopened if the server closed it. When the server supports PIPELINING, the MAIL FROM, RCPT TO and
+    DATA commands of an email are sent in one go, and their replies read afterwards, which saves a round trip per
+    command. The MIME message is written to the socket as it is built, the attachments being read from disk and base64
+    encoded chunk by chunk, so that memory usage does not grow with their size.
+
+    Unlike Graph, SMTP does not save the emails in the Sent Items folder of the mailbox.
+    """
+    name = 'smtp'
+
+    def __init__(self, host:str, port:int=587, username:str=None, password:str=None, starttls:bool=True):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self._smtp = None
+
+    def _session(self) -> smtplib.SMTP:
+        """
+        Returns the open SMTP session, opening a new one if there is none or if the server closed it.
+        """
+        if self._smtp is not None:
+            try:
+                if self._smtp.noop()[0] == 250:
+                    return self._smtp
+            except (smtplib.SMTPException, OSError):
+                pass
+            self.close()
+
+        smtp = smtplib.SMTP(self.host, self.port, timeout=SMTP_TIMEOUT)
+        smtp.ehlo()
+        if self.starttls:
+            smtp.starttls(context=ssl.create_default_context())
+            smtp.ehlo()
+        if self.username:
+            smtp.login(self.username, self.password or '')
+        self._smtp = smtp
+        return smtp
+
+    def close(self):
+        """
+        Closes the SMTP session, if any.
+        """
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                self._smtp.close()
+            self._smtp = None
+
+    def _send_envelope(self, smtp:smtplib.SMTP, sender:str, recipients:list):
+        """
+        Sends the MAIL FROM, RCPT TO and DATA commands of an email, pipelined if the server supports it.
+
+        Returns:
+        - list: The (code, message) replies of the server, in the order of the commands.
+        """
+        commands = [f"MAIL FROM:<{sender}>"] + [f"RCPT TO:<{recipient}>" for recipient in recipients] + ["DATA"]
+        if smtp.has_extn('pipelining'):
+            smtp.send(''.join(f"{command}\r\n" for command in commands))
+            return [smtp.getreply() for _ in commands]
+
+        # One command at a time, stopping as soon as the email cannot be sent anymore
+        replies = []
+        for command in commands:
+            if command == "DATA" and not any(code in (250, 251) for code, _ in replies[1:]):
+                break
+            smtp.putcmd(command)
+            replies.append(smtp.getreply())
+            if command.startswith("MAIL") and replies[-1][0] != 250:
+                break
+        return replies
+
+    def _send_mime(self, smtp:smtplib.SMTP, message:dict, sender:str):
+        """
+        Writes an email to the socket as a multipart MIME message, streaming its attachments from disk (or memory).
+        """
+        boundary = f"=_{uuid.uuid4().hex}"
+        text = MIMEPart()
+        text.set_content(message['content'])
+        subject = message['subject'] if message['subject'].isascii() else Header(message['subject'], 'utf-8').encode(linesep='\r\n')
+        head = (
+            f"From: {message.get('from_address') or sender}\r\n"
+            f"To: {', '.join(message['recipients'])}\r\n"
+            f"Subject: {subject}\r\n"
+            f"Date: {formatdate(localtime=True)}\r\n"
+            f"Message-ID: {make_msgid(domain=sender.rpartition('@')[2] or None)}\r\n"
+            f"MIME-Version: 1.0\r\n"
+            f"Content-Type: multipart/mixed; boundary=\"{boundary}\"\r\n"
+            f"\r\n"
+            f"--{boundary}\r\n"
+        ).encode() + text.as_bytes(policy=email.policy.SMTP)
+        smtp.send(re.sub(rb'(?m)^\.', b'..', head))  # Escape the lines starting with a dot
+
+        for name, _, open_attachment in _attachments(message.get('file_paths'), message.get('documents')):
+            content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+            filename = f'filename="{name}"' if name.isascii() else f"filename*={encode_rfc2231(name, 'utf-8')}"
+            smtp.send(
+                f"\r\n--{boundary}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Disposition: attachment; {filename}\r\n"
+                f"Content-Transfer-Encoding: base64\r\n"
+                f"\r\n")
+            with open_attachment() as file:
+                while chunk := file.read(MIME_CHUNK_SIZE):
+                    smtp.send(base64.encodebytes(chunk).replace(b'\n', b'\r\n'))
+
+        smtp.send(f"\r\n--{boundary}--\r\n.\r\n")
+
+    def send_email(self, message:dict):
+        """
+        Sends an email through the SMTP session.
+
+        As with `smtplib.SMTP.sendmail`, the email goes out to the recipients the server accepted as soon as there is at
+        least one. The recipients it refused are then reported in a `SendError` that is not retryable, since sending the
+        email again would duplicate it for the others.
+
+        Parameters:
+        - message (dict): A dictionary with the `send_email` arguments.
+
+        Raises:
+        - SendError: If the server refused the email, or some of its recipients.
+        """
+        recipients = message['recipients']
+        sender = message.get('from_address') or self.username or ''
+        smtp = self._session()
         try:
-            access_token = auth.refresh_access_token()
-            headers['Authorization'] = f'Bearer {access_token}'
-            response = requests.post(SENDMAIL_ENDPOINT, headers=headers, json=email_data)
-            if response.status_code == 403:
-                raise Exception(f"The authenticated user is not authorized to use the 'NDTplanning@vincotte.be' email address to send generate mission orders. Please ask ICT to grant access to 'NDTplanning@vincotte.be' for your account, 'avXXXX@vincotte.org'.")
-            response.raise_for_status()
-        except requests.exceptions.HTTPError:
-            raise Exception(f"Failed to send email to {[recipient for recipient in recipients]}. {response.status_code} {response.reason}")
\ No newline at end of file
+            replies = self._send_envelope(smtp, sender, recipients)
+            if len(replies) == len(recipients) + 2 and replies[-1][0] == 354:
+                self._send_mime(smtp, message, sender)
+                code, reason = smtp.getreply()
+            else:
+                smtp.rset()
+                code, reason = next((reply for reply in replies if reply[0] >= 400), (554, b'No valid recipients'))
+        except (smtplib.SMTPException, OSError):
+            self.close()  # The session is in an unknown state, the next email opens a new one
+            raise
+
+        error = send_error(code, recipients, reason.decode(errors='replace'))
+        if error:
+            raise SendError(error, code < 500)  # SMTP refusals are permanent (5xx) or transient (4xx)
+
+        refused = [f"{recipient} ({reply_code} {reply_reason.decode(errors='replace')})"
+                   for recipient, (reply_code, reply_reason) in zip(recipients, replies[1:]) if reply_code not in (250, 251)]
+        if refused:
+            accepted = [recipient for recipient, (reply_code, _) in zip(recipients, replies[1:]) if reply_code in (250, 251)]
+            raise SendError(f"The email was sent to {accepted}, but the server refused these recipients: {', '.join(refused)}.",
+                            retryable=False)
+
+    def send_emails(self, messages:list, max_workers:int=1, progress_callback=None, on_result=None,
+                    batch:bool=False) -> dict:
+        """
+        Sends several emails one after another through the SMTP session, and reports the outcome of each one.
+
+        The arguments and the result are the same as for `send_emails`. `max_workers` and `batch` are ignored: the
+        emails go through a single session, pipelined instead.
+        """
+        results = {}
+        total_messages = len(messages)
+        for processed_count, message in enumerate(messages, start=1):
+            try:
+                self.send_email(message)
+                error = None
+            except Exception as e:
+                error = e
+
+            error_message = str(error) if error else None
+            for key in message['keys']:
+                results[key] = error_message
+            if on_result:
+                on_result(message, error_message, is_retryable(error))
+
+            # Emit progress
+            if progress_callback:
+                progress_callback(int((processed_count / total_messages) * 100))
+
+        return results
+
+# The transport in use, kept between sends so that its session can be reused
+_transport = None
+
+def get_transport(name:str=None):
+    """
+    Returns the transport to send the emails with, as configured in the environment.
+
+    The OUTBOUND_TRANSPORT setting selects either 'graph' (Microsoft Graph, the default) or 'smtp'. The SMTP server is
+    configured with SMTP_HOST, SMTP_PORT, SMTP_USERNAME and SMTP_STARTTLS, and its password is securely fetched from
+    the keyring. The transport is created once and reused, so that the SMTP session stays open between sends.
+
+    Parameters:
+    - name (str, optional): The transport to use. Defaults to the OUTBOUND_TRANSPORT setting.
+
+    Returns:
+    - GraphTransport or SmtpTransport: The transport.
+    """
+    global _transport
+    name = (name or os.environ.get('OUTBOUND_TRANSPORT') or 'graph').lower()
+    if _transport is not None and _transport.name == name:
+        return _transport
+
+    if name == 'graph':
+        transport = GraphTransport()
+    elif name == 'smtp':
+        username = os.environ.get('SMTP_USERNAME') or None
+        transport = SmtpTransport(
+            os.environ.get('SMTP_HOST', 'smtp.office365.com'),
+            int(os.environ.get('SMTP_PORT') or 587),
+            username,
+            keyring.get_password('pmereporter', 'SMTP_PASSWORD') if username else None,
+            os.environ.get('SMTP_STARTTLS', 'true').lower() in ('1', 'true', 'yes'))
+    else:
+        raise Exception(f"Unknown outbound transport '{name}'. Please set OUTBOUND_TRANSPORT to 'graph' or 'smtp'.")
+
+    if _transport is not None:
+        _transport.close()
+    _transport = transport
+    return transport
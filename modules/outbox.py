@@ -0,0 +1,269 @@
+from contextlib import closing
+from datetime import datetime, timedelta
+from modules import outbound, sent_index, utils
+import json
+import os
+import shutil
+import sqlite3
+import time
+import uuid
+
+# Constants
+MAX_ATTEMPTS = 5  # Number of attempts before a job is marked as failed
+BACKOFF_BASE = 2  # Delay in seconds before the first retry, doubled after every failed attempt
+SENT_RETENTION_DAYS = 90  # Number of days the sent jobs are kept, for their fingerprints (see `delivered_fingerprints`)
+
+def get_outbox_path():
+    """
+    Returns the path to the SQLite database holding the outbox, in the application's data directory.
+    """
+    return os.path.join(utils.get_data_dir(), 'outbox.sqlite3')
+
+def get_spool_dir(job_id:int=None):
+    """
+    Returns the directory where the attachments of the outbox jobs are copied, or the one of a specific job.
+    """
+    spool_dir = os.path.join(utils.get_data_dir(), 'outbox')
+    return spool_dir if job_id is None else os.path.join(spool_dir, str(job_id))
+
+def _spooled_path(job_id:int, index:int, name:str) -> str:
+    """
+    Returns the path of an attachment in the spool directory of a job: './<job id>/<index>/<name>'. Every attachment
+    has its own directory, so that two attachments with the same name, e.g. from two missions of a grouped email,
+    keep their own content and name.
+    """
+    attachment_dir = os.path.join(get_spool_dir(job_id), str(index))
+    os.makedirs(attachment_dir, exist_ok=True)
+    return os.path.join(attachment_dir, name)
+
+def _connect():
+    """
+    Opens a connection to the outbox database, creating its table if needed.
+    """
+    connection = sqlite3.connect(get_outbox_path())
+    connection.row_factory = sqlite3.Row
+    connection.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            batch_id TEXT NOT NULL,
+            mission_keys TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            recipients TEXT NOT NULL,
+            content TEXT NOT NULL,
+            file_paths TEXT NOT NULL,
+            from_address TEXT,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL DEFAULT 0,
+            last_error TEXT,
+            created_at TEXT NOT NULL,
+            sent_at TEXT,
+            fingerprints TEXT NOT NULL DEFAULT '{}',
+            UNIQUE (batch_id, mission_keys)
+        )
+    """)
+    # Add the columns missing from outboxes created by earlier versions
+    columns = [row['name'] for row in connection.execute("PRAGMA table_info(jobs)")]
+    if 'fingerprints' not in columns:
+        connection.execute("ALTER TABLE jobs ADD COLUMN fingerprints TEXT NOT NULL DEFAULT '{}'")
+    return connection
+
+def enqueue(messages:list, batch_id:str=None) -> str:
+    """
+    Adds one job per email to the outbox.
+
+    The attachments of every job are copied into the outbox spool directory, so that the job can still be sent after
+    './temp' and './generated' have been cleaned up, e.g. when the application was closed in the middle of a send.
+    The attachments keep their name, each one in its own directory (see `_spooled_path`). The documents rendered in memory (the 'documents' of the emails) are written there directly.
+    A batch id and a set of mission keys identify a job: enqueuing the same batch twice does not duplicate its jobs.
+    An email whose attachments cannot be copied, e.g. a PDF that was deleted, is not enqueued, and does not stop the
+    other ones.
+
+    Parameters:
+    - messages (list): The emails, as built by `process.build_om_message`.
+    - batch_id (str, optional): The id of the batch the jobs belong to. A new one is generated if not provided.
+
+    Returns:
+    - tuple: The batch id, and a dictionary mapping the mission keys of the emails that could not be enqueued to the
+      error message.
+    """
+    batch_id = batch_id or uuid.uuid4().hex
+    errors = {}
+    with closing(_connect()) as connection:
+        for message in messages:
+            missing = [os.path.basename(path) for path in message.get('file_paths') or [] if not os.path.isfile(path)]
+            if missing:
+                errors.update((key, f"Missing attachment(s): {', '.join(missing)}") for key in message['keys'])
+                continue
+
+            cursor = connection.execute(
+                "INSERT OR IGNORE INTO jobs (batch_id, mission_keys, subject, recipients, content, file_paths, from_address, created_at, fingerprints) "
+                "VALUES (?, ?, ?, ?, ?, '[]', ?, ?, ?)",
+                (batch_id, json.dumps(message['keys']), message['subject'], json.dumps(message['recipients']),
+                 message['content'], message.get('from_address'), datetime.now().isoformat(), json.dumps(message.get('fingerprints') or {})))
+            if not cursor.rowcount:
+                continue  # Already enqueued
+
+            # Copy the attachments into the spool directory of the job
+            job_id = cursor.lastrowid
+            file_paths = []
+            try:
+                for index, file_path in enumerate(message.get('file_paths') or []):
+                    spooled_path = _spooled_path(job_id, index, os.path.basename(file_path))
+                    shutil.copyfile(file_path, spooled_path)
+                    file_paths.append(spooled_path)
+
+                # Write the documents rendered in memory straight into the spool directory
+                for index, document in enumerate(message.get('documents') or [], start=len(file_paths)):
+                    spooled_path = _spooled_path(job_id, index, document['name'])
+                    with open(spooled_path, 'wb') as file:
+                        file.write(document['content'])
+                    file_paths.append(spooled_path)
+            except OSError as error:
+                # Drop the job rather than sending it without some of its attachments
+                connection.rollback()
+                shutil.rmtree(get_spool_dir(job_id), ignore_errors=True)
+                errors.update((key, f"The attachments could not be copied to the outbox: {error}") for key in message['keys'])
+                continue
+            connection.execute("UPDATE jobs SET file_paths = ? WHERE id = ?", (json.dumps(file_paths), job_id))
+            connection.commit()
+    return batch_id, errors
+
+def unfinished_count() -> int:
+    """
+    Returns the number of jobs that have not been sent yet, including the ones that failed.
+    """
+    with closing(_connect()) as connection:
+        return connection.execute("SELECT COUNT(*) FROM jobs WHERE status != 'sent'").fetchone()[0]
+
+def delivered_fingerprints() -> dict:
+    """
+    Returns the fingerprint of the last delivered mission order of every mission sent through the outbox.
+
+    Returns:
+    - dict: A dictionary mapping each mission key to the fingerprint of its last sent mission order.
+    """
+    fingerprints = {}
+    with closing(_connect()) as connection:
+        for row in connection.execute("SELECT fingerprints FROM jobs WHERE status = 'sent' ORDER BY sent_at"):
+            fingerprints.update(json.loads(row['fingerprints']))
+    return fingerprints
+
+def retry_failed():
+    """
+    Puts the failed jobs back in the queue, with a fresh number of attempts.
+    """
+    with closing(_connect()) as connection:
+        connection.execute("UPDATE jobs SET status = 'pending', attempts = 0, next_attempt_at = 0 WHERE status = 'failed'")
+        connection.commit()
+
+def discard_unfinished():
+    """
+    Removes the jobs that have not been sent yet from the outbox, along with their spooled attachments.
+    """
+    with closing(_connect()) as connection:
+        for row in connection.execute("SELECT id FROM jobs WHERE status != 'sent'").fetchall():
+            shutil.rmtree(get_spool_dir(row['id']), ignore_errors=True)
+        connection.execute("DELETE FROM jobs WHERE status != 'sent'")
+        connection.commit()
+
+def purge_sent(retention_days:int=SENT_RETENTION_DAYS):
+    """
+    Removes the jobs sent more than `retention_days` days ago from the outbox. Their mission orders are then
+    considered changed by a changed-only resend (see `delivered_fingerprints`).
+    """
+    sent_before = (datetime.now() - timedelta(days=retention_days)).isoformat()
+    with closing(_connect()) as connection:
+        connection.execute("DELETE FROM jobs WHERE status = 'sent' AND sent_at < ?", (sent_before,))
+        connection.commit()
+
+def _job_to_message(row) -> dict:
+    """
+    Converts a job of the outbox to an email, as expected by the transports (see `outbound.send_emails`).
+    """
+    return {
+        "job_id": row['id'],
+        "attempts": row['attempts'],
+        "keys": json.loads(row['mission_keys']),
+        "subject": row['subject'],
+        "recipients": json.loads(row['recipients']),
+        "content": row['content'],
+        "file_paths": json.loads(row['file_paths']),
+        "from_address": row['from_address'],
+        "fingerprints": json.loads(row['fingerprints'])
+    }
+
+def drain(max_workers:int=1, progress_callback=None, batch:bool=False, transport=None) -> dict:
+    """
+    Sends the pending jobs of the outbox, retrying the failed ones with an exponential backoff.
+
+    A job is marked as 'sending' right before its email is handed to Graph, and as 'sent' as soon as Graph accepted it,
+    so that an interrupted drain resumes exactly where it stopped. A job left in the 'sending' state by an interruption
+    cannot be known to have gone out, and is therefore sent again. After `MAX_ATTEMPTS` failed attempts, or at once if
+    the email was refused for good (see `outbound.is_retryable`), a job is marked as 'failed' and stays in the outbox
+    until it is retried (see `retry_failed`) or discarded. The jobs sent long ago are purged first (see `purge_sent`).
+
+    Parameters:
+    - max_workers (int, optional): The number of emails sent concurrently. Defaults to 1 (one after another).
+    - progress_callback (function, optional): A callback function receiving the progress, from 0 to 100.
+    - batch (bool, optional): Whether to group the emails in Graph $batch calls (see `outbound.send_emails`).
+    - transport (optional): The transport to send the emails with. Defaults to the configured one (see `outbound.get_transport`).
+
+    Returns:
+    - dict: A dictionary mapping the mission keys of the jobs handled by this drain to None if their email was sent,
+      or to the last error message otherwise.
+    """
+    results = {}
+    transport = transport or outbound.get_transport()
+    purge_sent()
+    with closing(_connect()) as connection:
+        # Jobs interrupted in the middle of a send are sent again
+        connection.execute("UPDATE jobs SET status = 'pending' WHERE status = 'sending'")
+        connection.commit()
+
+        total_jobs = connection.execute("SELECT COUNT(*) FROM jobs WHERE status = 'pending'").fetchone()[0]
+        processed_count = 0
+
+        def on_result(message, error, retryable=True):
+            nonlocal processed_count
+            for key in message['keys']:
+                results[key] = error
+            if error is None:
+                connection.execute("UPDATE jobs SET status = 'sent', sent_at = ?, last_error = NULL WHERE id = ?",
+                                   (datetime.now().isoformat(), message['job_id']))
+                shutil.rmtree(get_spool_dir(message['job_id']), ignore_errors=True)
+                sent_index.record(message, f"outbox:{message['job_id']}")
+                processed_count += 1
+            else:
+                attempts = message['attempts'] + 1
+                if attempts >= MAX_ATTEMPTS or not retryable:
+                    connection.execute("UPDATE jobs SET status = 'failed', attempts = ?, last_error = ? WHERE id = ?",
+                                       (attempts, error, message['job_id']))
+                    processed_count += 1
+                else:
+                    next_attempt_at = time.time() + BACKOFF_BASE * 2 ** (attempts - 1)
+                    connection.execute("UPDATE jobs SET status = 'pending', attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                                       (attempts, next_attempt_at, error, message['job_id']))
+            connection.commit()
+
+            # Emit progress
+            if progress_callback:
+                progress_callback(int((processed_count / total_jobs) * 100))
+
+        while True:
+            rows = connection.execute("SELECT * FROM jobs WHERE status = 'pending' ORDER BY id").fetchall()
+            if not rows:
+                break
+
+            # Wait for the next job to be due
+            now = time.time()
+            due_rows = [row for row in rows if row['next_attempt_at'] <= now]
+            if not due_rows:
+                time.sleep(min(row['next_attempt_at'] for row in rows) - now)
+                continue
+
+            connection.executemany("UPDATE jobs SET status = 'sending' WHERE id = ?", [(row['id'],) for row in due_rows])
+            connection.commit()
+            transport.send_emails([_job_to_message(row) for row in due_rows], max_workers, on_result=on_result, batch=batch)
+
+    return results
@@ -1,386 +1,1048 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
 from datetime import datetime
-from modules import outbound, utils
+from itertools import islice
+from modules import activity, fastpdf, model, optimize, outbound, sent_index, utils
+from PIL import Image
+from reportlab import rl_config
 from reportlab.lib import colors
 from reportlab.lib.enums import TA_JUSTIFY
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Table, TableStyle, Spacer, PageBreak
+from reportlab.lib.utils import ImageReader
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Table, TableStyle, Spacer, PageBreak, ActionFlowable
+from types import SimpleNamespace
+import csv
+import hashlib
+import io
+import json
 import os
 import re
 import sys
+import threading
+
+# Optional dependency: splitting the mission order bundles
+try:
+    from pypdf import PdfReader, PdfWriter
+except ImportError:
+    PdfReader = PdfWriter = None
+
+# Constants
+PAGE_HEADER_FORM = 'PageHeader'  # Name of the form XObject holding the static part of the page header
+PDF_TEMPLATE_VERSION = '2'  # Part of the PDF build hash: bump it whenever the layout of the mission orders changes
+PDF_PROFILES = ('standard', 'compact')  # Output profiles of the PDF documents (see `_pdf_profile`)
+LOGO_DPI = 200  # Resolution of the logos of the page header in the compact profile
+ADDITIONAL_ATTACHMENTS_DIR = 'temp/attachments'  # Directory of the attachments downloaded from SharePoint, by day and mission key
+ADR_REGISTER_CHUNK_ROWS = 200  # Rows of the ADR register produced, written and drawn at once
+ADR_REGISTER_COLUMNS = [('Date', 48), ('Mission n°', 40), ('Agents', 80), ('Vehicle', 45), ('Departure', 55),
+                        ('Client', 85), ('Location', 110), ('Source', 45), ('UN number', 38), ('Isotope', 38),
+                        ('Activity (GBq)', 42), ('Activity (Ci)', 34), ('Package', 40), ('Label', 40), ('TI', 30)]
+
+# Styles of the mission orders, created once per process (see `_pdf_styles`)
+_styles = None
+
+# Serializes the PDF renders of the process, for the settings ReportLab only reads process-wide (see `_pdf_profile`)
+_render_lock = threading.RLock()
+
+# Logos of the page header, decoded once per process and profile (see `_page_logos`)
+_logos = {}
+
+# Sources of the PDF generation worker processes, sent once per worker (see `_init_pdf_worker`)
+_worker_sources = None
+
+def _pdf_styles():
+    """
+    Returns the paragraph styles of the mission orders, creating them on the first call in the process.
+    """
+    global _styles
+    if _styles is None:
+        styles = getSampleStyleSheet()
+        styles.add(ParagraphStyle(name='Justify', parent=styles['Normal'], fontSize=10, fontName='Helvetica', alignment=TA_JUSTIFY,))
+        smaller_font_style = ParagraphStyle('SmallerFont', parent=styles['Normal'], fontSize=9, fontName='Helvetica')
+        _styles = styles, smaller_font_style
+    return _styles
+
+@contextmanager
+def _pdf_profile(profile:str):
+    """
+    Renders the PDF document of the enclosed block with an output profile, yielding the settings of its document
+    template or canvas:
+    - 'standard': the ReportLab defaults.
+    - 'compact': the content streams are compressed without their ASCII85 encoding, which makes them a quarter larger,
+      and the logos of the page header are downscaled to their printed size (see `_page_logos`).
+    The fonts are the standard PDF ones, which are never embedded, whatever the profile.
+
+    The page compression and the logos are settings of the document, but ReportLab only reads the ASCII85 encoding from
+    its process-wide configuration: it is switched for the enclosed block only, and the renders of the process hold a
+    lock meanwhile, so that a render in another thread never picks up the profile of this one.
+    """
+    if profile not in PDF_PROFILES:
+        raise ValueError(f"Unknown PDF profile: {profile}")
+    with _render_lock:
+        use_a85 = rl_config.useA85
+        if profile == 'compact':
+            rl_config.useA85 = 0
+        try:
+            yield _document_settings(profile)
+        finally:
+            rl_config.useA85 = use_a85
 
-def generate_pdfs(missions:dict, sources:dict, keys:list=None):
+def _document_settings(profile:str) -> dict:
     """
-    Generates PDF documents for each mission in the provided missions list, including ADR information and other mission details.
+    Returns the settings of the document templates and canvases rendering the PDF documents of an output profile.
+    """
+    return {'pageCompression': 1} if profile == 'compact' else {}
+
+def pdf_path(mission:dict) -> str:
+    """
+    Returns the path of the PDF document of a mission: './generated/<day>/<agent names><key>.pdf'.
+    """
+    mission = model.as_mission(mission)
+    return f"./generated/{mission.day}/{mission.file_prefix}{mission.key}.pdf"
+
+def pdf_build_hash(mission:dict, sources:dict, profile:str='standard', renderer:str='platypus') -> str:
+    """
+    Computes the hash of everything the PDF document of a mission is built from: the cleaned mission fields, the records
+    of the sources it references, the template version, and the output profile and rendering engine, if not the default
+    ones. The attachments of the mission are not part of the PDF.
+
+    Returns:
+    - str: The hexadecimal SHA-256 hash.
+    """
+    fields = {key: value for key, value in mission.items() if key not in ('attachmentLinks', 'attachmentFileNames', 'attachmentSharedLinks')}
+    referenced_sources = {title: sources.get(title) for title in mission.get('sources') or []}
+    built_from = [fields, referenced_sources, PDF_TEMPLATE_VERSION] + ([profile] if profile != 'standard' else [])
+    built_from += [renderer] if renderer != 'platypus' else []
+    payload = json.dumps(built_from, sort_keys=True, default=model.json_default)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def _build_hash_path(path:str) -> str:
+    """
+    Returns the path of the file recording the build hash of a PDF document, next to it.
+    """
+    return f"{path}.sha256"
+
+def pdf_is_up_to_date(mission:dict, build_hash:str) -> bool:
+    """
+    Checks whether the PDF document of a mission exists and was built from the same content (see `pdf_build_hash`).
+    """
+    return _is_up_to_date(pdf_path(mission), build_hash)
+
+def _is_up_to_date(path:str, build_hash:str) -> bool:
+    """
+    Checks whether a PDF document exists and was built from the given build hash.
+    """
+    try:
+        with open(_build_hash_path(path), 'r') as file:
+            return file.read().strip() == build_hash and os.path.exists(path)
+    except OSError:
+        return False
+
+def mission_order_sections(mission:dict, sources:dict) -> list:
+    """
+    Lays out the content of the mission order of a mission, independently of the engine rendering it.
 
     Parameters:
-    - missions (dict): A dictionary containing mission items, each with details such as start/end times, resources, customers, and ADR source information.
+    - mission (dict): The cleaned mission, with details such as start/end times, resources, customers, and ADR source information.
     - sources (dict): A dictionary containing source items with details such as UN number, package, isotope, activity, and other ADR relevant information.
 
-    The function iterates over each mission, compiles relevant information into a structured format, and generates a PDF document for that mission.
-    The generated PDF includes mission details, agent and client information, ADR information for sources involved in the mission, and signature fields.
+    Returns:
+    - list: The sections of the mission order, in order. Each section is a dictionary with a 'type':
+      - 'paragraph': A 'text' in paragraph markup, with the name of its 'style' in the sample style sheet.
+      - 'spacer': A vertical space of 'height' points.
+      - 'page_break': The end of the current page.
+      - 'table': The 'rows' of a table of the given 'kind' (see `_table_style`), with its 'col_widths' (None to split the
+        width of the page evenly). The cells are in paragraph markup, except in 'signatures' tables. The 'free_text_rows'
+        are the indexes of the rows holding free text typed by the planners, such as remarks.
     """
+    styles, _ = _pdf_styles()
 
-    # print("Generating pdfs...")
+    # Convert start and end times to datetime objects
+    mission_start = model.start_of(mission)
+    mission_end = model.end_of(mission)  
 
-    # Define styles
-    styles = getSampleStyleSheet()
-    styles.add(ParagraphStyle(name='Justify', parent=styles['Normal'], fontSize=10, fontName='Helvetica', alignment=TA_JUSTIFY,))
-    smaller_font_style = ParagraphStyle('SmallerFont', parent=styles['Normal'], fontSize=9, fontName='Helvetica')
+    # Create content sections
+    sections = []
 
-    for mission in (missions):
-        # Skip missions that have a key in "keys" input argument list (That is, missions not selected to be generated in GUI)
-        if keys and mission.get('key') not in keys:
-            continue
-        # Convert start and end times to datetime objects
-        mission_start = datetime.strptime(mission['start'], '%Y-%m-%d %H:%M:%S')
-        mission_end = datetime.strptime(mission['end'], '%Y-%m-%d %H:%M:%S')  
+    def paragraph(text, style):
+        sections.append({'type': 'paragraph', 'text': text, 'style': style})
 
-        # Create content elements
-        elements = []
+    def table(rows, kind, col_widths=None, free_text_rows=()):
+        sections.append({'type': 'table', 'rows': rows, 'kind': kind, 'col_widths': col_widths, 'free_text_rows': list(free_text_rows)})
 
-        # Add content:
-        # -----------Title-----------
-        elements.append(Paragraph(f"Mission order n°{mission.get('key')} - Vinçotte NDT", styles['Title']))
-        elements.append(Spacer(1, 10))
+    # Add content:
+    # -----------Title-----------
+    paragraph(f"Mission order n°{mission.get('key')} - Vinçotte NDT", 'Title')
+    sections.append({'type': 'spacer', 'height': 10})
 
-        # ------------------------------------- Mission details -------------------------------------
-        elements.append(Paragraph(f"Mission details", styles['Heading2']))
-                
-        # Table data
-        mission_table_data = []
+    # ------------------------------------- Mission details -------------------------------------
+    paragraph(f"Mission details", 'Heading2')
             
-        # -----------Date and time-----------
-        mission_table_data.append([Paragraph("<b>Date of intervention</b>"), Paragraph(f"{mission_start.strftime('%d %b %Y')}")])
-        mission_table_data.append([Paragraph("<b>Start time</b>"), Paragraph(f"{mission_start.strftime('%H:%M')}")])
-        mission_table_data.append([Paragraph("<b>End time</b>"), Paragraph(f"{mission_end.strftime('%H:%M')}")])
+    # Table data
+    mission_table_data = []
+        
+    # -----------Date and time-----------
+    mission_table_data.append(["<b>Date of intervention</b>", f"{mission_start.strftime('%d %b %Y')}"])
+    mission_table_data.append(["<b>Start time</b>", f"{mission_start.strftime('%H:%M')}"])
+    mission_table_data.append(["<b>End time</b>", f"{mission_end.strftime('%H:%M')}"])
+    
+    # -----------Agents-----------
+    for index, item in enumerate(mission.get('resources')):
+        agent_name_label = "<b>Agent</b><br/><br/>" if len(mission.get('resources')) == 1 else f"<b>Agent {index+1}</b><br/><br/>"
+        agent_name = f"{item.get('firstName')} {item.get('lastName')}<br/>"
         
-        # -----------Agents-----------
-        for index, item in enumerate(mission.get('resources')):
-            agent_name_label = "<b>Agent</b><br/><br/>" if len(mission.get('resources')) == 1 else f"<b>Agent {index+1}</b><br/><br/>"
-            agent_name = f"{item.get('firstName')} {item.get('lastName')}<br/>"
+        agent_phone_label = "<b>Phone</b>"
+        agent_phone1 = f"<br/>{item.get('mobile1')}" if item.get('mobile1') else ''
+        agent_phone2 = f"<br/>{item.get('mobile2')}" if item.get('mobile2') else ''
+        
+        mission_table_data.append([agent_name_label+agent_phone_label, 
+                                   agent_name+agent_phone1+agent_phone2])
+        
+    # -----------Clients-----------
+    for index, item in enumerate(mission['customers']):
+        client_name_label = "<b>Client</b><br/><br/>" if len(mission.get('customers', '')) == 1 else f"<b>Client {index+1}</b><br/><br/>"    
+        client_name = f"{item.get('label')}<br/>"
+
+        client_phone_label = "<b>Phone</b>"
+        client_phone1 = f"<br/>{item.get('phone1')}" if item.get('phone1') else ''
+        client_phone2 = f"<br/>{item.get('phone2')}" if item.get('phone2') else ''
+        
+        mission_table_data.append([client_name_label+client_phone_label, 
+                                   client_name+client_phone1+client_phone2])
+
+    # -----------Service order number-----------
+    if mission.get('SOnumber') and mission.get('SOnumber') != 'None':
+        mission_table_data.append(["<b>Service order n°</b>", f"{mission.get('SOnumber')}"])
+
+    # -----------Location-----------
+    if mission.get('location') == "Run get_locations()":
+        raise ValueError('Mission intervention location missing, please first run ingest.get_locations()!')
+    elif mission.get('location') and mission.get('location') != 'None': 
+        location = utils.format_text(mission.get('location'))
+        mission_table_data.append(["<b>Intervention location</b>", f"{location}"])
+    else:
+        location = "" # Set location to empty string for use in ADR sender/receiver information, so that "None" is not displayed
+
+    # -----------Departure location-----------
+    departureplace = mission.get('departurePlace')
+    if departureplace:
+        mission_table_data.append(["<b>Departure location</b>", f"{departureplace}"])
+    else:
+        departureplace = "" # Set departure place to empty string for use in ADR sender/receiver information, so that "None" is not displayed
+
+    # -----------Vehicle-----------
+    vehicle = mission.get('vehicle')
+    if vehicle:
+        mission_table_data.append(["<b>Vehicle</b>", f"{vehicle}"])
+    
+    # -----------Equipment-----------
+    equipments = mission.get('equipment')
+    if equipments:
+        if len(equipments) > 1:
+            for index, equipment in enumerate(equipments):
+                mission_table_data.append([f"<b>Adv. equipment {index+1}</b>", f"{equipment}"])
+        else:
+            for equipment in equipments:
+                mission_table_data.append(["<b>Adv. equipment</b>", f"{equipment}"])
+
+    # -----------Info/comments-----------
+    # Format text for pretty display
+    comments = [utils.format_text(comment) for comment in mission.get('comments')]
             
-            agent_phone_label = "<b>Phone</b>"
-            agent_phone1 = f"<br/>{item.get('mobile1')}" if item.get('mobile1') else ''
-            agent_phone2 = f"<br/>{item.get('mobile2')}" if item.get('mobile2') else ''
+    # Add separator between different types of comments
+    separator = "<br/>----------------------------------------------------------------------------------------------<br/>"
+    comments_text = separator.join([comment for comment in comments])
+
+    comments_paragraph = []
+    max_height = 500
+    max_width = 320
+    # actual_height = utils.calculate_paragraph_height(comments_text, max_width, styles['Normal'])
+
+    # Checking if height > max height to avoid running 'ajust_paragraph_height' if not needed
+    # if actual_height > max_height:
+    #     # Split total comments text into two paragraphs if height > max height
+    #     comments_paragraph = utils.ajust_paragraph_height(comments_text, max_height, max_width, styles['Normal'])
+    # else:
+    #     comments_paragraph.append(comments_text)
+
+    # Split total comments text into as many paragraphs as needed if height > max height
+    comments_paragraph = utils.ajust_paragraph_height(comments_text, max_height, max_width, styles['Normal'])
+
+    # Display one paragraph per table row
+    remarks_rows = []
+    for comment in comments_paragraph:
+        remarks_rows.append(len(mission_table_data))
+        mission_table_data.append(["<b>Remarks/comments</b>", 
+                                   comment])
+
+    # Add the table with the mission data
+    table(mission_table_data, 'mission', [111, None], remarks_rows)
+
+    # Norms & criteria
+    norm_crit_list = mission.get('normCr', [])
+    techniques_list = mission.get('techniques', [])
+    
+    # Check if any techniques, norms or criteria are present
+    if any(norm_crit_list) or any(techniques_list):
+        # -----------Techniques, Norms & Criteria heading-----------
+        paragraph("Techniques, Norms & Criteria", 'Heading4')
+        
+        tech_norm_crit_table_data = []
+
+        k = 1
+        for technique in techniques_list:
+            tech_norm_crit_table_data.append([f"<b>Technique {k}</b>", technique])
+            k += 1
+
+        j = 1
+        for norm_crit in norm_crit_list:
+            tech_norm_crit_table_data.append([f"<b>Norm/Criteria {j}</b>", norm_crit])
+            j += 1
+
+        table(tech_norm_crit_table_data, 'mission', [111, None])
+
+    # ------------------------------------- ADR Information -------------------------------------
+    # Check if RT mission
+    mission_sources = mission.get('sources')
             
-            mission_table_data.append([Paragraph(agent_name_label+agent_phone_label), 
-                                       Paragraph(agent_name+agent_phone1+agent_phone2)])
+    # Check if any sources are present
+    if any(mission_sources):
+        sections.append({'type': 'page_break'})
+        paragraph("<b>ADR Informatie / Information ADR</b>", 'Heading2')
+
+        # -----------Sender / Receiver table-----------
+        s_r_table_data = []
+        addresses = {'Villers-Le-Bouillet': 'Rue de la métallurgie 47<br/>4530 Villers-Le-Bouillet',
+                     'Houdeng': 'Chaussée Paul Houtart 88<br/>7100 Houdeng-Goegnies',
+                     'Wijnegem': 'Bijkhoevelaan 7<br/>2110 Wijnegem'}
+        # Check if one way transport
+        if mission.get('oneWayTransport') == True:
+            s_r_table_data.append(["<b>Verzender / Expéditeur</b>",
+                                   "<b>Bestemmeling / Destinataire</b>"])
+            if mission.get('return') == True:
+                s_r_table_data.append([f"{client_name}<br/>{location}",
+                                       f"Vinçotte NV<br/><br/>{addresses.get(departureplace)}"])
+            else:
+                s_r_table_data.append([f"Vinçotte NV<br/><br/>{addresses.get(departureplace)}",
+                                       f"{client_name}<br/>{location}"])
+            table(s_r_table_data, 'mission')
+
+        else:
+            paragraph('Heen / Aller', 'Heading5')
+            s_r_table_data.append(["<b>Verzender / Expéditeur</b>",
+                                   "<b>Bestemmeling / Destinataire</b>"])
+            s_r_table_data.append([f"Vinçotte NV<br/><br/>{addresses.get(departureplace)}",
+                                   f"{client_name}<br/>{location}"])
+            table(s_r_table_data, 'mission')
+
+            paragraph('Terug / Retour', 'Heading5')
+            s_r_table_data = []
+            s_r_table_data.append(["<b>Verzender / Expéditeur</b>",
+                                   "<b>Bestemmeling / Destinataire</b>"])
+            s_r_table_data.append([f"{client_name}<br/>{location}",
+                                   f"Vinçotte NV<br/><br/>{addresses.get(departureplace)}"])
+            table(s_r_table_data, 'mission')
+        
+        # -----------Description-----------
+        paragraph("<b>Getransporteerde ADR stoffen: / Marchandises ADR transportées:</b>", 'Heading4')
+        
+        i=0
+        for source in mission_sources:
+            # -----------Isotope n° heading-----------
+            if len(mission_sources)>1:
+                i+=1
+                paragraph(f"<b>Isotope {i}</b>", 'Heading5')
+
+            # Table data
+            ADR_table_data = []
+
+            # -----------Source internal identification (Vincotte)-----------
+            ADR_table_data.append([f"<b>Identificatie /<br/>Identification</b>", f"{source}"])
             
-        # -----------Clients-----------
-        for index, item in enumerate(mission['customers']):
-            client_name_label = "<b>Client</b><br/><br/>" if len(mission.get('customers', '')) == 1 else f"<b>Client {index+1}</b><br/><br/>"    
-            client_name = f"{item.get('label')}<br/>"
-
-            client_phone_label = "<b>Phone</b>"
-            client_phone1 = f"<br/>{item.get('phone1')}" if item.get('phone1') else ''
-            client_phone2 = f"<br/>{item.get('phone2')}" if item.get('phone2') else ''
+            # -----------UN Number & description-----------
+            UN_number = sources[source]['UNnumber']
+            package = sources[source]['Package']
+            ADR_table_data.append([f"<b>Beschrijving /<br/>Description</b>",
+                                   f"{UN_number} RADIOACTIEVE STOFFEN, IN COLLI VAN TYPE {package}, 7, (E) /<br/>{UN_number} MATIÈRES RADIOACTIVES EN COLIS DE TYPE {package}, 7, (E)"])
             
-            mission_table_data.append([Paragraph(client_name_label+client_phone_label), 
-                                       Paragraph(client_name+client_phone1+client_phone2)])
-
-        # -----------Service order number-----------
-        if mission.get('SOnumber') and mission.get('SOnumber') != 'None':
-            mission_table_data.append([Paragraph("<b>Service order n°</b>"), Paragraph(f"{mission.get('SOnumber')}")])
-
-        # -----------Location-----------
-        if mission.get('location') == "Run get_locations()":
-            raise ValueError('Mission intervention location missing, please first run ingest.get_locations()!')
-        elif mission.get('location') and mission.get('location') != 'None': 
-            location = utils.format_text(mission.get('location'))
-            mission_table_data.append([Paragraph("<b>Intervention location</b>"), Paragraph(f"{location}")])
-        else:
-            location = "" # Set location to empty string for use in ADR sender/receiver information, so that "None" is not displayed
+            # -----------Isotope-----------
+            isotope = sources[source]['Isotope']
+            ADR_table_data.append([f"<b>Isotoop /<br/>Isotope</b>", f"{isotope}"])
+            
+            # -----------Activity-----------
+            GBq, Ci = activity.source_activity(sources, source, mission_start)
+            ADR_table_data.append([f"<b>Activiteit op {mission_start.strftime('%d %b %Y')} /<br/>Activité le {mission_start.strftime('%d %b %Y')}</b>",
+                                   f"{GBq} GBq - {Ci} Ci"])
+            
+            # -----------Package category-----------
+            pckg_category = sources[source]['Label']
+            ADR_table_data.append([f"<b>Label /<br/>Étiquette</b>", f"{pckg_category}"])
+            
+            # -----------Transport index-----------
+            transport_index = sources[source]['Transportindex']
+            ADR_table_data.append([f"<b>Transportindex /<br/>Indice de transport</b>", f"{transport_index}"])
+            
+            # -----------Physical state-----------
+            physical_state = sources[source]['Physicalstate']
+            ADR_table_data.append([f"<b>Fysiche toestand /<br/>État physique</b>", f"{physical_state}"])
+            
+            # -----------Certificate-----------
+            certificate = sources[source]['Certificate']
+            ADR_table_data.append([f"<b>Goedkeuringscertificaat /<br/>Certificat d'approbation</b>", f"{certificate}"])
+            
+            # -----------Certificate (Special Form)-----------
+            certificate_sf = sources[source]['Certificate_x0028_specialform_x0']
+            if certificate_sf is not None:
+                ADR_table_data.append([f"<b>Goedkeuringscertificaat - Special Form /<br/>Certificat d'approbation - Forme spéciale</b>",
+                                       f"{certificate_sf}"])
+                
+            # TODO: Replace dict accesses by .get() to avoid errors when none
 
-        # -----------Departure location-----------
-        departureplace = mission.get('departurePlace')
-        if departureplace:
-            mission_table_data.append([Paragraph("<b>Departure location</b>"), Paragraph(f"{departureplace}")])
-        else:
-            departureplace = "" # Set departure place to empty string for use in ADR sender/receiver information, so that "None" is not displayed
+            # -----------Focus-----------
+            focus = sources.get(source).get('Focus')
+            if focus is not None:
+                ADR_table_data.append(["<b>Focus /<br/>Foyer</b>", f"{focus} mm"])
 
-        # -----------Vehicle-----------
-        vehicle = mission.get('vehicle')
-        if vehicle:
-            mission_table_data.append([Paragraph("<b>Vehicle</b>"), Paragraph(f"{vehicle}")])
-        
-        # -----------Equipment-----------
-        equipments = mission.get('equipment')
-        if equipments:
-            if len(equipments) > 1:
-                for index, equipment in enumerate(equipments):
-                    mission_table_data.append([Paragraph(f"<b>Adv. equipment {index+1}</b>"), Paragraph(f"{equipment}")])
-            else:
-                for equipment in equipments:
-                    mission_table_data.append([Paragraph("<b>Adv. equipment</b>"), Paragraph(f"{equipment}")])
+            # Add the table with the data
+            table(ADR_table_data, 'adr', [125, None])
+
+            sections.append({'type': 'spacer', 'height': 10})
+
+            if len(mission_sources)>1 and i < len(mission_sources):
+                sections.append({'type': 'page_break'})
 
-        # -----------Info/comments-----------
-        comments = mission.get('comments')
+        # -----------Signatures of concerned parties-----------
+        paragraph("Signatures", 'Heading4')
+        sections.append({'type': 'spacer', 'height': 10})
         
-        # Format text for pretty display
-        for i in range(len(comments)):
-            comments[i] = utils.format_text(comments[i])
-                
-        # Add separator between different types of comments
-        separator = "<br/>----------------------------------------------------------------------------------------------<br/>"
-        comments_text = separator.join([comment for comment in comments])
-
-        comments_paragraph = []
-        max_height = 500
-        max_width = 320
-        # actual_height = utils.calculate_paragraph_height(comments_text, max_width, styles['Normal'])
-
-        # Checking if height > max height to avoid running 'ajust_paragraph_height' if not needed
-        # if actual_height > max_height:
-        #     # Split total comments text into two paragraphs if height > max height
-        #     comments_paragraph = utils.ajust_paragraph_height(comments_text, max_height, max_width, styles['Normal'])
-        # else:
-        #     comments_paragraph.append(comments_text)
-
-        # Split total comments text into two paragraphs if height > max height
-        comments_paragraph = utils.ajust_paragraph_height(comments_text, max_height, max_width, styles['Normal'])
-
-        # Display one paragraph per table row
-        for comment in comments_paragraph:
-            mission_table_data.append([Paragraph("<b>Remarks/comments</b>"), 
-                                       Paragraph(comment)])
-
-        # Create the table with the mission data
-        mission_table = Table(mission_table_data, colWidths=[111, None])
-
-        # Define a TableStyle
-        style = TableStyle([
+        signatures_table_data = []
+        signatures_table_data.append(["Verzender / Expéditeur",
+                                      "Vervoerder / Transporteur",
+                                      "Bestemmeling / Destinataire"])
+        table(signatures_table_data, 'signatures', [150, 150, 150])
+
+    return sections
+
+def _table_style(kind:str) -> TableStyle:
+    """
+    Returns the style of the tables of a kind: 'mission' (mission details, sender/receiver), 'adr' (ADR information of a
+    source) or 'signatures'.
+    """
+    if kind == 'adr':
+        return TableStyle([
             ('TEXTCOLOR', (0,0), (-1,0), colors.black),
             ('ALIGN', (0,0), (-1,-1), 'LEFT'),
-            ('VALIGN', (0,0), (-1,-1), 'TOP'),
-            ('BOTTOMPADDING', (0,0), (-1,-1), 5),
-            ('TOPPADDING', (0,0), (-1,-1), 5),
+            ('VALIGN', (0,0), (-1,-1), 'CENTER'),
+            ('BOTTOMPADDING', (0,0), (-1,-1), 4.9),
+            ('TOPPADDING', (0,0), (-1,-1), 4.9),
             ('GRID', (0,0), (-1,-1), 1, colors.darkslategray),
         ])
+    if kind == 'signatures':
+        return TableStyle([
+            ('TEXTCOLOR', (0,0), (-1,0), colors.black),
+            ('ALIGN', (0,0), (0,-1), 'LEFT'),
+            ('ALIGN', (1,0), (1,-1), 'CENTER'),
+            ('ALIGN', (2,0), (2,-1), 'RIGHT'),
+            ('BOTTOMPADDING', (0,0), (-1,-1), 0),
+            ('TOPPADDING', (0,0), (-1,-1), 0),
+            ('GRID', (0,0), (-1,-1), 1, colors.transparent),
+        ])
+    return TableStyle([
+        ('TEXTCOLOR', (0,0), (-1,0), colors.black),
+        ('ALIGN', (0,0), (-1,-1), 'LEFT'),
+        ('VALIGN', (0,0), (-1,-1), 'TOP'),
+        ('BOTTOMPADDING', (0,0), (-1,-1), 5),
+        ('TOPPADDING', (0,0), (-1,-1), 5),
+        ('GRID', (0,0), (-1,-1), 1, colors.darkslategray),
+    ])
+
+def _platypus_flowables(sections:list) -> list:
+    """
+    Converts the sections of a mission order (see `mission_order_sections`) to Platypus flowables.
+    """
+    styles, smaller_font_style = _pdf_styles()
+    elements = []
+    for section in sections:
+        if section['type'] == 'paragraph':
+            elements.append(Paragraph(section['text'], styles[section['style']]))
+        elif section['type'] == 'spacer':
+            elements.append(Spacer(1, section['height']))
+        elif section['type'] == 'page_break':
+            elements.append(PageBreak())
+        else:
+            if section['kind'] == 'signatures':
+                rows = section['rows']
+            elif section['kind'] == 'adr':
+                rows = [[Paragraph(cell, smaller_font_style) for cell in row] for row in section['rows']]
+            else:
+                rows = [[Paragraph(cell) for cell in row] for row in section['rows']]
+            table = Table(rows, colWidths=section['col_widths'])
+            table.setStyle(_table_style(section['kind']))
+            elements.append(table)
+    return elements
 
-        # Apply the style to the table
-        mission_table.setStyle(style)
+def render_pdf(mission:dict, sources:dict, renderer:str='platypus', profile:str='standard') -> bytes:
+    """
+    Renders the PDF document of a mission in memory, including ADR information and other mission details.
 
-        # Add table to list of flowables
-        elements.append(mission_table)
+    Parameters:
+    - mission (dict): The cleaned mission, with details such as start/end times, resources, customers, and ADR source information.
+    - sources (dict): A dictionary containing source items with details such as UN number, package, isotope, activity, and other ADR relevant information.
+    - renderer (str, optional): The rendering engine: 'platypus' (default), or 'canvas' to draw the fixed layout of the
+      mission orders directly on the canvas, which is faster (see `fastpdf.render_sections`).
+    - profile (str, optional): The output profile, 'standard' (default) or 'compact' (see `PDF_PROFILES`).
 
-        # Norms & criteria
-        norm_crit_list = mission.get('normCr', [])
-        techniques_list = mission.get('techniques', [])
+    Returns:
+    - bytes: The content of the PDF document.
+    """
+    sections = mission_order_sections(mission, sources)
+    with _pdf_profile(profile) as settings:
+        if renderer == 'canvas':
+            return fastpdf.render_sections(sections, profile)
+
+        # Create a PDF document in memory
+        buffer = io.BytesIO()
+        doc = SimpleDocTemplate(buffer, pagesize=A4, topMargin=100, **settings)
+        doc.pdf_profile = profile
         
-        # Check if any techniques, norms or criteria are present
-        if any(norm_crit_list) or any(techniques_list):
-            # -----------Techniques, Norms & Criteria heading-----------
-            elements.append(Paragraph("Techniques, Norms & Criteria", styles['Heading4']))
-            
-            tech_norm_crit_table_data = []
+        # Build the PDF document
+        doc.build(_platypus_flowables(sections), onFirstPage=add_header_footer, onLaterPages=add_header_footer)
+        return buffer.getvalue()
 
-            k = 1
-            for technique in techniques_list:
-                tech_norm_crit_table_data.append([Paragraph(f"<b>Technique {k}</b>"), Paragraph(technique)])
-                k += 1
+def save_pdf(mission:dict, document:bytes, build_hash:str):
+    """
+    Saves the PDF document of a mission as './generated/<day>/<agent names><key>.pdf' (see `pdf_path`), and its build
+    hash next to it.
+    """
+    _write_pdf(pdf_path(mission), document, build_hash)
 
-            j = 1
-            for norm_crit in norm_crit_list:
-                tech_norm_crit_table_data.append([Paragraph(f"<b>Norm/Criteria {j}</b>"), Paragraph(norm_crit)])
-                j += 1
+def _write_pdf(path:str, document:bytes, build_hash:str):
+    """
+    Writes a PDF document, and the build hash it was built from next to it.
+    """
+    # Create directory to store generated PDFs
+    os.makedirs(os.path.dirname(path), exist_ok=True)
 
-            norm_crit_table = Table(tech_norm_crit_table_data, colWidths=[111, None])
-            norm_crit_table.setStyle(style)
+    # Forget the build hash of the previous PDF, which is about to be overwritten
+    if os.path.exists(_build_hash_path(path)):
+        os.remove(_build_hash_path(path))
 
-            elements.append(norm_crit_table)
+    try:
+        with open(path, 'wb') as file:
+            file.write(document)
+    except OSError as e:
+        raise Exception(f"Please close the document \"{e.filename or path}\" and try again.")
 
-        # ------------------------------------- ADR Information -------------------------------------
-        # Check if RT mission
-        mission_sources = mission.get('sources')
-                
-        # Check if any sources are present
-        if any(mission_sources):
-            elements.append(PageBreak())
-            elements.append(Paragraph("<b>ADR Informatie / Information ADR</b>", styles['Heading2']))
+    with open(_build_hash_path(path), 'w') as file:
+        file.write(build_hash)
 
-            # -----------Sender / Receiver table-----------
-            s_r_table_data = []
-            addresses = {'Villers-Le-Bouillet': 'Rue de la métallurgie 47<br/>4530 Villers-Le-Bouillet',
-                         'Houdeng': 'Chaussée Paul Houtart 88<br/>7100 Houdeng-Goegnies',
-                         'Wijnegem': 'Bijkhoevelaan 7<br/>2110 Wijnegem'}
-            # Check if one way transport
-            if mission.get('oneWayTransport') == True:
-                s_r_table_data.append([Paragraph("<b>Verzender / Expéditeur</b>"),
-                                   Paragraph("<b>Bestemmeling / Destinataire</b>")])
-                if mission.get('return') == True:
-                    s_r_table_data.append([Paragraph(f"{client_name}<br/>{location}"),
-                                            Paragraph(f"Vinçotte NV<br/><br/>{addresses.get(departureplace)}")])
-                else:
-                    s_r_table_data.append([Paragraph(f"Vinçotte NV<br/><br/>{addresses.get(departureplace)}"),
-                                            Paragraph(f"{client_name}<br/>{location}")])
-                s_r_table = Table(s_r_table_data)
-                s_r_table.setStyle(style)
-                elements.append(s_r_table)
+def generate_pdf(mission:dict, sources:dict, build_hash:str=None, renderer:str='platypus', profile:str='standard'):
+    """
+    Generates the PDF document of a mission and saves it, along with its build hash (see `render_pdf` and `save_pdf`).
 
-            else:
-                elements.append(Paragraph('Heen / Aller', styles['Heading5']))
-                s_r_table_data.append([Paragraph("<b>Verzender / Expéditeur</b>"),
-                                   Paragraph("<b>Bestemmeling / Destinataire</b>")])
-                s_r_table_data.append([Paragraph(f"Vinçotte NV<br/><br/>{addresses.get(departureplace)}"),
-                                        Paragraph(f"{client_name}<br/>{location}")])
-                
-                s_r_table = Table(s_r_table_data)
-                s_r_table.setStyle(style)
-                elements.append(s_r_table)
-
-                elements.append(Paragraph('Terug / Retour', styles['Heading5']))
-                s_r_table_data = []
-                s_r_table_data.append([Paragraph("<b>Verzender / Expéditeur</b>"),
-                                   Paragraph("<b>Bestemmeling / Destinataire</b>")])
-                s_r_table_data.append([Paragraph(f"{client_name}<br/>{location}"),
-                                        Paragraph(f"Vinçotte NV<br/><br/>{addresses.get(departureplace)}")])
-                
-                s_r_table = Table(s_r_table_data)
-                s_r_table.setStyle(style)
-                elements.append(s_r_table)
-            
-            # -----------Description-----------
-            elements.append(Paragraph("<b>Getransporteerde ADR stoffen: / Marchandises ADR transportées:</b>", styles['Heading4']))
-            
-            i=0
-            for source in mission_sources:
-                # -----------Isotope n° heading-----------
-                if len(mission_sources)>1:
-                    i+=1
-                    elements.append(Paragraph(f"<b>Isotope {i}</b>", styles['Heading5']))
-
-                # Table data
-                ADR_table_data = []
-
-                # -----------Source internal identification (Vincotte)-----------
-                ADR_table_data.append([Paragraph(f"<b>Identificatie /<br/>Identification</b>", smaller_font_style),
-                                       Paragraph(f"{source}", smaller_font_style)])
-                
-                # -----------UN Number & description-----------
-                UN_number = sources[source]['UNnumber']
-                package = sources[source]['Package']
-                ADR_table_data.append([Paragraph(f"<b>Beschrijving /<br/>Description</b>", smaller_font_style),
-                                       Paragraph(f"{UN_number} RADIOACTIEVE STOFFEN, IN COLLI VAN TYPE {package}, 7, (E) /<br/>{UN_number} MATIÈRES RADIOACTIVES EN COLIS DE TYPE {package}, 7, (E)", smaller_font_style)])
-                
-                # -----------Isotope-----------
-                isotope = sources[source]['Isotope']
-                ADR_table_data.append([Paragraph(f"<b>Isotoop /<br/>Isotope</b>", smaller_font_style),
-                                       Paragraph(f"{isotope}", smaller_font_style)])
-                
-                # -----------Activity-----------
-                A0 = sources[source]['GBq']
-                A0_date = utils.iso_to_datetime(sources[source]['Calibrationdate'])
+    Parameters:
+    - mission (dict): The cleaned mission.
+    - sources (dict): The sources registry.
+    - build_hash (str, optional): The build hash of the mission (see `pdf_build_hash`). Computed if not provided.
+    - renderer (str, optional): The rendering engine, 'platypus' (default) or 'canvas' (see `render_pdf`).
+    - profile (str, optional): The output profile, 'standard' (default) or 'compact' (see `PDF_PROFILES`).
+    """
+    save_pdf(mission, render_pdf(mission, sources, renderer, profile), build_hash or pdf_build_hash(mission, sources, profile, renderer))
 
-                GBq, Ci = compute_activity(A0, A0_date, isotope, mission_start)
-                ADR_table_data.append([Paragraph(f"<b>Activiteit op {mission_start.strftime('%d %b %Y')} /<br/>Activité le {mission_start.strftime('%d %b %Y')}</b>", smaller_font_style),
-                                       Paragraph(f"{GBq} GBq - {Ci} Ci", smaller_font_style)])
-                
-                # -----------Package category-----------
-                pckg_category = sources[source]['Label']
-                ADR_table_data.append([Paragraph(f"<b>Label /<br/>Étiquette</b>", smaller_font_style),
-                                       Paragraph(f"{pckg_category}", smaller_font_style)])
-                
-                # -----------Transport index-----------
-                transport_index = sources[source]['Transportindex']
-                ADR_table_data.append([Paragraph(f"<b>Transportindex /<br/>Indice de transport</b>", smaller_font_style),
-                                       Paragraph(f"{transport_index}", smaller_font_style)])
-                
-                # -----------Physical state-----------
-                physical_state = sources[source]['Physicalstate']
-                ADR_table_data.append([Paragraph(f"<b>Fysiche toestand /<br/>État physique</b>", smaller_font_style),
-                                       Paragraph(f"{physical_state}", smaller_font_style)])
-                
-                # -----------Certificate-----------
-                certificate = sources[source]['Certificate']
-                ADR_table_data.append([Paragraph(f"<b>Goedkeuringscertificaat /<br/>Certificat d'approbation</b>", smaller_font_style),
-                                       Paragraph(f"{certificate}", smaller_font_style)])
-                
-                # -----------Certificate (Special Form)-----------
-                certificate_sf = sources[source]['Certificate_x0028_specialform_x0']
-                if certificate_sf is not None:
-                    ADR_table_data.append([Paragraph(f"<b>Goedkeuringscertificaat - Special Form /<br/>Certificat d'approbation - Forme spéciale</b>", smaller_font_style),
-                                       Paragraph(f"{certificate_sf}", smaller_font_style)])
-                    
-                # TODO: Replace dict accesses by .get() to avoid errors when none
-
-                # -----------Focus-----------
-                focus = sources.get(source).get('Focus')
-                if focus is not None:
-                    ADR_table_data.append([Paragraph("<b>Focus /<br/>Foyer</b>", smaller_font_style),
-                                           Paragraph(f"{focus} mm", smaller_font_style)])
-
-                # Create the table with the data
-                ADR_table = Table(ADR_table_data, colWidths=[125, None])
-
-                # Define a TableStyle
-                styleADR = TableStyle([
-                    ('TEXTCOLOR', (0,0), (-1,0), colors.black),
-                    ('ALIGN', (0,0), (-1,-1), 'LEFT'),
-                    ('VALIGN', (0,0), (-1,-1), 'CENTER'),
-                    ('BOTTOMPADDING', (0,0), (-1,-1), 4.9),
-                    ('TOPPADDING', (0,0), (-1,-1), 4.9),
-                    ('GRID', (0,0), (-1,-1), 1, colors.darkslategray),
-                ])
-
-                # Apply the style to the table
-                ADR_table.setStyle(styleADR)
-
-                # Add table to list of flowables
-                elements.append(ADR_table)
-
-                elements.append(Spacer(1, 10))
-
-                if len(mission_sources)>1 and i < len(mission_sources):
-                    elements.append(PageBreak())
-
-            # -----------Signatures of concerned parties-----------
-            elements.append(Paragraph("Signatures", styles['Heading4']))
-            elements.append(Spacer(1, 10))
-            
-            signatures_table_data = []
-            signatures_table_data.append(["Verzender / Expéditeur",
-                                          "Vervoerder / Transporteur",
-                                          "Bestemmeling / Destinataire"])
-            signatures_table = Table(signatures_table_data, colWidths=150) 
-            # Define a TableStyle
-            style_sign = TableStyle([
-                ('TEXTCOLOR', (0,0), (-1,0), colors.black),
-                ('ALIGN', (0,0), (0,-1), 'LEFT'),
-                ('ALIGN', (1,0), (1,-1), 'CENTER'),
-                ('ALIGN', (2,0), (2,-1), 'RIGHT'),
-                ('BOTTOMPADDING', (0,0), (-1,-1), 0),
-                ('TOPPADDING', (0,0), (-1,-1), 0),
-                ('GRID', (0,0), (-1,-1), 1, colors.transparent),
-            ])
-
-            # Apply the style to the table
-            signatures_table.setStyle(style_sign)
-
-            # Add table to list of flowables
-            elements.append(signatures_table)
-
-        # Create directory to store generated PDFs
-        day_missions = mission_start.strftime('%Y%m%d')
-        if not os.path.exists(f"./generated/{day_missions}"):
-            os.makedirs(f"./generated/{day_missions}")
-        
-        # Get names for file naming
-        names = ""
+def archive_pdfs(missions:list, documents:dict, sources:dict, profile:str='standard', renderer:str='platypus') -> threading.Thread:
+    """
+    Saves PDF documents rendered in memory to './generated', in a background thread, for archiving and preview.
+
+    A document that cannot be saved (e.g. open in a viewer) is skipped: it was rendered for sending, not for the archive.
+
+    Parameters:
+    - missions (list): The cleaned missions.
+    - documents (dict): The PDF documents, by mission key (see `render_pdfs`).
+    - sources (dict): The sources registry, used to record the build hash of the documents.
+    - profile (str, optional): The output profile the documents were rendered with.
+    - renderer (str, optional): The rendering engine the documents were rendered with.
+
+    Returns:
+    - threading.Thread: The thread saving the documents.
+    """
+    return _save_in_background([(save_pdf, (mission, documents[mission.get('key')], pdf_build_hash(mission, sources, profile, renderer)))
+                                for mission in missions if mission.get('key') in documents])
+
+def _save_in_background(saves:list) -> threading.Thread:
+    """
+    Runs the given (save function, arguments) tuples in a background thread, skipping the ones that fail.
+    """
+    def archive():
+        for save, args in saves:
+            try:
+                save(*args)
+            except Exception:
+                pass
+
+    thread = threading.Thread(target=archive)
+    thread.start()
+    return thread
+
+def _init_pdf_worker(sources:dict):
+    """
+    Initializes a PDF generation worker process: the sources are received once, and the styles created once.
+    """
+    global _worker_sources
+    _worker_sources = sources
+    _pdf_styles()
+
+def _run_pdf_task(function, mission:dict, sources:dict, *args):
+    """
+    Runs a PDF task (`generate_pdf` or `render_pdf`) on a mission.
+
+    Returns:
+    - tuple: The result of the task (None if it failed) and the error message (None if it succeeded).
+    """
+    try:
+        return function(mission, sources, *args), None
+    except Exception as e:
+        return None, str(e)
+
+def _run_pdf_task_in_worker(function, mission:dict, *args):
+    """
+    Runs a PDF task on a mission in a worker process, with the sources it received once (see `_init_pdf_worker`).
+    """
+    return _run_pdf_task(function, mission, _worker_sources, *args)
+
+def _run_pdf_tasks(function, tasks:list, sources:dict, max_workers:int, report):
+    """
+    Runs a PDF task on several missions, in a pool of worker processes if `max_workers` is greater than 1.
+
+    Parameters:
+    - function: The task, `generate_pdf` or `render_pdf`.
+    - tasks (list): A (mission, additional arguments) tuple per mission.
+    - sources (dict): The sources registry.
+    - max_workers (int): The number of worker processes.
+    - report (function): A callback function called with each mission, its result and its error message, as soon as
+      it is done. It is called from the calling thread.
+    """
+    if max_workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=min(max_workers, len(tasks)), initializer=_init_pdf_worker,
+                                 initargs=(sources,)) as executor:
+            futures = {executor.submit(_run_pdf_task_in_worker, function, mission, *args): mission for mission, args in tasks}
+            for future in as_completed(futures):
+                try:
+                    result, error = future.result()
+                except Exception as e:
+                    result, error = None, str(e)  # The worker process died
+                report(futures[future], result, error)
+    else:
+        for mission, args in tasks:
+            report(mission, *_run_pdf_task(function, mission, sources, *args))
+
+def generate_pdfs(missions:dict, sources:dict, keys:list=None, progress_callback=None, max_workers:int=1,
+                  force:bool=False, renderer:str='platypus', profile:str='standard') -> dict:
+    """
+    Generates PDF documents for each mission in the provided missions list, including ADR information and other mission details.
+
+    Parameters:
+    - missions (dict): A dictionary containing mission items, each with details such as start/end times, resources, customers, and ADR source information.
+    - sources (dict): A dictionary containing source items with details such as UN number, package, isotope, activity, and other ADR relevant information.
+    - keys (list, optional): The keys of the missions selected in the GUI. All missions are generated if empty or None.
+    - progress_callback (function, optional): A callback function receiving the progress, from 0 to 100.
+    - max_workers (int, optional): The number of worker processes. Defaults to 1, which generates the PDFs one after another
+      in the calling process.
+    - force (bool, optional): Whether to regenerate the PDFs that are up to date. Defaults to False.
+    - renderer (str, optional): The rendering engine, 'platypus' (default) or 'canvas' (see `render_pdf`).
+    - profile (str, optional): The output profile, 'standard' (default) or 'compact' (see `PDF_PROFILES`).
+
+    The function compiles the information of every mission into a structured format and generates a PDF document for it (see `generate_pdf`).
+    The layout is CPU-bound, so with `max_workers` greater than 1 the missions are spread across a pool of processes, each of
+    them receiving the sources only once. A failure, such as a PDF left open in a viewer, does not stop the other missions.
+    A PDF is only regenerated if the mission, its sources, the template, the profile or the renderer changed since it was
+    built (see `pdf_build_hash`), unless `force` is set.
+
+    Returns:
+    - dict: A dictionary mapping each mission key to None if its PDF was generated, or to an error message otherwise.
+    """
+
+    # print("Generating pdfs...")
+
+    # Skip missions that do not have a key in "keys" input argument list (That is, missions not selected to be generated in GUI)
+    selected_missions = [mission for mission in missions if not keys or mission.get('key') in keys]
+
+    results = {}
+    total_missions = len(selected_missions)
+
+    def report(mission, _, error):
+        results[mission.get('key')] = error
+
+        # Emit progress
+        if progress_callback:
+            progress_callback(int((len(results) / total_missions) * 100))
+
+    # Skip the PDFs that are up to date
+    pending = []
+    for mission in selected_missions:
+        build_hash = pdf_build_hash(mission, sources, profile, renderer)
+        if not force and pdf_is_up_to_date(mission, build_hash):
+            report(mission, None, None)
+        else:
+            pending.append((mission, (build_hash, renderer, profile)))
+
+    _run_pdf_tasks(generate_pdf, pending, sources, max_workers, report)
+
+    # print("Pdfs generated!")
+    return results
+
+def render_pdfs(missions:dict, sources:dict, keys:list=None, progress_callback=None, max_workers:int=1,
+                renderer:str='platypus', profile:str='standard') -> tuple:
+    """
+    Renders the PDF documents of the selected missions in memory, without writing them to disk (see `render_pdf`).
+
+    The documents can be handed straight to the send stage (see `build_om_messages`), and saved for archiving in the
+    background (see `archive_pdfs`). As with `generate_pdfs`, the missions can be spread across a pool of processes,
+    and a failure does not stop the other missions.
+
+    Parameters:
+    - missions (dict): The cleaned missions.
+    - sources (dict): The sources registry.
+    - keys (list, optional): The keys of the missions selected in the GUI. All missions are rendered if empty or None.
+    - progress_callback (function, optional): A callback function receiving the progress, from 0 to 100.
+    - max_workers (int, optional): The number of worker processes. Defaults to 1.
+    - renderer (str, optional): The rendering engine, 'platypus' (default) or 'canvas' (see `render_pdf`).
+    - profile (str, optional): The output profile, 'standard' (default) or 'compact' (see `PDF_PROFILES`).
+
+    Returns:
+    - tuple: A dictionary mapping each rendered mission key to its PDF document (bytes), and a dictionary mapping each
+      mission key to None if its PDF was rendered, or to an error message otherwise.
+    """
+    selected_missions = [mission for mission in missions if not keys or mission.get('key') in keys]
+
+    documents = {}
+    results = {}
+
+    def report(mission, document, error):
+        results[mission.get('key')] = error
+        if document is not None:
+            documents[mission.get('key')] = document
+
+        # Emit progress
+        if progress_callback:
+            progress_callback(int((len(results) / len(selected_missions)) * 100))
+
+    _run_pdf_tasks(render_pdf, [(mission, (renderer, profile)) for mission in selected_missions], sources, max_workers, report)
+    return documents, results
+
+def agent_bundles(missions:list, keys:list=None, by_day:bool=True) -> list:
+    """
+    Groups the selected missions by agent, for rendering each group into a single PDF document (see `render_bundle`).
+
+    A mission with several agents is part of the bundle of each of them.
+
+    Parameters:
+    - missions (list): The cleaned missions.
+    - keys (list, optional): The keys of the missions selected in the GUI. All missions are bundled if empty or None.
+    - by_day (bool, optional): Whether to make one bundle per agent and day (default), or one per agent for the whole
+      date range of the selected missions.
+
+    Returns:
+    - list: The bundles, as dictionaries with an 'id', the agent in 'resource', the name of the agent in 'name' (followed
+      by their email if another agent of the period has the same name), the day ('YYYYMMDD') or date range
+      ('YYYYMMDD-YYYYMMDD') in 'period' and the 'missions', in chronological order. The missions without agents are in
+      no bundle (see `unbundled_missions`).
+    """
+    selected_missions = sorted((mission for mission in missions if not keys or mission.get('key') in keys),
+                               key=lambda mission: (mission['start'], mission.get('key')))
+    days = [model.start_of(mission).strftime('%Y%m%d') for mission in selected_missions]
+    date_range = f"{days[0]}-{days[-1]}" if days and days[0] != days[-1] else (days[0] if days else '')
+
+    bundles = {}
+    for mission, day in zip(selected_missions, days):
+        period = day if by_day else date_range
         for resource in mission.get('resources'):
-            names += resource.get('lastName') + " " + resource.get('firstName') + " - "
-        
-        # Create a PDF document
-        doc = SimpleDocTemplate(f"./generated/{day_missions}/{names}{mission.get('key')}.pdf", pagesize=A4, topMargin=100)
-        
+            agent = f"{resource.get('lastName')} {resource.get('firstName')}"
+            bundle = bundles.setdefault((period, agent, resource.get('email')), {
+                "resource": resource,
+                "name": agent,
+                "period": period,
+                "missions": []
+            })
+            bundle['missions'].append(mission)
+
+    # Agents with the same name get their own bundle, told apart by their email
+    agents = [(period, agent) for period, agent, _ in bundles]
+    for (period, agent, email), bundle in bundles.items():
+        if agents.count((period, agent)) > 1:
+            bundle['name'] = f"{agent} ({email or 'no email'})"
+        bundle['id'] = f"{period}/{bundle['name']}"
+    return list(bundles.values())
+
+def unbundled_missions(missions:list, keys:list=None) -> list:
+    """
+    Returns the keys of the selected missions that are in no bundle, since they have no agent (see `agent_bundles`).
+    """
+    return [mission.get('key') for mission in missions
+            if (not keys or mission.get('key') in keys) and not mission.get('resources')]
+
+def _report_unbundled(missions:list, keys:list, results:dict):
+    """
+    Reports the selected missions without agents as failed in the results of the bundles, so that they are not
+    silently left out.
+    """
+    for key in unbundled_missions(missions, keys):
+        results[key] = "The mission has no agent, so it is in no bundle."
+
+def bundle_path(bundle:dict) -> str:
+    """
+    Returns the path of the PDF document of a bundle: './generated/<period>/<agent name> - <period>.pdf'.
+    """
+    return f"./generated/{bundle['period']}/{bundle['name']} - {bundle['period']}.pdf"
+
+def bundle_build_hash(bundle:dict, sources:dict, profile:str='standard', renderer:str='platypus') -> str:
+    """
+    Computes the build hash of a bundle, from the build hashes of its missions (see `pdf_build_hash`).
+    """
+    payload = json.dumps([pdf_build_hash(mission, sources, profile, renderer) for mission in bundle['missions']])
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def _bundle_title(mission:dict) -> str:
+    """
+    Returns the title of the bookmark of a mission in a bundle, which also identifies it when splitting the bundle.
+    """
+    intervention_date = model.start_of(mission).strftime('%d/%m/%Y')
+    return f"Mission order n°{mission.get('key')} - {intervention_date}"
+
+class _BundleMarker(ActionFlowable):
+    """
+    Marks the start of a mission in a bundle: the next page gets its bookmark, and the page numbers restart from 1.
+    """
+    def __init__(self, key:str, title:str):
+        ActionFlowable.__init__(self)
+        self.key = key
+        self.title = title
+
+    def apply(self, doc):
+        doc.bundle_next_mission = (self.key, self.title)
+
+def _add_bundle_header_footer(canvas, doc):
+    """
+    Draws the header and footer on each page of a bundle (see `add_header_footer`), with the page numbers of each
+    mission starting from 1, and adds the bookmark of the missions starting on the page.
+    """
+    if doc.bundle_next_mission:
+        key, title = doc.bundle_next_mission
+        canvas.bookmarkPage(f"OM{key}")
+        canvas.addOutlineEntry(title, f"OM{key}", level=0)
+        doc.bundle_next_mission = None
+        doc.bundle_first_page = doc.page
+    add_header_footer(canvas, SimpleNamespace(page=doc.page - doc.bundle_first_page + 1, pdf_profile=doc.pdf_profile))
+
+def render_bundle(bundle:dict, sources:dict, renderer:str='platypus', profile:str='standard') -> bytes:
+    """
+    Renders the missions of a bundle (see `agent_bundles`) into a single PDF document, in memory.
+
+    The document setup, fonts and header images are shared by all the missions, each of which starts on a new page with
+    its own bookmark and page numbers: the bundle can be split back into the PDF documents of its missions (see
+    `split_bundle`).
+
+    Parameters:
+    - bundle (dict): The bundle.
+    - sources (dict): The sources registry.
+    - renderer (str, optional): The rendering engine, 'platypus' (default) or 'canvas' (see `render_pdf`).
+    - profile (str, optional): The output profile, 'standard' (default) or 'compact' (see `PDF_PROFILES`).
+
+    Returns:
+    - bytes: The content of the PDF document.
+    """
+    parts = [(mission.get('key'), _bundle_title(mission), mission_order_sections(mission, sources))
+             for mission in bundle['missions']]
+    with _pdf_profile(profile) as settings:
+        if renderer == 'canvas':
+            return fastpdf.render_bundle(parts, profile)
+
+        elements = []
+        for index, (key, title, sections) in enumerate(parts):
+            if index:
+                elements += [_BundleMarker(key, title), PageBreak()]
+            elements += _platypus_flowables(sections)
+
+        # Create a PDF document in memory
+        buffer = io.BytesIO()
+        doc = SimpleDocTemplate(buffer, pagesize=A4, topMargin=100, **settings)
+        doc.pdf_profile = profile
+        doc.bundle_next_mission = parts[0][:2]
+        doc.bundle_first_page = 1
+
         # Build the PDF document
-        try:
-            doc.build(elements, onFirstPage=add_header_footer, onLaterPages=add_header_footer)
-        except Exception as e:
-            raise Exception(f"Please close the document \"{e.filename}\" and try again.")
-            
-    # print("Pdfs generated!")
-    return
+        doc.build(elements, onFirstPage=_add_bundle_header_footer, onLaterPages=_add_bundle_header_footer)
+        return buffer.getvalue()
+
+def split_bundle(document:bytes) -> dict:
+    """
+    Splits the PDF document of a bundle back into the PDF documents of its missions, using its bookmarks.
+
+    Returns:
+    - dict: A dictionary mapping each mission key to its PDF document (bytes).
+    """
+    if PdfReader is None:
+        raise Exception("The pypdf package is required to split the mission order bundles.")
+    reader = PdfReader(io.BytesIO(document))
+    starts = sorted((reader.get_destination_page_number(entry), sent_index.KEY_PATTERN.search(entry.title).group(1))
+                    for entry in reader.outline if not isinstance(entry, list))
+
+    documents = {}
+    for index, (first_page, key) in enumerate(starts):
+        last_page = starts[index + 1][0] if index + 1 < len(starts) else len(reader.pages)
+        writer = PdfWriter()
+        for page_number in range(first_page, last_page):
+            writer.add_page(reader.pages[page_number])
+        buffer = io.BytesIO()
+        writer.write(buffer)
+        documents[key] = buffer.getvalue()
+    return documents
+
+def save_bundle(bundle:dict, document:bytes, build_hash:str, sources:dict=None, profile:str='standard',
+                renderer:str='platypus'):
+    """
+    Saves the PDF document of a bundle (see `bundle_path`), and its build hash next to it. If the sources are provided,
+    the bundle is also split back into the PDF documents of its missions, saved as if they were generated one by one
+    with the same output profile and rendering engine.
+    """
+    _write_pdf(bundle_path(bundle), document, build_hash)
+    if sources is not None:
+        missions = {mission.get('key'): mission for mission in bundle['missions']}
+        for key, mission_document in split_bundle(document).items():
+            save_pdf(missions[key], mission_document, pdf_build_hash(missions[key], sources, profile, renderer))
+
+def generate_bundle(bundle:dict, sources:dict, build_hash:str=None, renderer:str='platypus', profile:str='standard',
+                    split:bool=False):
+    """
+    Generates the PDF document of a bundle and saves it, along with its build hash (see `render_bundle` and `save_bundle`).
+    With `split`, the PDF documents of its missions are saved as well.
+    """
+    save_bundle(bundle, render_bundle(bundle, sources, renderer, profile),
+                build_hash or bundle_build_hash(bundle, sources, profile, renderer), sources if split else None, profile, renderer)
+
+def generate_bundles(missions:dict, sources:dict, keys:list=None, progress_callback=None, max_workers:int=1,
+                     force:bool=False, renderer:str='platypus', by_day:bool=True, split:bool=False,
+                     profile:str='standard') -> dict:
+    """
+    Generates one PDF document per agent and day (or date range) with all their mission orders, instead of one per
+    mission (see `agent_bundles` and `generate_bundle`).
+
+    As with `generate_pdfs`, the bundles can be spread across a pool of processes, a failure does not stop the other
+    bundles, and a bundle is only regenerated if one of its missions changed, unless `force` is set.
+
+    Parameters:
+    - missions (dict): The cleaned missions.
+    - sources (dict): The sources registry.
+    - keys (list, optional): The keys of the missions selected in the GUI. All missions are generated if empty or None.
+    - progress_callback (function, optional): A callback function receiving the progress, from 0 to 100.
+    - max_workers (int, optional): The number of worker processes. Defaults to 1.
+    - force (bool, optional): Whether to regenerate the bundles that are up to date. Defaults to False.
+    - renderer (str, optional): The rendering engine, 'platypus' (default) or 'canvas' (see `render_pdf`).
+    - by_day (bool, optional): Whether to make one bundle per agent and day (default), or per agent for the whole date range.
+    - split (bool, optional): Whether to also save the PDF documents of the missions, split from the bundles. Defaults to False.
+    - profile (str, optional): The output profile, 'standard' (default) or 'compact' (see `PDF_PROFILES`).
+
+    Returns:
+    - dict: A dictionary mapping each mission key to None if its bundles were generated, or to an error message otherwise
+      (including the missions without agents, see `unbundled_missions`).
+    """
+    bundles = agent_bundles(missions, keys, by_day)
+
+    results = {}
+    done = 0
+
+    def report(bundle, _, error):
+        nonlocal done
+        done += 1
+        for mission in bundle['missions']:
+            results[mission.get('key')] = results.get(mission.get('key')) or error
+
+        # Emit progress
+        if progress_callback:
+            progress_callback(int((done / len(bundles)) * 100))
+
+    # Skip the bundles that are up to date
+    pending = []
+    for bundle in bundles:
+        build_hash = bundle_build_hash(bundle, sources, profile, renderer)
+        up_to_date = _is_up_to_date(bundle_path(bundle), build_hash)
+        if up_to_date and split:
+            up_to_date = all(pdf_is_up_to_date(mission, pdf_build_hash(mission, sources, profile, renderer)) for mission in bundle['missions'])
+        if not force and up_to_date:
+            report(bundle, None, None)
+        else:
+            pending.append((bundle, (build_hash, renderer, profile, split)))
+
+    _run_pdf_tasks(generate_bundle, pending, sources, max_workers, report)
+    _report_unbundled(missions, keys, results)
+    return results
+
+def render_bundles(missions:dict, sources:dict, keys:list=None, progress_callback=None, max_workers:int=1,
+                   renderer:str='platypus', profile:str='standard') -> tuple:
+    """
+    Renders the PDF documents of the bundles of the selected missions in memory, one per agent and day (see
+    `agent_bundles` and `render_bundle`).
+
+    Returns:
+    - tuple: A dictionary mapping each rendered bundle id to its PDF document (bytes), and a dictionary mapping each
+      mission key to None if its bundles were rendered, or to an error message otherwise (including the missions
+      without agents, see `unbundled_missions`).
+    """
+    bundles = agent_bundles(missions, keys)
+
+    documents = {}
+    results = {}
+    done = 0
+
+    def report(bundle, document, error):
+        nonlocal done
+        done += 1
+        for mission in bundle['missions']:
+            results[mission.get('key')] = results.get(mission.get('key')) or error
+        if document is not None:
+            documents[bundle['id']] = document
+
+        # Emit progress
+        if progress_callback:
+            progress_callback(int((done / len(bundles)) * 100))
+
+    _run_pdf_tasks(render_bundle, [(bundle, (renderer, profile)) for bundle in bundles], sources, max_workers, report)
+    _report_unbundled(missions, keys, results)
+    return documents, results
+
+def profile_summary(sizes:list, sample:dict, sources:dict, renderer:str='platypus', profile:str='standard',
+                    bundled:bool=False) -> str:
+    """
+    Summarizes the size of PDF documents rendered with an output profile other than the standard one, and how much
+    smaller than with the standard profile they are. The reduction is measured on a sample document rendered with both
+    profiles, rather than by rendering every document twice.
+
+    Parameters:
+    - sizes (list): The sizes of the PDF documents, in bytes.
+    - sample (dict): The mission of one of the documents, or its bundle if `bundled` (see `agent_bundles`).
+    - sources (dict): The sources registry.
+    - renderer (str, optional): The rendering engine, 'platypus' (default) or 'canvas' (see `render_pdf`).
+    - profile (str, optional): The output profile of the documents (see `PDF_PROFILES`).
+    - bundled (bool, optional): Whether the documents are bundles. Defaults to False.
+
+    Returns:
+    - str: The summary, or None with the standard profile.
+    """
+    if profile == 'standard' or not sizes:
+        return None
+    render = render_bundle if bundled else render_pdf
+    standard_size, profile_size = (len(render(sample, sources, renderer, name)) for name in ('standard', profile))
+    measured_on = f"the bundle {sample['id']}" if bundled else f"mission order n°{sample.get('key')}"
+    documents = f"{len(sizes)} PDF documents" if len(sizes) > 1 else "1 PDF document"
+    return (f"{documents} of {sum(sizes) / len(sizes) / 1024:.1f} KiB on average with the {profile} profile, "
+            f"{1 - profile_size / standard_size:.0%} smaller than with the standard profile (measured on {measured_on}).")
+
+def archive_bundles(bundles:list, documents:dict, sources:dict, profile:str='standard', renderer:str='platypus') -> threading.Thread:
+    """
+    Saves the PDF documents of bundles rendered in memory to './generated', in a background thread (see `archive_pdfs`).
+    """
+    return _save_in_background([(save_bundle, (bundle, documents[bundle['id']], bundle_build_hash(bundle, sources, profile, renderer),
+                                               None, profile, renderer))
+                                for bundle in bundles if bundle['id'] in documents])
 
 def compute_activity(A0:float, A0_date:datetime, isotope:str, date:datetime):
     """
@@ -397,20 +1059,47 @@ def compute_activity(A0:float, A0_date:datetime, isotope:str, date:datetime):
     - isotope (str): The type of the isotope, used to determine its half-life.
     - date (datetime): The target date for which the activity is to be calculated.
 
+    The mission orders look the activities up in the activity table of the sources registry instead
+    (see `activity.source_activity`).
+
     Returns:
     - tuple: A tuple containing two float values:
         - The first float is the calculated activity in GBq on the target date.
         - The second float is the calculated activity in Ci on the target date.
     """
-    half_life = {'Cs-137': 11012.05,
-                 'Ir-192': 73.83,
-                 'Se-75': 119.78}
     timedelta = date.date()-A0_date.date()
     days_diff_float = utils.timedelta_to_days_float(timedelta)
-    GBq = round(A0*((1/2)**(days_diff_float/half_life[isotope])), 2)
-    Ci = round((GBq / 37), 2)
+    GBq = round(A0*((1/2)**(days_diff_float/activity.HALF_LIVES[isotope])), 2)
+    Ci = round((GBq / activity.GBQ_PER_CI), 2)
     return GBq, Ci
 
+def _downscaled_logo(path:str, width:float, height:float) -> ImageReader:
+    """
+    Returns a logo downscaled to `LOGO_DPI` at its printed size, in points. PNG logos stay PNG so that they keep their
+    transparency and sharp edges, the others are saved as JPEG.
+    """
+    buffer = io.BytesIO()
+    with Image.open(path) as image:
+        image.thumbnail((round(width / 72 * LOGO_DPI), round(height / 72 * LOGO_DPI)))
+        if path.lower().endswith('.png'):
+            image.save(buffer, 'PNG', optimize=True)
+        else:
+            image.convert('RGB').save(buffer, 'JPEG', quality=optimize.JPEG_QUALITY, optimize=True)
+    buffer.seek(0)
+    return ImageReader(buffer)
+
+def _page_logos(profile:str='standard'):
+    """
+    Returns the logos of the page header for an output profile, read and decoded once per process.
+    """
+    if profile not in _logos:
+        paths = (utils.resource_path("./media/Vincotte_RGB_H.png"), utils.resource_path("./media/Member-Group-Kiwa-FC.jpg"))
+        if profile == 'compact':
+            _logos[profile] = (_downscaled_logo(paths[0], 52, 52), _downscaled_logo(paths[1], 62.28, 30))
+        else:
+            _logos[profile] = tuple(ImageReader(path) for path in paths)
+    return _logos[profile]
+
 def add_header_footer(canvas, doc):
     """
     Draws the header and footer on each page of a PDF document.
@@ -419,132 +1108,359 @@ def add_header_footer(canvas, doc):
     It adds a consistent header and footer to each page, enhancing the document's presentation and providing essential
     information like page numbers. The function also includes the company's logos in the header for branding purposes.
 
+    The static part of the header (the logos) is drawn once per document in a form XObject, which every page then
+    references: the logos are embedded only once in the PDF, and only the page number is drawn per page.
+
     Parameters:
     - canvas: The canvas represents the current page in the PDF document. It is used to draw the header and footer elements.
-    - doc: The document object that is being generated. It provides context, such as the current page number.
+    - doc: The document object that is being generated. It provides context, such as the current page number, and the
+      output profile of the logos in its `pdf_profile` attribute, if any (see `_pdf_profile`).
 
     Returns:
     - None: This function directly modifies the canvas and does not return any value.
     """
     canvas.saveState()
 
+    # Header, drawn once per document
+    if not canvas.hasForm(PAGE_HEADER_FORM):
+        logo1, logo2 = _page_logos(getattr(doc, 'pdf_profile', 'standard'))
+        canvas.beginForm(PAGE_HEADER_FORM)
+        canvas.drawImage(logo1, 75, 759, width=52, height=52)  # Draw the first logo
+        canvas.drawImage(logo2, 135, 760, width=62.28, height=30)  # Draw the second logo
+        canvas.endForm()
+    canvas.doForm(PAGE_HEADER_FORM)
+
     # Footer
     footer_text = "Page %d" % doc.page
     canvas.setFont("Helvetica", 10)
     canvas.drawString(75, 30, footer_text)  # Adjust coordinates as needed
-
-    # Logo image to include
-    logo1_path = utils.resource_path("./media/Vincotte_RGB_H.png")
-    logo2_path = utils.resource_path("./media/Member-Group-Kiwa-FC.jpg")
-    canvas.drawImage(logo1_path, 75, 759, width=52, height=52)  # Draw the first logo
-    canvas.drawImage(logo2_path, 135, 760, width=62.28, height=30)  # Draw the second logo
-    
-    # Optionally add more elements here (e.g., footer text)
     
     canvas.restoreState()
 
-def check_sources_double_bookings(missions: list) -> dict:
+def mission_fingerprint(mission:dict, sources:dict, file_paths:list) -> str:
     """
-    This function iterates over a list of missions and identifies sources that are booked during overlapping times.
-    It returns a dictionary with sources as keys and the list of mission keys during which overlaps occur as values.
+    Computes a fingerprint of the content of a mission order.
+
+    The fingerprint covers the cleaned mission fields, the records of the sources it references and the content of its
+    additional attachments. The generated PDF itself is not included, since it embeds its creation date: it is entirely
+    derived from the mission and sources anyway.
 
     Parameters:
-    missions (list): A list of mission dictionaries. Each dictionary must contain a 'sources' key, which is a list of sources,
-                     and 'start' and 'end' keys with datetime strings.
+    - mission (dict): The cleaned mission.
+    - sources (dict): The sources registry.
+    - file_paths (list): The paths to the additional attachments of the mission.
 
     Returns:
-    double_bookings (dict): A dictionary of sources with overlapping bookings, along with the mission keys where these overlaps occur.
+    - str: The hexadecimal SHA-256 fingerprint.
     """
-    booked_sources = {}
+    fields = {key: value for key, value in mission.items() if key != 'attachmentFileNames'}
+    referenced_sources = {title: sources.get(title) for title in mission.get('sources') or []}
+    attachments = sorted((os.path.basename(file_path), utils.file_hash(file_path)) for file_path in file_paths if os.path.exists(file_path))
+    payload = json.dumps([fields, referenced_sources, attachments], sort_keys=True, default=model.json_default)
+    return hashlib.sha256(payload.encode()).hexdigest()
 
-    # Iterate over all missions
-    for mission in missions:
-        sources = mission.get('sources', [])
-        mission_start = datetime.strptime(mission['start'], '%Y-%m-%d %H:%M:%S')
-        mission_end = datetime.strptime(mission['end'], '%Y-%m-%d %H:%M:%S')
-
-        # Store sources with their respective mission keys and timings
-        for source in sources:
-            if source not in booked_sources:
-                booked_sources[source] = []
-            booked_sources[source].append({'key': mission['key'], 'start': mission_start, 'end': mission_end})
-
-    # Check for double bookings in booked_sources
-    double_bookings = {}
-    for source, entries in booked_sources.items():
-        if len(entries) > 1:
-            # Check for overlapping times
-            for i in range(len(entries)):
-                for j in range(i + 1, len(entries)):
-                    if entries[i]['end'] > entries[j]['start'] and entries[i]['start'] < entries[j]['end']:
-                        if source not in double_bookings:
-                            double_bookings[source] = []
-                        double_bookings[source].extend([entries[i]['key'], entries[j]['key']])
-                        break
-
-    # Remove duplicate mission keys in the results
-    for source in double_bookings:
-        double_bookings[source] = list(set(double_bookings[source]))
-
-    return None if not double_bookings else double_bookings
-
-
-def send_om(missions:dict, keys:list[str], sender_name:str, progress_callback=None):
-    # print("Sending mission orders...")
+def _om_content(numbers:str, sender_name:str, shared_links:list, several:bool=False) -> str:
+    """
+    Builds the body of a mission order email, listing the documents linked rather than attached, if any.
+    """
+    content = f"Please find in attachment the Intervention Document{'s' if several else ''} (Nr: {numbers}).\n\n"
+    if shared_links:
+        content += "The following documents are available on SharePoint:\n"
+        content += "".join(f"- {link['name']}: {link['url']}\n" for link in shared_links)
+        content += "\n"
+    content += f"Kind regards,\n\n{sender_name}\n\n"
+    return content
+
+def _additional_attachments(mission:dict) -> list:
+    """
+    Returns the paths to the additional attachments of a mission, downloaded to './temp/attachments/<day>/<key>'.
+    """
+    mission_start = model.start_of(mission)
+    additional_attachments_path = f"{ADDITIONAL_ATTACHMENTS_DIR}/{mission_start.strftime('%Y%m%d')}/{mission.get('key')}"
+    additional_attachments = []
+    
+    if os.path.isdir(additional_attachments_path):
+        for file in os.listdir(additional_attachments_path):
+            additional_attachments.append(f"{additional_attachments_path}/{file}")
+    return additional_attachments
 
-    # Variables for process tracking
-    total_missions = len(missions)
-    processed_count = 0
+def _is_additional_attachment(file_path:str) -> bool:
+    """
+    Returns whether an attachment of an email is an additional attachment of a mission (see `_additional_attachments`),
+    rather than a generated mission order.
+    """
+    return file_path.startswith(ADDITIONAL_ATTACHMENTS_DIR + '/')
 
-    # Iterate over all missions
-    for mission in (missions):
-        # Skip missions that have a key in "keys" input argument list (That is, missions not selected to be generated in GUI)
-        if keys and mission.get('key') not in keys:
-            continue
-        # Initialize empty list of recipients
-        recipients = []
-        # For finding files via filename
-        names = ""
-        # Iterate over all mission resources
-        for resource in mission.get('resources'):
-            recipients.append(resource.get('email'))
-            names += f"{resource.get('lastName')} {resource.get('firstName')} - "
-        # Remove any empty or None values
-        recipients = [r for r in recipients if r and r != '']
-        number = mission.get('key')
-        mission_start = datetime.strptime(mission['start'], '%Y-%m-%d %H:%M:%S')
-        intervention_date = mission_start.strftime('%d/%m/%Y')
-        
-        subject = f"Mission order n°{number} - {intervention_date}"
-        
-        content = f"Please find in attachment the Intervention Document (Nr: {number}).\n\nKind regards,\n\n{sender_name}\n\n"
-            
-        attachment_path = [f"generated/{mission_start.strftime('%Y%m%d')}/{names}{number}.pdf"]
+def _unique_attachments(file_paths:list) -> list:
+    """
+    Removes the attachments with the same name and content as a previous one (e.g. a drawing linked to several missions).
+    """
+    unique_file_paths = []
+    attached = set()
+    for file_path in file_paths:
+        identity = (os.path.basename(file_path), utils.file_hash(file_path) if os.path.exists(file_path) else file_path)
+        if identity not in attached:
+            attached.add(identity)
+            unique_file_paths.append(file_path)
+    return unique_file_paths
+
+def build_om_message(mission:dict, sender_name:str, sources:dict=None, document:bytes=None) -> dict:
+    """
+    Builds the email carrying the mission order of a mission to its agents.
 
-        additional_attachments_path = f"temp/attachments/{mission_start.strftime('%Y%m%d')}/{number}"
-        
-        if os.path.isdir(additional_attachments_path):
-            for file in os.listdir(additional_attachments_path):
-                attachment_path.append(f"{additional_attachments_path}/{file}")
-
-        sender_address = 'NDTplanning@vincotte.be'
-
-        # # recipients_str is for development purposes
-        # recipients_str = "[\n"
-        # for recipient in recipients:
-        #     recipients_str += recipient + ",\n"
-        # recipients_str += "]\n\n"
-        # content += recipients_str
-        
-        outbound.send_email(subject, recipients, content, attachment_path, sender_address)
+    Parameters:
+    - mission (dict): The cleaned mission.
+    - sender_name (str): The name of the planner sending the mission order, used to sign the email.
+    - sources (dict, optional): The sources registry. If provided, the fingerprint of the mission order is computed
+      (see `mission_fingerprint`).
+    - document (bytes, optional): The PDF document of the mission, rendered in memory (see `render_pdfs`). If provided,
+      it is attached from memory instead of from './generated'.
+
+    Returns:
+    - dict: The email, as expected by `outbound.send_emails`: subject, recipients, content, file paths of the
+      generated PDF and additional attachments, from address, the mission key in 'keys', its fingerprint in
+      'fingerprints', the SharePoint documents linked in the body in 'shared_links' and the in-memory PDF in 'documents'.
+    """
+    mission = model.as_mission(mission)
+    # Initialize empty list of recipients
+    recipients = []
+    # Iterate over all mission resources
+    for resource in mission.get('resources'):
+        recipients.append(resource.get('email'))
+    # For finding files via filename
+    names = mission.file_prefix
+    # Remove any empty or None values
+    recipients = [r for r in recipients if r and r != '']
+    number = mission.get('key')
+    mission_start = mission.start
+    intervention_date = mission_start.strftime('%d/%m/%Y')
+    
+    subject = f"Mission order n°{number} - {intervention_date}"
+    
+    shared_links = mission.get('attachmentSharedLinks') or []
+    content = _om_content(number, sender_name, shared_links)
         
-        # Update processed count and emit progress
-        processed_count += 1
-        progress = int((processed_count / total_missions) * 100)
-        if progress_callback:
-            progress_callback(progress)
+    # The PDF is attached from memory if it was rendered in memory, from './generated' otherwise
+    pdf_name = f"{names}{number}.pdf"
+    documents = [{"name": pdf_name, "content": document}] if document is not None else []
+    attachment_path = [f"generated/{mission_start.strftime('%Y%m%d')}/{pdf_name}"] if document is None else []
+
+    additional_attachments = _additional_attachments(mission)
+    attachment_path += additional_attachments
+
+    sender_address = 'NDTplanning@vincotte.be'
+
+    # # recipients_str is for development purposes
+    # recipients_str = "[\n"
+    # for recipient in recipients:
+    #     recipients_str += recipient + ",\n"
+    # recipients_str += "]\n\n"
+    # content += recipients_str
+
+    return {
+        "keys": [number],
+        "subject": subject,
+        "recipients": recipients,
+        "content": content,
+        "file_paths": attachment_path,
+        "from_address": sender_address,
+        "fingerprints": {number: mission_fingerprint(mission, sources, additional_attachments)} if sources is not None else {},
+        "shared_links": shared_links,
+        "documents": documents
+    }
+
+def group_om_messages(messages:list, sender_name:str) -> list:
+    """
+    Consolidates the mission order emails sent to the same recipients for the same day into a single email.
+
+    The consolidated email lists the intervention numbers of all its missions in its subject and body, and carries all
+    their PDFs and additional attachments. Attachments with the same name and content (e.g. a drawing linked to several
+    missions) are attached only once. Emails that are alone in their group are left unchanged.
+
+    Parameters:
+    - messages (list): The emails, one per mission, as built by `build_om_message`.
+    - sender_name (str): The name of the planner sending the mission orders.
+
+    Returns:
+    - list: The emails, one per set of recipients and day.
+    """
+    groups = {}
+    for message in messages:
+        intervention_date = sent_index.parse_subject(message['subject'])[1]
+        recipients = tuple(sorted(recipient.lower() for recipient in message['recipients']))
+        groups.setdefault((recipients, intervention_date), []).append(message)
+
+    grouped_messages = []
+    for (_, intervention_date), group in groups.items():
+        if len(group) == 1:
+            grouped_messages.extend(group)
+            continue
+
+        keys = [key for message in group for key in message['keys']]
+        numbers = ", ".join(keys)
+
+        # De-duplicate the attachments by name and content
+        file_paths = _unique_attachments([file_path for message in group for file_path in message['file_paths']])
+
+        # De-duplicate the SharePoint links
+        shared_links = list({link['url']: link for message in group for link in message.get('shared_links') or []}.values())
+
+        grouped_messages.append({
+            "keys": keys,
+            "subject": "Mission orders " + ", ".join(f"n°{key}" for key in keys) + f" - {intervention_date}",
+            "recipients": group[0]['recipients'],
+            "content": _om_content(numbers, sender_name, shared_links, several=True),
+            "file_paths": file_paths,
+            "from_address": group[0]['from_address'],
+            "fingerprints": {key: fingerprint for message in group for key, fingerprint in message['fingerprints'].items()},
+            "shared_links": shared_links,
+            "documents": [document for message in group for document in message.get('documents') or []]
+        })
+    return grouped_messages
+
+def build_bundle_message(bundle:dict, sender_name:str, sources:dict=None, document:bytes=None) -> dict:
+    """
+    Builds the email carrying the bundle of the mission orders of an agent for a day (see `agent_bundles`) to this agent.
+
+    Parameters:
+    - bundle (dict): The bundle, of a single day.
+    - sender_name (str): The name of the planner sending the mission orders, used to sign the email.
+    - sources (dict, optional): The sources registry. If provided, the fingerprints of the mission orders are computed.
+    - document (bytes, optional): The PDF document of the bundle, rendered in memory (see `render_bundles`). If provided,
+      it is attached from memory instead of from './generated'.
+
+    Returns:
+    - dict: The email, as built by `build_om_message`, for all the missions of the bundle.
+    """
+    missions = bundle['missions']
+    keys = [mission.get('key') for mission in missions]
+    numbers = ", ".join(keys)
+    intervention_date = model.start_of(missions[0]).strftime('%d/%m/%Y')
+    if len(keys) == 1:
+        subject = f"Mission order n°{keys[0]} - {intervention_date}"
+    else:
+        subject = "Mission orders " + ", ".join(f"n°{key}" for key in keys) + f" - {intervention_date}"
+
+    # De-duplicate the SharePoint links
+    shared_links = list({link['url']: link for mission in missions for link in mission.get('attachmentSharedLinks') or []}.values())
+
+    # The bundle is attached from memory if it was rendered in memory, from './generated' otherwise
+    path = bundle_path(bundle)
+    documents = [{"name": os.path.basename(path), "content": document}] if document is not None else []
+    additional_attachments = {mission.get('key'): _additional_attachments(mission) for mission in missions}
+    file_paths = ([path] if document is None else []) + _unique_attachments(
+        [file_path for mission in missions for file_path in additional_attachments[mission.get('key')]])
+
+    return {
+        "keys": keys,
+        "subject": subject,
+        "recipients": [bundle['resource'].get('email')] if bundle['resource'].get('email') else [],
+        "content": _om_content(numbers, sender_name, shared_links, several=len(keys) > 1),
+        "file_paths": file_paths,
+        "from_address": 'NDTplanning@vincotte.be',
+        "fingerprints": {mission.get('key'): mission_fingerprint(mission, sources, additional_attachments[mission.get('key')])
+                         for mission in missions} if sources is not None else {},
+        "shared_links": shared_links,
+        "documents": documents
+    }
+
+def build_om_messages(missions:dict, keys:list[str], sender_name:str, delivered:dict=None, group_by_agent:bool=False,
+                      optimize_attachments:bool=False, sources:dict=None, last_fingerprints:dict=None, documents:dict=None,
+                      bundle:bool=False) -> list:
+    """
+    Builds the mission order emails of the selected missions (see `build_om_message`).
+
+    Parameters:
+    - missions (dict): The cleaned missions.
+    - keys (list): The keys of the missions selected in the GUI. All missions are included if empty or None.
+    - sender_name (str): The name of the planner sending the mission orders.
+    - delivered (dict, optional): The sent mission orders index (see `sent_index.load`). If provided, the mission
+      orders already delivered to the same recipients are skipped.
+    - group_by_agent (bool, optional): Whether to send a single email per set of recipients and day, carrying all
+      their mission orders (see `group_om_messages`). Defaults to False.
+    - optimize_attachments (bool, optional): Whether to replace the additional attachments with lighter variants
+      (downscaled images, recompressed PDFs, see `optimize.optimize_attachment`). Defaults to False.
+    - sources (dict, optional): The sources registry, used to compute the fingerprint of each mission order.
+    - last_fingerprints (dict, optional): The fingerprints of the last delivered mission orders, by mission key (see
+      `outbox.delivered_fingerprints`). If provided along with `sources`, the mission orders whose content did not
+      change since they were last delivered are skipped.
+    - documents (dict, optional): The PDF documents rendered in memory, by mission key (see `render_pdfs`), or by
+      bundle id (see `render_bundles`). If provided, the PDFs are attached from memory instead of from './generated'.
+    - bundle (bool, optional): Whether to send each agent a single email per day, carrying the bundle of all their
+      mission orders of the day (see `build_bundle_message`) instead of one PDF per mission. Defaults to False.
+
+    Returns:
+    - list: The emails, one per selected mission, or one per set of recipients (or agent if bundled) and day if grouped.
+    """
+    # Skip missions that do not have a key in "keys" input argument list (That is, missions not selected to be sent in GUI)
+    documents = documents or {}
+    if bundle:
+        messages = {}
+        for agent_bundle in agent_bundles(missions, keys):
+            message = build_bundle_message(agent_bundle, sender_name, sources, documents.get(agent_bundle['id']))
+            # Agents with exactly the same missions (e.g. a team) share a single email, as without bundles
+            same_missions = messages.get(tuple(message['keys']))
+            if same_missions:
+                same_missions['recipients'] += [recipient for recipient in message['recipients'] if recipient not in same_missions['recipients']]
+            else:
+                messages[tuple(message['keys'])] = message
+        messages = list(messages.values())
+    else:
+        messages = [build_om_message(mission, sender_name, sources, documents.get(mission.get('key')))
+                    for mission in missions if not keys or mission.get('key') in keys]
+
+    # Skip mission orders already delivered
+    if delivered is not None:
+        messages = [message for message in messages if not sent_index.is_delivered(delivered, message)]
+
+    # Skip mission orders that did not change since they were last delivered
+    if last_fingerprints is not None and sources is not None:
+        messages = [message for message in messages if any(last_fingerprints.get(key) != fingerprint for key, fingerprint in message['fingerprints'].items())]
+
+    # Only the additional attachments are optimized: the mission orders are generated as lean as they can be
+    if optimize_attachments:
+        for message in messages:
+            message['file_paths'] = [optimize.optimize_attachment(file_path) if _is_additional_attachment(file_path) else file_path
+                                     for file_path in message['file_paths']]
+
+    if group_by_agent and not bundle:
+        messages = group_om_messages(messages, sender_name)
+    return messages
+
+def send_om(missions:dict, keys:list[str], sender_name:str, progress_callback=None, max_workers:int=1, delivered:dict=None,
+            batch:bool=False, group_by_agent:bool=False, optimize_attachments:bool=False, transport=None) -> dict:
+    """
+    Sends the mission orders of the selected missions to their agents.
+
+    Every selected mission is attempted, even if sending another one failed. With `max_workers` greater than 1,
+    the emails are sent concurrently through a bounded pool that honours Graph throttling (see `outbound.send_emails`).
+
+    Parameters:
+    - missions (dict): The cleaned missions.
+    - keys (list): The keys of the missions selected in the GUI. All missions are sent if empty or None.
+    - sender_name (str): The name of the planner sending the mission orders.
+    - progress_callback (function, optional): A callback function receiving the progress, from 0 to 100.
+    - max_workers (int, optional): The number of emails sent concurrently. Defaults to 1 (one after another).
+    - delivered (dict, optional): The sent mission orders index (see `sent_index.load`). If provided, the mission
+      orders already delivered to the same recipients are skipped, without any Graph call.
+    - batch (bool, optional): Whether to group the emails in Graph $batch calls (see `outbound.send_emails`).
+    - group_by_agent (bool, optional): Whether to send a single email per set of recipients and day (see `group_om_messages`).
+    - optimize_attachments (bool, optional): Whether to send lighter variants of the attachments (see `build_om_messages`).
+    - transport (optional): The transport to send the emails with, Graph or SMTP. Defaults to the one selected by the
+      OUTBOUND_TRANSPORT setting (see `outbound.get_transport`).
+
+    Returns:
+    - dict: A dictionary mapping each mission key sent to None if its mission order was sent, or to an error message otherwise.
+    """
+    # print("Sending mission orders...")
+
+    messages = build_om_messages(missions, keys, sender_name, delivered, group_by_agent, optimize_attachments)
+
+    transport = transport or outbound.get_transport()
+    results = transport.send_emails(messages, max_workers, progress_callback, batch=batch)
 
     # print("Mission orders sent!")
+    return results
 
 def clean_data(missions):
     missions_cleaned = []
@@ -610,8 +1526,8 @@ def clean_data(missions):
                                     mission.get('remark'), 
                                     # mission.get('fields').get('TASKCOMMENTS'), 
                                     mission.get('customers')[0].get('fields').get('COMMENTSCUSTOMER') if mission.get('customers') else None]
-        # Remove empty or None values
-        mission_dict['comments'] = [comment for comment in mission_dict['comments'] if comment is not None and comment!= '']
+        # Remove empty or None values, including the comments holding only whitespace and line breaks
+        mission_dict['comments'] = [comment for comment in mission_dict['comments'] if utils.format_text(comment)]
         
         # Populate customers if available
         for customer in mission.get('customers', []):
@@ -678,5 +1594,74 @@ def filter_rt_missions(missions):
             rt_missions.append(mission)
     return rt_missions
 
-def generate_ADR_transport_list(missions, sources):
-    pass
\ No newline at end of file
+def adr_register_path(month:datetime, extension:str) -> str:
+    """
+    Returns the path of the monthly ADR transport register: './generated/ADR/<year><month> ADR register.<extension>'.
+    """
+    return f"./generated/ADR/{month.strftime('%Y%m')} ADR register.{extension}"
+
+def adr_register_rows(missions:list, sources:dict):
+    """
+    Yields the rows of the ADR transport register, one per source transported by a mission, in order of departure.
+
+    The activities of all the sources over the days of the missions are computed at once (see `activity.activity_table`),
+    and only looked up for each row.
+
+    Parameters:
+    - missions (list): The RT missions (see `filter_rt_missions`), with their locations.
+    - sources (dict): The sources registry.
+
+    Yields:
+    - list: The cells of a row, as strings, in the order of `ADR_REGISTER_COLUMNS`.
+    """
+    if not missions:
+        return
+    missions = sorted(missions, key=lambda mission: mission['start'])
+    first_day = model.start_of(missions[0]).date()
+    last_day = model.start_of(missions[-1]).date()
+    activities = activity.activity_table(sources, first_day, last_day)
+
+    for mission in missions:
+        mission_start = model.start_of(mission)
+        agents = ", ".join(f"{agent.get('firstName')} {agent.get('lastName')}" for agent in mission.get('resources') or [])
+        clients = ", ".join(customer.get('label') or '' for customer in mission.get('customers') or [])
+        location = mission.get('location')
+        location = "\n".join(line.strip() for line in location.splitlines() if line.strip()) if location and location != 'None' else ''
+        for source in mission.get('sources'):
+            record = sources[source]
+            GBq, Ci = activities.activity(source, mission_start.date())
+            yield [mission_start.strftime('%d/%m/%Y'), mission.get('key'), agents, mission.get('vehicle') or '',
+                   mission.get('departurePlace') or '', clients, location, source, record.get('UNnumber'),
+                   record.get('Isotope'), f"{GBq}", f"{Ci}", record.get('Package'), record.get('Label'),
+                   f"{record.get('Transportindex')}"]
+
+def generate_ADR_transport_list(missions:list, sources:dict, month:datetime) -> tuple:
+    """
+    Generates the monthly ADR transport register, as a PDF document and a CSV file (see `adr_register_path`).
+
+    The rows are streamed from the RT missions (see `adr_register_rows`) in chunks of `ADR_REGISTER_CHUNK_ROWS`, each
+    chunk being written to the CSV file and drawn on the canvas of the PDF document before the next one is produced,
+    so that the memory used does not grow with the number of transports of the month.
+
+    Parameters:
+    - missions (list): The RT missions of the month (see `filter_rt_missions`), with their locations.
+    - sources (dict): The sources registry.
+    - month (datetime): A day of the month of the register.
+
+    Returns:
+    - tuple: The paths of the PDF document and of the CSV file.
+    """
+    pdf_file, csv_file = adr_register_path(month, 'pdf'), adr_register_path(month, 'csv')
+    os.makedirs(os.path.dirname(pdf_file), exist_ok=True)
+
+    register = fastpdf.RegisterDocument(pdf_file, f"ADR transport register - {month.strftime('%m/%Y')}", ADR_REGISTER_COLUMNS)
+    # The semicolon separator and the BOM let Excel open the file with its Belgian regional settings
+    with open(csv_file, 'w', newline='', encoding='utf-8-sig') as file:
+        writer = csv.writer(file, delimiter=';')
+        writer.writerow([header for header, _ in ADR_REGISTER_COLUMNS])
+        rows = adr_register_rows(missions, sources)
+        while chunk := list(islice(rows, ADR_REGISTER_CHUNK_ROWS)):
+            writer.writerows(chunk)
+            register.add_rows(chunk)
+    register.save()
+    return pdf_file, csv_file
\ No newline at end of file
@@ -0,0 +1,145 @@
+from contextlib import closing
+from datetime import datetime
+from dotenv import load_dotenv
+from modules import auth, ingest, utils
+import json
+import os
+import re
+import sqlite3
+
+# Constants
+SUBJECT_PATTERN = re.compile(r'Mission orders? ((?:n°[^,\s]+(?:, )?)+) - (\d{2}/\d{2}/\d{4})')  # Subject of the mission order emails
+KEY_PATTERN = re.compile(r'n°([^,\s]+)')
+
+def get_index_path():
+    """
+    Returns the path to the SQLite database holding the sent mission orders index, in the application's data directory.
+    """
+    return os.path.join(utils.get_data_dir(), 'sent_items.sqlite3')
+
+def _connect():
+    """
+    Opens a connection to the sent mission orders index, creating its tables if needed.
+    """
+    connection = sqlite3.connect(get_index_path())
+    connection.row_factory = sqlite3.Row
+    connection.execute("""
+        CREATE TABLE IF NOT EXISTS sent_items (
+            id TEXT NOT NULL,
+            mission_key TEXT NOT NULL,
+            intervention_date TEXT NOT NULL,
+            recipients TEXT NOT NULL,
+            sent_time TEXT,
+            PRIMARY KEY (id, mission_key)
+        )
+    """)
+    connection.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+    return connection
+
+def parse_subject(subject:str):
+    """
+    Extracts the mission keys and the intervention date from the subject of a mission order email, either for a single
+    mission ("Mission order n°1 - dd/mm/yyyy") or for several ones ("Mission orders n°1, n°2 - dd/mm/yyyy").
+
+    Parameters:
+    - subject (str): The subject of the email.
+
+    Returns:
+    - tuple: The list of mission keys and the intervention date (dd/mm/yyyy), or None if the email is not a mission order.
+    """
+    match = SUBJECT_PATTERN.match(subject)
+    if not match:
+        return None
+    return KEY_PATTERN.findall(match.group(1)), match.group(2)
+
+def _normalize_recipients(recipients:list) -> list:
+    return sorted({recipient.strip().lower() for recipient in recipients if recipient})
+
+def _insert(connection, element_id:str, subject:str, recipients:list, sent_time:str):
+    """
+    Adds an email to the index, one row per mission key, if it is a mission order.
+    """
+    parsed = parse_subject(subject)
+    if not parsed:
+        return
+    keys, intervention_date = parsed
+    recipients = json.dumps(_normalize_recipients(recipients))
+    connection.executemany(
+        "INSERT OR REPLACE INTO sent_items (id, mission_key, intervention_date, recipients, sent_time) VALUES (?, ?, ?, ?, ?)",
+        [(element_id, key, intervention_date, recipients, sent_time) for key in keys])
+
+def sync(access_token:str=None, interactive:bool=True):
+    """
+    Brings the index up to date with the Sent Items folder of the user, using a Microsoft Graph delta query.
+
+    Only the changes since the previous synchronization are downloaded: the delta link returned by Graph is stored in
+    the index. The first synchronization retrieves the last 30 days of sent emails.
+
+    Parameters:
+    - access_token (str, optional): The Microsoft Graph access token. Defaults to the one stored in the environment.
+    - interactive (bool, optional): Whether the interactive Microsoft login may be started if the access token cannot
+      be refreshed (see `auth.refresh_access_token`). Defaults to True.
+    """
+    if not access_token:
+        load_dotenv(utils.get_env_path(), override=True)
+        access_token = os.environ.get('MS_ACCESS_TOKEN')
+
+    with closing(_connect()) as connection:
+        row = connection.execute("SELECT value FROM meta WHERE name = 'delta_link'").fetchone()
+        delta_link = row['value'] if row else None
+
+        try:
+            elements, removed, delta_link = ingest.get_sent_elements_delta(access_token, delta_link)
+        except ValueError:
+            access_token = auth.refresh_access_token(interactive)
+            elements, removed, delta_link = ingest.get_sent_elements_delta(access_token, delta_link)
+
+        connection.executemany("DELETE FROM sent_items WHERE id = ?", [(element_id,) for element_id in removed])
+        for element in elements:
+            _insert(connection, element['id'], element['subject'], element['recipients'], element['sent_time'])
+        connection.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('delta_link', ?)", (delta_link,))
+        connection.commit()
+
+def record(message:dict, element_id:str=None):
+    """
+    Adds an email that was just sent to the index, without waiting for the next synchronization.
+
+    Parameters:
+    - message (dict): The email, as built by `process.build_om_message`.
+    - element_id (str, optional): The id to record the email under. Defaults to one derived from the subject.
+    """
+    with closing(_connect()) as connection:
+        _insert(connection, element_id or f"local:{message['subject']}", message['subject'], message['recipients'],
+                datetime.now().isoformat())
+        connection.commit()
+
+def load() -> dict:
+    """
+    Loads the index in memory, for constant time lookups with `is_delivered`.
+
+    Returns:
+    - dict: A dictionary mapping each (mission key, intervention date) pair to the list of recipient sets it was sent to.
+    """
+    index = {}
+    with closing(_connect()) as connection:
+        for row in connection.execute("SELECT mission_key, intervention_date, recipients FROM sent_items"):
+            index.setdefault((row['mission_key'], row['intervention_date']), []).append(frozenset(json.loads(row['recipients'])))
+    return index
+
+def is_delivered(index:dict, message:dict) -> bool:
+    """
+    Checks whether a mission order email was already delivered to all of its recipients.
+
+    Parameters:
+    - index (dict): The index, as returned by `load`.
+    - message (dict): The email, as built by `process.build_om_message`.
+
+    Returns:
+    - bool: True if, for every mission of the email, an email was already sent to the same recipients (or more).
+    """
+    parsed = parse_subject(message['subject'])
+    if not parsed:
+        return False
+    keys, intervention_date = parsed
+    recipients = set(_normalize_recipients(message['recipients']))
+    return all(any(recipients <= sent_to for sent_to in index.get((key, intervention_date), [])) for key in keys)
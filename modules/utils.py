@@ -1,14 +1,42 @@
 from datetime import datetime, timedelta
 from dotenv import load_dotenv, set_key
+from functools import lru_cache
 from modules import auth, ingest
 from pathlib import Path
 from reportlab.platypus import Paragraph
+import hashlib
 import json
 import keyring
 import os
 import re
 import regex
+import requests
 import sys
+import threading
+
+# Constants
+FORMAT_TEXT_CACHE_SIZE = 4096  # Number of formatted texts kept in memory (see `format_text`)
+PARAGRAPH_HEIGHT_CACHE_SIZE = 4096  # Number of paragraph heights kept in memory (see `calculate_paragraph_height`)
+LINE_BREAKS_PATTERN = re.compile(r'(?:\n|<br/>)+')  # Runs of line endings and HTML line breaks
+
+# Shared HTTP session so that connections to PPME and Graph are kept alive and reused across calls
+_session = requests.Session()
+
+# Serializes the updates of the .env file, e.g. by the start-up warm-up and the first Fetch (see `update_env_var`)
+_env_lock = threading.Lock()
+
+def get_session():
+    """
+    Returns the HTTP session shared by all modules talking to the PlanningPME and Microsoft Graph APIs.
+
+    Using a single `requests.Session` keeps the underlying TCP/TLS connections open in its connection pool, so
+    that only the first request to a host pays for the handshake. Opening these connections early (see
+    `main.warm_up`) therefore makes the first Fetch faster.
+
+    Returns:
+    - requests.Session: The shared HTTP session.
+    """
+    return _session
 
 def update_env_var(value: str, key: str):
     """
@@ -27,11 +55,12 @@ def update_env_var(value: str, key: str):
     """
     env_file_path = get_env_path()
 
-    # Load the current contents of the .env file
-    load_dotenv(env_file_path)
+    with _env_lock:  # The .env file is rewritten as a whole: one update at a time
+        # Load the current contents of the .env file
+        load_dotenv(env_file_path)
 
-    # Update the environment variable in the .env file
-    set_key(env_file_path, key, value)
+        # Update the environment variable in the .env file
+        set_key(env_file_path, key, value)
 
 def iso_to_datetime(datestring:str):
     """
@@ -72,80 +101,149 @@ def timedelta_to_days_float(td:timedelta):
     days_float = td.days + (td.seconds/86400)
     return days_float
 
+def _normalize_line_breaks(match) -> str:
+    # Runs of three line breaks or more are collapsed into a single one, shorter runs are kept
+    run = match.group(0)
+    count = run.count('\n') + run.count('<br/>')
+    return '<br/>' if count >= 3 else '<br/>' * count
+
+@lru_cache(maxsize=FORMAT_TEXT_CACHE_SIZE)
+def _format_text(text:str) -> str:
+    """
+    Formats a text for `format_text`, in a single regex pass followed by the trimming of its ends.
+    """
+    formatted_text = LINE_BREAKS_PATTERN.sub(_normalize_line_breaks, text)
+
+    # Strip the whitespace and one HTML line break from both ends, three times in a row
+    start, end = 0, len(formatted_text)
+    for _ in range(3):
+        while start < end and formatted_text[start].isspace():
+            start += 1
+        while end > start and formatted_text[end - 1].isspace():
+            end -= 1
+        if formatted_text.startswith('<br/>', start, end):
+            start += 5
+        if end - start >= 5 and formatted_text.endswith('<br/>', start, end):
+            end -= 5
+    return formatted_text[start:end]
+
 def format_text(text):
     """
-    Formats the given text to be web-friendly by converting Unicode escape sequences to actual Unicode characters,
-    replacing Windows line endings with HTML line breaks, and removing redundant HTML line breaks and whitespace.
+    Formats the given text to be web-friendly by replacing line endings with HTML line breaks, and removing redundant
+    HTML line breaks and whitespace.
 
-    This function takes a string that may contain Unicode escape sequences and Windows line endings (\r\n),
-    and formats it for better web display. It converts Unicode escape sequences to their corresponding characters,
-    replaces Windows line endings with HTML line breaks (<br/>), removes redundant HTML line breaks, and trims
-    leading and trailing whitespace and newlines.
+    Line endings are replaced by HTML line breaks (<br/>), runs of three line breaks or more are collapsed into a single
+    one, and the leading and trailing whitespace and line breaks are trimmed. The texts are normalized in a single regex
+    pass, and memoized by raw text in an LRU cache shared by all the callers: the customer comments, for instance,
+    repeat for every mission of the same customer (see `format_text_stats`).
 
     Parameters:
-    - api_text (str): The text to be formatted, potentially containing Unicode escape sequences and Windows line endings.
+    - text (str): The text to be formatted, potentially containing line endings.
 
     Returns:
-    - str: The formatted text, with Unicode characters properly displayed, Windows line endings replaced by HTML line breaks,
-           redundant line breaks and whitespace removed, and no <br/> tags at the beginning or end.
+    - str: The formatted text, with line endings replaced by HTML line breaks, redundant line breaks and whitespace
+           removed, and no <br/> tags at the beginning or end. None if the text is empty or None.
     """
     if text:
-        # Convert Unicode sequences to actual Unicode characters
-        text = text.encode('utf8').decode('utf8')
-        
-        # Replace Windows line endings (\r\n) with HTML line breaks(<br/>)
-        formatted_text = text.replace('\r\n', '<br/>')
-        formatted_text = text.replace('\n', '<br/>')
+        return _format_text(text)
 
-        # Remove redundant HTML line breaks
-        formatted_text = re.sub(r'(<br/>){3,}', '<br/>', formatted_text)
-        
-        # Strip leading and trailing whitespace and newlines
-        formatted_text = formatted_text.strip()
-        
-        # Remove <br/> tags from the beginning and end of the text
-        formatted_text = re.sub(r'^<br/>|<br/>$', '', formatted_text)
-        
-        # Strip leading and trailing whitespace and newlines
-        formatted_text = formatted_text.strip()
+def plain_text(text):
+    """
+    Formats a text for display in the GUI: as with `format_text`, but with the HTML line breaks turned back into
+    line endings. Empty texts are returned as is.
+    """
+    return format_text(text).replace('<br/>', '\n') if text else text
 
-        # Remove <br/> tags from the beginning and end of the text
-        formatted_text = re.sub(r'^<br/>|<br/>$', '', formatted_text)
-        
-        # Strip leading and trailing whitespace and newlines
-        formatted_text = formatted_text.strip()
+def format_text_stats() -> dict:
+    """
+    Returns the statistics of the memo of `format_text`: its number of hits and misses, hit rate and current size.
+    """
+    info = _format_text.cache_info()
+    calls = info.hits + info.misses
+    return {
+        "hits": info.hits,
+        "misses": info.misses,
+        "hit_rate": info.hits / calls if calls else 0.0,
+        "size": info.currsize
+    }
 
-        # Remove <br/> tags from the beginning and end of the text
-        formatted_text = re.sub(r'^<br/>|<br/>$', '', formatted_text)
-                
-        return formatted_text
+@lru_cache(maxsize=PARAGRAPH_HEIGHT_CACHE_SIZE)
+def _paragraph_height(text, width, style, style_key) -> float:
+    """
+    Measures a paragraph for `calculate_paragraph_height`. `style_key` holds the attributes of the style the height
+    depends on, so that a style changed in place is measured again.
+    """
+    # Create a Paragraph object
+    para = Paragraph(text, style)
+
+    # Use wrap method to determine the space required by the text
+    # wrap returns a tuple (actual_used_width, height_needed)
+    _, height = para.wrap(width, 10000)  # Large height to avoid premature wrapping
+    return height
 
 def calculate_paragraph_height(text, width, style):
     """
     Calculate the height of a Paragraph given text, width, and style.
+
+    The heights are memoized per (text, width, style) in an LRU cache, so that measuring the same text again costs
+    nothing while the memory used stays bounded for the lifetime of the application.
     
     :param text: The text content of the paragraph.
     :param width: The width constraint of the paragraph.
     :param style: The style to apply to the paragraph, which includes font size and leading.
     :return: Height of the paragraph in points.
     """
-    # Create a Paragraph object
-    para = Paragraph(text, style)
-    
-    # Use wrap method to determine the space required by the text
-    # wrap returns a tuple (actual_used_width, height_needed)
-    _, height = para.wrap(width, 10000)  # Large height to avoid premature wrapping
-    
-    return height
+    return _paragraph_height(text, width, style, (style.name, style.fontName, style.fontSize, style.leading))
+
+def _pack(units:list, max_height, width, style, words:bool=False) -> list:
+    """
+    Packs consecutive text units (sentences or words) into as few parts as possible, each part fitting within the
+    maximum height.
+
+    The end of each part is found by binary search, since the height of a part only grows with the units it holds:
+    a part of n units costs O(log n) measurements instead of one per unit. A sentence too tall to fit on its own is
+    split between words (`words` is then True).
+
+    Returns:
+    - list: The parts, as strings.
+    """
+    def fits(start, end):
+        return calculate_paragraph_height(" ".join(units[start:end]).strip(), width, style) <= max_height
+
+    parts = []
+    start = 0
+    while start < len(units):
+        if fits(start, len(units)):
+            end = len(units)
+        else:
+            # The largest end such that units[start:end] fits, with at least one unit per part
+            low, high = start + 1, len(units) - 1
+            while low < high:
+                middle = (low + high + 1) // 2
+                if fits(start, middle):
+                    low = middle
+                else:
+                    high = middle - 1
+            end = low
+
+        if end == start + 1 and not words and not fits(start, end):
+            # A single sentence taller than the maximum height, split it between words
+            parts.extend(_pack(units[start].split(" "), max_height, width, style, words=True))
+        else:
+            parts.append(" ".join(units[start:end]).strip())
+        start = end
+
+    return parts
 
 def ajust_paragraph_height(text, max_height, width, style):
     """
     Adjusts the height of a paragraph by splitting the text into multiple parts if necessary.
 
-    This function iteratively splits the input text into multiple parts to ensure that the height of the rendered
-    paragraph does not exceed a specified maximum height. It does so by splitting the text into sentences and
-    gradually moving sentences from the first part to the second part until the height of the first part is within
-    the allowed limit. This process is designed to be extended for splitting into more than two parts if needed.
+    This function splits the input text into as many parts as needed to ensure that the height of the rendered
+    paragraph does not exceed a specified maximum height. The text is split into sentences, which are then packed
+    into parts, the cut points being found by binary search (see `_pack`). A sentence too tall on its own is split
+    between words. The heights are memoized (see `calculate_paragraph_height`), so the number of paragraph layouts
+    grows with the number of parts times the logarithm of the number of sentences, instead of quadratically.
 
     Parameters:
     - text (str): The text content to be split into paragraphs.
@@ -162,27 +260,8 @@ def ajust_paragraph_height(text, max_height, width, style):
         text = [text]
         return text
 
-    # Split the text into sentences
-    part1 = split_into_sentences(text)  # Start with all sentences in part1
-    part2 = ""
-
-    # Set while condition to true at first iteration
-    part1_height = max_height + 1
-
-    # Iterate from the end, moving sentences from part1 to part2
-    while part1_height > max_height:
-        part2 = part1.pop() + " " + part2 # Move the last sentence to part2
-        part1_height = calculate_paragraph_height(" ".join(part1).strip(), width, style) # Re-evaluate the height of part1
-    
-    # Ensure no leading or trailing spaces
-    part1 = " ".join(part1).strip()
-
-    # Combine the two parts
-    result = []
-    result.append(part1)
-    result.append(part2)
-
-    return result
+    # Split the text into sentences, and pack them into parts
+    return _pack(split_into_sentences(text), max_height, width, style)
 
 def save_to_txt(missions):
     """
@@ -235,6 +314,22 @@ def split_into_sentences(text):
 
     return sentences
 
+def file_hash(path:str) -> str:
+    """
+    Computes the SHA-256 hash of a file's content, reading it in chunks.
+
+    Parameters:
+    - path (str): The path to the file.
+
+    Returns:
+    - str: The hexadecimal hash.
+    """
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
 def remove_leading_dots(input_string):
     if input_string.startswith(".."):
         return input_string[2:]
@@ -286,11 +381,38 @@ def get_env_path():
                     env_file.write('MS_REFRESH_TOKEN=\'\'\n')
                     env_file.write('SHP_SITE_URL=\'https://vincottegroup.sharepoint.com/sites/NDT-MM\'\n')
                     env_file.write('MS_USER_NAME=\'\'\n')
+                    env_file.write('SEND_MAX_WORKERS=\'4\'\n')
+                    env_file.write('SEND_BATCH=\'false\'\n')
+                    env_file.write('SEND_GROUP_BY_AGENT=\'false\'\n')
+                    env_file.write('SEND_OPTIMIZE_ATTACHMENTS=\'false\'\n')
+                    env_file.write('ATTACHMENT_LINK_THRESHOLD_MB=\'\'\n')
+                    env_file.write('OUTBOUND_TRANSPORT=\'graph\'\n')
+                    env_file.write('SMTP_HOST=\'smtp.office365.com\'\n')
+                    env_file.write('SMTP_PORT=\'587\'\n')
+                    env_file.write('SMTP_USERNAME=\'\'\n')
+                    env_file.write('SMTP_STARTTLS=\'true\'\n')
+                    env_file.write('GENERATE_MAX_WORKERS=\'1\'\n')
+                    env_file.write('PDF_IN_MEMORY=\'false\'\n')
+                    env_file.write('PDF_RENDERER=\'platypus\'\n')
+                    env_file.write('PDF_BUNDLE=\'false\'\n')
+                    env_file.write('PDF_PROFILE=\'standard\'\n')
             return env_path
         else:
             # If running in a normal Python environment, use the current working directory
             return os.path.join(os.getcwd(), '.env')
         
+def get_data_dir():
+    """
+    Returns the directory where the application keeps its persistent data, such as the outbox.
+
+    This is the directory holding the .env file: the user's APPDATA folder when running as a PyInstaller bundle, the
+    current working directory otherwise. Unlike './temp' and './generated', it is not cleaned up by the GUI.
+
+    Returns:
+    - str: The absolute path to the data directory.
+    """
+    return os.path.dirname(os.path.abspath(get_env_path()))
+
 def init_ppme_api_variables():
     """
     Load environment variables and initialize variables for PlanningPME API connection.
@@ -1,9 +1,11 @@
 # run.py
+import multiprocessing
 import sys
 from PyQt6 import QtWidgets
 from app.main_window import MainWindow
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # Required by the PDF generation worker processes in the PyInstaller bundle
     app = QtWidgets.QApplication(sys.argv)
     mainWin = MainWindow()
     mainWin.show()
@@ -0,0 +1,26 @@
+from datetime import date
+import unittest
+from modules import activity
+
+class ActivityTableTest(unittest.TestCase):
+    def setUp(self):
+        self.sources = {"IR-1": {"Isotope": "Ir-192", "GBq": 1000, "Calibrationdate": "2024-07-01T00:00:00"}}
+        self.table = activity.ActivityTable(self.sources, date(2024, 7, 1), date(2024, 7, 31))
+
+    def test_activity_on_the_days_of_the_table(self):
+        self.assertEqual(self.table.activity("IR-1", date(2024, 7, 1)), (1000.0, 27.03))
+        self.assertEqual(self.table.activity("IR-1", date(2024, 7, 31))[0], round(1000 * 0.5 ** (30 / 73.83), 2))
+
+    def test_days_outside_the_table_are_rejected(self):
+        for day in (date(2024, 6, 30), date(2024, 8, 1)):
+            with self.assertRaises(ValueError) as raised:
+                self.table.activity("IR-1", day)
+            self.assertIn(str(day), str(raised.exception))
+
+    def test_source_activity_extends_the_cached_table(self):
+        self.assertEqual(activity.source_activity(self.sources, "IR-1", date(2024, 7, 1)), (1000.0, 27.03))
+        self.assertEqual(activity.source_activity(self.sources, "IR-1", date(2025, 7, 1))[0],
+                         round(1000 * 0.5 ** (365 / 73.83), 2))
+
+if __name__ == '__main__':
+    unittest.main()
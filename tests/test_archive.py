@@ -0,0 +1,62 @@
+from datetime import date, timedelta
+from unittest import mock
+import os
+import tempfile
+import unittest
+from modules import archive
+
+@unittest.skipUnless(archive.is_available(), "pyarrow is not installed")
+class ArchiveMissionsTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        patcher = mock.patch.object(archive, 'get_archive_dir', return_value=directory.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def mission(self, key:str, day:str) -> dict:
+        return {"key": key, "start": f"{day} 08:00:00", "end": f"{day} 17:00:00", "resources": [], "customers": []}
+
+    def archived(self) -> list:
+        table = archive.load(columns=['key'])
+        return sorted(zip(table['day'].to_pylist(), table['key'].to_pylist()))
+
+    def test_mission_moved_to_another_day_is_archived_once(self):
+        archive.archive_missions([self.mission("1", "2024-07-01"), self.mission("2", "2024-07-01")], date(2024, 7, 1), [2])
+        archive.archive_missions([self.mission("1", "2024-07-02")], date(2024, 7, 2), [2])
+
+        self.assertEqual(self.archived(), [("2024-07-01", "2"), ("2024-07-02", "1")])
+
+    def test_cancelled_missions_of_the_refetched_departments_are_removed(self):
+        archive.archive_missions([self.mission("1", "2024-07-01"), self.mission("2", "2024-07-01")], date(2024, 7, 1), [2, 3])
+        archive.archive_missions([self.mission("3", "2024-07-01")], date(2024, 7, 1), [5])
+        archive.archive_missions([self.mission("1", "2024-07-01")], date(2024, 7, 1), [2, 3])
+
+        self.assertEqual(self.archived(), [("2024-07-01", "1"), ("2024-07-01", "3")])
+
+    def test_refetching_an_empty_day_empties_its_partition(self):
+        archive.archive_missions([self.mission("1", "2024-07-01")], date(2024, 7, 1), [2])
+        archive.archive_missions([], date(2024, 7, 1), [2])
+
+        self.assertEqual(self.archived(), [])
+
+    def test_failed_write_keeps_the_previous_partition(self):
+        archive.archive_missions([self.mission("1", "2024-07-01")], date(2024, 7, 1), [2])
+
+        with mock.patch.object(archive.pq, 'write_table', side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                archive.archive_missions([self.mission("2", "2024-07-01")], date(2024, 7, 1), [3])
+
+        self.assertEqual(self.archived(), [("2024-07-01", "1")])
+        self.assertEqual(os.listdir(os.path.dirname(archive._day_path("2024-07-01"))), [archive.ARCHIVE_FILE_NAME])
+
+    def test_only_the_partitions_around_the_archived_days_are_searched(self):
+        archive.archive_missions([self.mission("1", "2024-07-01"), self.mission("2", "2024-07-01")], date(2024, 7, 1), [2])
+        far = date(2024, 7, 1) + timedelta(days=archive.MOVED_MISSION_WINDOW_DAYS + 1)
+        archive.archive_missions([self.mission("1", "2024-07-10")])
+        archive.archive_missions([self.mission("2", far.isoformat())])
+
+        self.assertEqual(self.archived(), [("2024-07-01", "2"), ("2024-07-10", "1"), (far.isoformat(), "2")])
+
+if __name__ == '__main__':
+    unittest.main()
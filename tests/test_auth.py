@@ -0,0 +1,51 @@
+from unittest import mock
+import os
+import tempfile
+import threading
+import time
+import unittest
+from modules import auth, utils
+
+class RefreshAccessTokenTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.env_path = os.path.join(directory.name, '.env')
+        with open(self.env_path, 'w') as file:
+            file.write("MS_CLIENT_ID=client\nMS_TENANT_ID=tenant\nMS_REFRESH_TOKEN=refresh-0\n")
+        for patcher in (mock.patch.object(utils, 'get_env_path', return_value=self.env_path),
+                        mock.patch.object(auth, 'load_dotenv', lambda override=False: utils.load_dotenv(self.env_path, override=True)),
+                        mock.patch.object(auth.keyring, 'get_password', return_value="secret"),
+                        mock.patch.dict(os.environ)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.used_refresh_tokens = []
+        self.running = 0
+        self.overlapped = False
+
+    def post(self, url, headers=None, data=None):
+        self.running += 1
+        self.overlapped |= self.running > 1
+        time.sleep(0.05)  # Leaves the other thread the time to start its own refresh
+        self.used_refresh_tokens.append(data['refresh_token'])
+        number = len(self.used_refresh_tokens)
+        self.running -= 1
+        response = mock.Mock()
+        response.json.return_value = {'access_token': f"access-{number}", 'refresh_token': f"refresh-{number}"}
+        return response
+
+    def test_concurrent_refreshes_use_the_rotated_refresh_token(self):
+        with mock.patch.object(utils.get_session(), 'post', side_effect=self.post):
+            threads = [threading.Thread(target=auth.refresh_access_token, kwargs={'interactive': False}) for _ in range(2)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertFalse(self.overlapped)
+        self.assertEqual(self.used_refresh_tokens, ["refresh-0", "refresh-1"])
+        with open(self.env_path, 'r') as file:
+            self.assertIn("MS_REFRESH_TOKEN='refresh-2'", file.read())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+from datetime import datetime, timedelta
+import random
+import unittest
+from modules import conflicts
+
+def mission(key:str, start:str, end:str, vehicle:str=None, sources:list=None, agents:list=None) -> dict:
+    return {"key": key, "start": start, "end": end, "vehicle": vehicle, "sources": sources or [], "equipment": [],
+            "resources": [{"firstName": first_name, "lastName": last_name} for first_name, last_name in agents or []]}
+
+def brute_force_conflicts(missions:list) -> dict:
+    """
+    Compares every pair of missions, as the reference of the conflict checks.
+    """
+    found = {}
+    for index, first in enumerate(missions):
+        for second in missions[index + 1:]:
+            (first_start, first_end), (second_start, second_end) = conflicts.mission_period(first), conflicts.mission_period(second)
+            if first_start < second_end and second_start < first_end:
+                for resource in set(conflicts.mission_resources(first)) & set(conflicts.mission_resources(second)):
+                    found.setdefault(conflicts.resource_label(resource), set()).update((first['key'], second['key']))
+    return {label: sorted(keys) for label, keys in found.items()} or None
+
+class FindConflictsTest(unittest.TestCase):
+    def test_multi_day_mission_overlaps_the_missions_of_its_days(self):
+        missions = [mission("1", "2024-07-01 08:00:00", "2024-07-03 17:00:00", vehicle="1-ABC"),
+                    mission("2", "2024-07-02 08:00:00", "2024-07-02 12:00:00", vehicle="1-ABC"),
+                    mission("3", "2024-07-03 17:00:00", "2024-07-04 12:00:00", vehicle="1-ABC"),
+                    mission("4", "2024-07-02 09:00:00", "2024-07-02 10:00:00", vehicle="2-DEF")]
+
+        self.assertEqual(conflicts.find_conflicts(missions), {"Vehicle 1-ABC": ["1", "2"]})
+
+    def test_every_kind_of_resource_is_checked(self):
+        missions = [mission("1", "2024-07-01 08:00:00", "2024-07-01 17:00:00", sources=["IR-1"], agents=[("Jean", "Dupont")]),
+                    mission("2", "2024-07-01 16:00:00", "2024-07-01 18:00:00", sources=["IR-1"], agents=[("Jean", "Dupont")])]
+
+        self.assertEqual(conflicts.find_conflicts(missions), {"Source IR-1": ["1", "2"], "Agent Jean Dupont": ["1", "2"]})
+
+    def test_no_conflict(self):
+        missions = [mission("1", "2024-07-01 08:00:00", "2024-07-01 12:00:00", vehicle="1-ABC"),
+                    mission("2", "2024-07-01 12:00:00", "2024-07-01 17:00:00", vehicle="1-ABC")]
+
+        self.assertIsNone(conflicts.find_conflicts(missions))
+
+    def test_random_missions_match_the_brute_force_check(self):
+        generator = random.Random(47)
+        start = datetime(2024, 7, 1)
+        for _ in range(20):
+            missions = []
+            for key in range(60):
+                mission_start = start + timedelta(hours=generator.randrange(24 * 30))
+                mission_end = mission_start + timedelta(hours=generator.choice([1, 4, 8, 30, 80]))
+                missions.append(mission(str(key), f"{mission_start:%Y-%m-%d %H:%M:%S}", f"{mission_end:%Y-%m-%d %H:%M:%S}",
+                                        vehicle=generator.choice(["1-ABC", "2-DEF", None]),
+                                        sources=generator.sample(["IR-1", "IR-2", "SE-1"], generator.randrange(2))))
+
+            self.assertEqual(conflicts.find_conflicts(missions), brute_force_conflicts(missions))
+
+class ConflictIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.index = conflicts.ConflictIndex()
+
+    def test_add_reports_the_conflicts_of_a_multi_day_mission(self):
+        self.assertEqual(self.index.add(mission("1", "2024-07-02 08:00:00", "2024-07-02 12:00:00", vehicle="1-ABC")), {})
+        self.assertEqual(self.index.add(mission("2", "2024-07-05 08:00:00", "2024-07-05 12:00:00", vehicle="1-ABC")), {})
+
+        added = self.index.add(mission("3", "2024-07-01 08:00:00", "2024-07-04 17:00:00", vehicle="1-ABC"))
+
+        self.assertEqual(added, {"Vehicle 1-ABC": ["1"]})
+        self.assertEqual(self.index.conflicts(), {"Vehicle 1-ABC": ["1", "3"]})
+
+    def test_a_long_booking_is_found_from_a_later_start(self):
+        self.index.add(mission("1", "2024-07-01 08:00:00", "2024-07-10 17:00:00", vehicle="1-ABC"))
+        self.index.add(mission("2", "2024-07-02 08:00:00", "2024-07-02 09:00:00", vehicle="1-ABC"))
+
+        self.assertEqual(self.index.add(mission("3", "2024-07-09 08:00:00", "2024-07-09 09:00:00", vehicle="1-ABC")),
+                         {"Vehicle 1-ABC": ["1"]})
+
+    def test_remove_drops_the_conflicts_of_the_mission(self):
+        self.index.add(mission("1", "2024-07-01 08:00:00", "2024-07-01 17:00:00", vehicle="1-ABC"))
+        self.index.add(mission("2", "2024-07-01 10:00:00", "2024-07-01 12:00:00", vehicle="1-ABC"))
+
+        self.index.remove("2")
+        self.index.remove("unknown")
+
+        self.assertIsNone(self.index.conflicts())
+        self.assertEqual(self.index.add(mission("3", "2024-07-01 16:00:00", "2024-07-01 18:00:00", vehicle="1-ABC")),
+                         {"Vehicle 1-ABC": ["1"]})
+
+    def test_adding_a_mission_again_replaces_its_bookings(self):
+        self.index.add(mission("1", "2024-07-01 08:00:00", "2024-07-01 17:00:00", vehicle="1-ABC"))
+        self.index.add(mission("2", "2024-07-01 10:00:00", "2024-07-01 12:00:00", vehicle="1-ABC"))
+
+        self.assertEqual(self.index.add(mission("2", "2024-07-02 10:00:00", "2024-07-02 12:00:00", vehicle="1-ABC")), {})
+        self.assertIsNone(self.index.conflicts())
+
+    def test_streamed_missions_match_the_batch_check(self):
+        generator = random.Random(1047)
+        start = datetime(2024, 7, 1)
+        missions = {}
+        for _ in range(300):
+            key = str(generator.randrange(80))
+            if generator.random() < 0.1:
+                self.index.remove(key)
+                missions.pop(key, None)
+                continue
+            mission_start = start + timedelta(hours=generator.randrange(24 * 30))
+            mission_end = mission_start + timedelta(hours=generator.choice([1, 4, 8, 30, 80]))
+            missions[key] = mission(key, f"{mission_start:%Y-%m-%d %H:%M:%S}", f"{mission_end:%Y-%m-%d %H:%M:%S}",
+                                    vehicle=generator.choice(["1-ABC", "2-DEF"]),
+                                    agents=generator.sample([("Jean", "Dupont"), ("Marie", "Martin")], generator.randrange(2)))
+            self.index.add(missions[key])
+
+            self.assertEqual(self.index.conflicts(), conflicts.find_conflicts(list(missions.values())))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,159 @@
+import email
+import email.policy
+import os
+import socketserver
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from modules import outbound
+
+class StubSmtpHandler(socketserver.StreamRequestHandler):
+    """
+    A minimal SMTP server: it accepts every recipient but the ones starting with 'refused', and records the emails.
+    """
+    def reply(self, line:str):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        server = self.server
+        server.sessions += 1
+        self.reply("220 stub ESMTP")
+        recipients = []
+        while line := self.rfile.readline():
+            command = line.decode().strip()
+            verb = command.split(' ', 1)[0].split(':', 1)[0].upper()
+            if verb == 'EHLO':
+                self.reply("250-stub" + ("\r\n250-PIPELINING" if server.pipelining else "") + "\r\n250 8BITMIME")
+            elif verb == 'MAIL':
+                recipients = []
+                self.reply("250 OK")
+            elif verb == 'RCPT':
+                recipient = command.partition('<')[2].rstrip('>')
+                if recipient.startswith('refused'):
+                    self.reply("550 No such user")
+                else:
+                    recipients.append(recipient)
+                    self.reply("250 OK")
+            elif verb == 'DATA':
+                if not recipients:
+                    self.reply("554 No valid recipients")
+                    continue
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                data = b''
+                while (line := self.rfile.readline()) != b'.\r\n':
+                    data += line
+                server.emails.append((recipients, data))
+                self.reply("250 Queued")
+            elif verb in ('RSET', 'NOOP'):
+                self.reply("250 OK")
+            elif verb == 'QUIT':
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+class SmtpTransportTest(unittest.TestCase):
+    pipelining = True
+
+    def setUp(self):
+        self.server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), StubSmtpHandler)
+        self.server.daemon_threads = True
+        self.server.pipelining = self.pipelining
+        self.server.emails = []
+        self.server.sessions = 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.transport = outbound.SmtpTransport('127.0.0.1', self.server.server_address[1], starttls=False)
+
+    def tearDown(self):
+        self.transport.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def message(self, recipients:list, subject:str="Mission order n°1 - 01/07/2024", documents:list=None, key:str="1") -> dict:
+        return {"keys": [key], "subject": subject, "recipients": recipients, "content": "Please find in attachment.\n",
+                "from_address": "planning@example.com", "documents": documents or []}
+
+    def test_long_non_ascii_subject_is_folded_with_crlf(self):
+        subject = "Mission orders " + ", ".join(f"n°{key}" for key in range(10001, 10013)) + " - 01/07/2024"
+        self.transport.send_email(self.message(["agent@example.com"], subject))
+
+        (recipients, data), = self.server.emails
+        self.assertEqual(recipients, ["agent@example.com"])
+        self.assertNotIn(b'\n', data.replace(b'\r\n', b''), "bare LF in the DATA stream")
+        self.assertEqual(email.message_from_bytes(data, policy=email.policy.default)['subject'], subject)
+
+    def test_attachments_are_streamed_intact(self):
+        content = b'.leading dot\r\n' + os.urandom(200 * 1024)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "plan.pdf")
+            with open(path, 'wb') as file:
+                file.write(content)
+            message = self.message(["agent@example.com"], documents=[{"name": "Dupont Jean - 1.pdf", "content": b'%PDF-1.4'}])
+            message['file_paths'] = [path]
+            self.transport.send_email(message)
+
+        (_, data), = self.server.emails
+        data = data.replace(b'\r\n..', b'\r\n.')  # Undo the dot-stuffing, as a real server does
+        attachments = {part.get_filename(): part.get_content()
+                       for part in email.message_from_bytes(data, policy=email.policy.default).iter_attachments()}
+        self.assertEqual(attachments, {"plan.pdf": content, "Dupont Jean - 1.pdf": b'%PDF-1.4'})
+
+    def test_refused_recipients_are_reported(self):
+        with self.assertRaises(outbound.SendError) as raised:
+            self.transport.send_email(self.message(["agent@example.com", "refused@example.com"]))
+
+        self.assertFalse(raised.exception.retryable)
+        self.assertIn("refused@example.com (550 No such user)", str(raised.exception))
+        (recipients, _), = self.server.emails
+        self.assertEqual(recipients, ["agent@example.com"])
+
+    def test_no_accepted_recipient_fails_without_sending(self):
+        with self.assertRaises(outbound.SendError) as raised:
+            self.transport.send_email(self.message(["refused@example.com"]))
+
+        self.assertFalse(raised.exception.retryable)
+        self.assertEqual(self.server.emails, [])
+
+    def test_session_is_reused_between_emails(self):
+        results = self.transport.send_emails([self.message(["agent@example.com"], key="1"),
+                                              self.message(["refused@example.com"], key="2"),
+                                              self.message(["other@example.com"], key="3")])
+
+        self.assertEqual([recipients for recipients, _ in self.server.emails], [["agent@example.com"], ["other@example.com"]])
+        self.assertIsNone(results["1"])
+        self.assertIn("refused@example.com", results["2"])
+        self.assertIsNone(results["3"])
+        self.assertEqual(self.server.sessions, 1)
+
+class SmtpTransportWithoutPipeliningTest(SmtpTransportTest):
+    pipelining = False
+
+class SendEmailBatchTest(unittest.TestCase):
+    def message(self, key:str) -> dict:
+        return {"keys": [key], "subject": f"Mission order n°{key}", "recipients": [f"agent{key}@example.com"],
+                "content": "Please find in attachment.\n", "documents": []}
+
+    def send(self, responses:list) -> list:
+        response = mock.Mock(status_code=200)
+        response.json.return_value = {"responses": responses}
+        with mock.patch.object(outbound, 'graph_request', return_value=response):
+            return outbound.send_email_batch([self.message("1"), self.message("2"), self.message("3")])
+
+    def test_emails_without_a_response_are_not_sent(self):
+        errors = self.send([{"id": "0", "status": 202}, {"id": "2", "status": 404, "body": {"error": {"message": "Not found"}}}])
+
+        self.assertIsNone(errors[0])
+        self.assertIsInstance(errors[1], outbound.SendError)
+        self.assertTrue(errors[1].retryable)
+        self.assertFalse(errors[2].retryable)
+
+    def test_only_success_statuses_mark_an_email_sent(self):
+        errors = self.send([{"id": "0", "status": 200}, {"id": "1", "status": 302}, {"id": "2", "status": 202}])
+
+        self.assertIsNone(errors[0])
+        self.assertIn("302", str(errors[1]))
+        self.assertIsNone(errors[2])
+
+if __name__ == '__main__':
+    unittest.main()
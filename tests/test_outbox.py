@@ -0,0 +1,51 @@
+from contextlib import closing
+from unittest import mock
+import json
+import os
+import tempfile
+import unittest
+from modules import outbox, utils
+
+class EnqueueTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        patcher = mock.patch.object(utils, 'get_data_dir', return_value=self.directory)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def message(self, key:str, file_paths:list) -> dict:
+        return {"keys": [key], "subject": f"Mission order n°{key}", "recipients": ["agent@example.com"],
+                "content": "Please find in attachment.\n", "file_paths": file_paths,
+                "documents": [{"name": f"Dupont Jean - {key}.pdf", "content": b'%PDF-1.4'}]}
+
+    def jobs(self) -> list:
+        with closing(outbox._connect()) as connection:
+            return [(json.loads(row['mission_keys']), json.loads(row['file_paths']))
+                    for row in connection.execute("SELECT mission_keys, file_paths FROM jobs ORDER BY id")]
+
+    def test_email_with_a_missing_attachment_is_reported_and_the_others_enqueued(self):
+        path = os.path.join(self.directory, "plan.pdf")
+        with open(path, 'wb') as file:
+            file.write(b'%PDF-1.4')
+
+        _, errors = outbox.enqueue([self.message("1", [path]),
+                                    self.message("2", [os.path.join(self.directory, "deleted.pdf")]),
+                                    self.message("3", [])])
+
+        self.assertEqual(list(errors), ["2"])
+        self.assertIn("deleted.pdf", errors["2"])
+        self.assertEqual([keys for keys, _ in self.jobs()], [["1"], ["3"]])
+        self.assertEqual([os.path.basename(path) for path in self.jobs()[0][1]], ["plan.pdf", "Dupont Jean - 1.pdf"])
+
+    def test_email_whose_attachments_cannot_be_copied_is_dropped(self):
+        with mock.patch.object(outbox.shutil, 'copyfile', side_effect=PermissionError("denied")):
+            _, errors = outbox.enqueue([self.message("1", [__file__])])
+
+        self.assertIn("denied", errors["1"])
+        self.assertEqual(self.jobs(), [])
+        self.assertEqual(os.listdir(outbox.get_spool_dir()), [])
+
+if __name__ == '__main__':
+    unittest.main()